@@ -0,0 +1,116 @@
+"""
+Compares the connection profiles of bijidb/profiles.py: the batch writer
+with small batches, so that the time of the commits shows, lookups, and
+the latency of a reader on another connection while the writer runs.
+
+    python -m bijibiji.bijibench.compare_profiles --files 20000 --batch 100
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from ..bijidb.bijidatabase import BijiDatabase
+from .compare_schemas import make_bijis, timeit
+
+# The profiles of the writer, read-only is measured as a reader.
+WRITERS = ['legacy', 'interactive', 'bulk-load']
+
+
+def read_while_writing(db_path: str, profile: str,
+                       done: threading.Event, result: dict) -> None:
+    """ The latency of a reader, like the GUI, during the writes. """
+    db = BijiDatabase.new_connection(db_path, profile)
+    latencies = []
+    errors = 0
+    while not done.is_set():
+        start = time.perf_counter()
+        try:
+            db.get_tag_rows()
+        except sqlite3.OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+    db.close_db()
+    result.update(reads=len(latencies),
+                  read_max=max(latencies, default=0),
+                  read_errors=errors)
+
+
+def measure(bijis: List[dict], profile: str, batch: int,
+            folder: str) -> Dict[str, float]:
+    db_path = os.path.join(folder, f'{profile}.db')
+    BijiDatabase.create_db(db_path)
+    db = BijiDatabase.new_connection(db_path, profile)
+
+    rand = random.Random(1)
+    sample = [biji['filepath'] for biji in rand.sample(bijis, 200)]
+    outdated = [dict(biji, tags=biji['tags'][1:])
+                for biji in rand.sample(bijis, len(bijis) // 10)]
+
+    result = dict(insert=timeit(lambda: db.insert_bijis(bijis, batch)))
+
+    # The reader of a WAL database is read-only, a reader of the
+    # rollback journal has to be legacy too.
+    reader_profile = 'legacy' if profile == 'legacy' else 'read-only'
+    done = threading.Event()
+    reader: dict = {}
+    thread = threading.Thread(
+        target=read_while_writing,
+        args=(db_path, reader_profile, done, reader))
+    thread.start()
+    result['update'] = timeit(lambda: db.update_bijis(outdated, batch))
+    done.set()
+    thread.join()
+    result.update(reader)
+
+    result.update(
+        get_tags=timeit(lambda: [db.get_tags(f) for f in sample]),
+        tag_rows=timeit(db.get_tag_rows, 10),
+    )
+    db.close_db()
+
+    reader = BijiDatabase.new_connection(db_path, 'read-only')
+    result['read_only_get_tags'] = timeit(
+        lambda: [reader.get_tags(f) for f in sample])
+    reader.close_db()
+    return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Compares the connection profiles.')
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--tags-per-file', type=int, default=5)
+    parser.add_argument('--batch', type=int, default=100,
+                        help='records per transaction')
+    parser.add_argument('--folder', default=None,
+                        help='a folder on the disk to measure, '
+                             'defaults to the temp folder')
+    args = parser.parse_args()
+
+    bijis = make_bijis(args.files, args.tags, args.tags_per_file)
+    with tempfile.TemporaryDirectory(dir=args.folder) as folder:
+        results = {profile: measure(bijis, profile, args.batch, folder)
+                   for profile in WRITERS}
+
+    print(f'{args.files} files, {args.batch} records per transaction')
+    print(f'{"":<24}' + ''.join(f'{profile:>14}' for profile in WRITERS))
+    for key in results[WRITERS[0]]:
+        line = f'{key:<24}' if key in ('reads', 'read_errors') \
+            else f'{key + " (ms)":<24}'
+        for profile in WRITERS:
+            value = results[profile][key]
+            line += f'{value:>14}' if key in ('reads', 'read_errors') \
+                else f'{value * 1000:>14.2f}'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
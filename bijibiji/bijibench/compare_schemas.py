@@ -0,0 +1,108 @@
+"""
+Compares the default schema with the compact schema on the same synthetic
+records: the size of the database file, and the time of the batch writer
+and of the lookups used by the GUI.
+
+    python -m bijibiji.bijibench.compare_schemas --files 20000 --tags 200
+"""
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from ..bijidb.bijidatabase import BijiDatabase
+
+
+def make_bijis(files: int, tags: int, tags_per_file: int,
+               seed: int = 0) -> List[dict]:
+    """ Records in a tree of about sqrt(files) directories. """
+    rand = random.Random(seed)
+    tag_names = [f'tag-{i}' for i in range(tags)]
+    dirs = [os.path.join('Documents', f'project-{i // 10}', f'folder-{i}')
+            for i in range(max(1, int(files ** 0.5)))]
+    bijis = []
+    for i in range(files):
+        filename = f'file-{i}.txt'
+        bijis.append(dict(
+            filepath=os.path.join(rand.choice(dirs), filename),
+            filename=filename,
+            suffix='.txt',
+            mimetype='text/plain',
+            filesize=rand.randrange(1 << 20),
+            updatedAt='2020-01-01T00:00:00',
+            backupAt='',
+            bijiCTime='2020-01-01T00:00:00',
+            bijiMTime='2020-01-01T00:00:00',
+            tags=rand.sample(tag_names, min(tags_per_file, tags)),
+        ))
+    return bijis
+
+
+def timeit(func: Callable, repeat: int = 1) -> float:
+    """ Returns the seconds of one call. """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def measure(bijis: List[dict], compact: bool, folder: str) -> Dict[str, float]:
+    db_path = os.path.join(folder, 'compact.db' if compact else 'default.db')
+    BijiDatabase.create_db(db_path, compact=compact)
+    db = BijiDatabase.new_connection(db_path)
+
+    rand = random.Random(1)
+    sample = [biji['filepath'] for biji in rand.sample(bijis, 200)]
+    tag = bijis[0]['tags'][0]
+    expression = ' AND '.join(bijis[0]['tags'][:2])
+    outdated = [dict(biji, tags=biji['tags'][1:])
+                for biji in rand.sample(bijis, len(bijis) // 10)]
+
+    result = dict(
+        insert=timeit(lambda: db.insert_bijis(bijis)),
+        update=timeit(lambda: db.update_bijis(outdated)),
+        get_tags=timeit(lambda: [db.get_tags(f) for f in sample]),
+        get_mtime=timeit(lambda: [db.get_mtime(f) for f in sample]),
+        get_bijis=timeit(lambda: db.get_bijis(tag), 10),
+        query=timeit(lambda: list(db.query_bijis(expression)), 10),
+        tags_by_count=timeit(db.get_tags_order_by_count, 10),
+        all_mtimes=timeit(db.get_all_mtimes, 10),
+        delete=timeit(lambda: db.delete_bijis(sample)),
+    )
+    db.db.execute('VACUUM')
+    db.close_db()
+    result['size'] = os.path.getsize(db_path)
+    return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Compares the default schema with the compact schema.')
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--tags-per-file', type=int, default=5)
+    args = parser.parse_args()
+
+    bijis = make_bijis(args.files, args.tags, args.tags_per_file)
+    with tempfile.TemporaryDirectory() as folder:
+        default = measure(bijis, False, folder)
+        compact = measure(bijis, True, folder)
+
+    print(f'{args.files} files, {args.tags} tags, '
+          f'{args.tags_per_file} tags per file')
+    print(f'{"":<20}{"default":>12}{"compact":>12}{"ratio":>8}')
+    for key in default:
+        ratio = compact[key] / default[key] if default[key] else 0
+        if key == 'size':
+            print(f'{"size (KiB)":<20}{default[key] / 1024:>12.0f}'
+                  f'{compact[key] / 1024:>12.0f}{ratio:>8.2f}')
+        else:
+            print(f'{key + " (ms)":<20}{default[key] * 1000:>12.2f}'
+                  f'{compact[key] * 1000:>12.2f}{ratio:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Times the scanner and the tag operations on synthetic HOME folders of
+several sizes, see synthetic_home.py, and writes the results to JSON.
+
+    python -m bijibiji.bijibench.run_benchmarks --sizes 1000 10000 \
+        --output after.json --baseline before.json
+
+With --baseline, the times are also printed as ratios to the baseline,
+a ratio below 1 is a speedup.
+"""
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from .. import DB_NAME
+from ..bijidb.bijidatabase import BijiDatabase
+from ..bijiscan.bijiscanner import biji_json_not_exists, scan_all, \
+    scan_all_and_update_db
+from ..bijitags import bulk_tags
+from ..bijitags.biji import Biji
+from .synthetic_home import make_home
+
+# Number of files tagged by update_tags_for_files.
+TAGGED_FILES = 100
+
+# seconds of each benchmark, by the number of files.
+Results = Dict[str, Dict[str, float]]
+
+
+def timeit(func: Callable) -> float:
+    """ Returns the seconds of one call, the output is discarded. """
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+
+def run(files: int, args) -> Dict[str, float]:
+    """ The benchmarks in the order they run, each one on a new HOME. """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as home:
+        filepaths = make_home(home, files, args.depth, args.tags,
+                              args.tags_per_file, args.zipf)
+        os.chdir(home)
+        db = BijiDatabase
+        try:
+            db.create_db(DB_NAME, compact=args.compact)
+            db.connect_db(DB_NAME)
+            rand = random.Random(0)
+            tagged = rand.sample(filepaths, min(TAGGED_FILES, files))
+            # The most frequent tag of the Zipf distribution.
+            common_tag = 'tag-0'
+
+            result = dict(
+                scan_all=timeit(lambda: scan_all(db, jobs=args.jobs)),
+                scan_all_and_update_db=timeit(
+                    lambda: scan_all_and_update_db(db, jobs=args.jobs)),
+                rescan=timeit(
+                    lambda: scan_all_and_update_db(db, jobs=args.jobs)),
+                update_tags_for_files=timeit(
+                    lambda: Biji.update_tags_for_files(
+                        set(tagged), set(), {'benchmark'})),
+                rename_tag=timeit(
+                    lambda: bulk_tags.rename_tag(
+                        db, common_tag, 'renamed', jobs=args.jobs)),
+                get_tags_order_by_count=timeit(
+                    db.get_tags_order_by_count),
+                biji_json_not_exists=timeit(lambda: biji_json_not_exists(db)),
+            )
+        finally:
+            db.close_db()
+            os.chdir(cwd)
+    return result
+
+
+def print_results(results: Results, baseline: Optional[Results]) -> None:
+    sizes = list(results)
+    names = list(results[sizes[0]])
+    print(f'{"seconds":<26}' + ''.join(f'{size:>12}' for size in sizes))
+    for name in names:
+        line = f'{name:<26}'
+        for size in sizes:
+            line += f'{results[size][name]:>12.3f}'
+        print(line)
+        if baseline is None:
+            continue
+        line = f'{"  / baseline":<26}'
+        for size in sizes:
+            before = baseline.get(size, {}).get(name)
+            line += f'{results[size][name] / before:>12.2f}' \
+                if before else f'{"-":>12}'
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Times the scanner and the tag operations.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000],
+                        help='numbers of files')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--tags', type=int, default=500)
+    parser.add_argument('--tags-per-file', type=int, default=5)
+    parser.add_argument('--zipf', type=float, default=1.0)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--compact', action='store_true',
+                        help='use the compact schema')
+    parser.add_argument('--output', default=None,
+                        help='writes the results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='a JSON file written by --output')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    # The keys are strings, the same as in a JSON file.
+    results: Results = {str(size): run(size, args) for size in args.sizes}
+    print_results(results, baseline)
+
+    if args.output:
+        report = dict(
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            options={key: value for key, value in vars(args).items()
+                     if key not in ('output', 'baseline')},
+            results=results,
+        )
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
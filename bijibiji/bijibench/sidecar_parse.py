@@ -0,0 +1,81 @@
+"""
+Time to read bijiMTime from '.biji.json' files, see read_biji_mtime() in
+bijiscan/scan_engine.py.
+
+    python -m bijibiji.bijibench.sidecar_parse --files 2000 --tags 5 100 1000
+
+    full        json.load of the whole file, as the scanner used to do
+    header      read_biji_mtime, bijiMTime from the first bytes of the file
+"""
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from ..bijiscan.scan_engine import BIJI_JSON_SUFFIX, read_biji_mtime
+
+
+def make_files(folder: str, files: int, tags: int) -> List[str]:
+    """ Writes '.biji.json' files like Biji._asjson() does. """
+    now = datetime.now().isoformat()
+    result = []
+    for i in range(files):
+        path = os.path.join(folder, f'file-{i}.jpg')
+        biji_dict = dict(filepath=path,
+                         filename=f'file-{i}.jpg',
+                         suffix='.jpg',
+                         mimetype='image/jpeg',
+                         filesize=1024,
+                         updatedAt=now,
+                         backupAt='',
+                         bijiCTime=now,
+                         bijiMTime=now,
+                         tags=[f'tag-{j}' for j in range(tags)])
+        with open(path + BIJI_JSON_SUFFIX, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(biji_dict, sort_keys=True, ensure_ascii=False))
+        result.append(path)
+    return result
+
+
+def full(filepath: str) -> str:
+    with open(filepath + BIJI_JSON_SUFFIX, encoding='utf-8') as f:
+        return json.load(f)['bijiMTime']
+
+
+MODES: List[Tuple[str, Callable[[str], str]]] = [
+    ('full', full),
+    ('header', read_biji_mtime),
+]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Time to read bijiMTime from '.biji.json' files.")
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--tags', type=int, nargs='+', default=[5, 100, 1000],
+                        help='numbers of tags per file')
+    args = parser.parse_args()
+
+    print(f'{args.files} files')
+    print(f'{"tags":>6}{"bytes":>10}'
+          + ''.join(f'{name + " files/s":>16}' for name, _ in MODES))
+    for tags in args.tags:
+        with tempfile.TemporaryDirectory() as folder:
+            files = make_files(folder, args.files, tags)
+            size = os.path.getsize(files[0] + BIJI_JSON_SUFFIX)
+            line = f'{tags:>6}{size:>10}'
+            for name, read in MODES:
+                start = time.perf_counter()
+                for file in files:
+                    read(file)
+                seconds = time.perf_counter() - start
+                line += f'{args.files / seconds:>16.0f}'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Throughput of the ways to write '.biji.json' files, see bijitags/sidecar.py.
+
+    python -m bijibiji.bijibench.sidecar_writer --files 2000 --dirs 20
+
+    in-place    Path.write_text, not atomic
+    atomic      write_sidecar, one fsync per file and per directory
+    safe        SidecarWriter, one fsync per file, one per directory per batch
+    fast        SidecarWriter(safe=False), no fsync
+"""
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from ..bijitags.sidecar import SidecarWriter, write_sidecar
+
+
+def make_files(folder: str, files: int, dirs: int) -> List[Tuple[str, str]]:
+    """ (path, text) of the '.biji.json' files, spread over dirs. """
+    result = []
+    for i in range(dirs):
+        os.makedirs(os.path.join(folder, f'dir-{i}'))
+    for i in range(files):
+        path = os.path.join(folder, f'dir-{i % dirs}', f'file-{i}.biji.json')
+        text = json.dumps(dict(filepath=path, tags=['tag-1', 'tag-2']))
+        result.append((path, text))
+    return result
+
+
+def in_place(files: List[Tuple[str, str]]) -> None:
+    for path, text in files:
+        Path(path).write_text(text, encoding='utf-8')
+
+
+def atomic(files: List[Tuple[str, str]]) -> None:
+    for path, text in files:
+        write_sidecar(path, text)
+
+
+def safe(files: List[Tuple[str, str]]) -> None:
+    with SidecarWriter() as writer:
+        for path, text in files:
+            writer.write(path, text)
+
+
+def fast(files: List[Tuple[str, str]]) -> None:
+    with SidecarWriter(safe=False) as writer:
+        for path, text in files:
+            writer.write(path, text)
+
+
+MODES: List[Tuple[str, Callable]] = [
+    ('in-place', in_place),
+    ('atomic', atomic),
+    ('safe', safe),
+    ('fast', fast),
+]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Throughput of the '.biji.json' writers.")
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--dirs', type=int, default=20)
+    parser.add_argument('--folder', default=None,
+                        help='a folder on the disk to measure, '
+                             'defaults to the temp folder')
+    args = parser.parse_args()
+
+    print(f'{args.files} files in {args.dirs} directories')
+    print(f'{"":<12}{"seconds":>10}{"files/s":>12}')
+    for name, write in MODES:
+        with tempfile.TemporaryDirectory(dir=args.folder) as folder:
+            files = make_files(folder, args.files, args.dirs)
+            start = time.perf_counter()
+            write(files)
+            seconds = time.perf_counter() - start
+        print(f'{name:<12}{seconds:>10.3f}{args.files / seconds:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Builds a synthetic HOME folder: small files with their '.biji.json' files
+in a tree of directories, with tags drawn from a Zipf distribution, so
+that a few tags are on most files and most tags are on a few files.
+
+    python -m bijibiji.bijibench.synthetic_home --files 10000 --depth 3
+
+The folder defaults to TESTING_FILES_FOLDER ('unittesting_mock'), which is
+the HOME of change_cwd(testing=True). The database is not created, scan it
+with 'python -m bijibiji.bijiscan.scan_all_and_update' in that folder.
+"""
+import itertools
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+from .. import TESTING_FILES_FOLDER
+from ..bijitags.sidecar import SidecarWriter
+
+# Number of subdirectories of a directory.
+FAN_OUT = 8
+
+SUFFIXES = [('.txt', 'text/plain'),
+            ('.jpg', 'image/jpeg'),
+            ('.pdf', 'application/pdf'),
+            ('.md', None)]
+
+
+def zipf_weights(n: int, exponent: float) -> List[float]:
+    """ The cumulative weights of the ranks 1..n. """
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def make_dirs(files: int, depth: int) -> List[str]:
+    """ The leaf directories, about FAN_OUT ** depth of them at most. """
+    leaves = max(1, min(files // 10, FAN_OUT ** depth))
+    dirs = []
+    for i in range(leaves):
+        parts = []
+        for level in range(depth):
+            parts.append(f'dir-{level}-{i // FAN_OUT ** level % FAN_OUT}')
+        dirs.append(os.path.join(*parts) if parts else '')
+    return dirs
+
+
+def make_home(folder: str,
+              files: int,
+              depth: int = 3,
+              tags: int = 500,
+              tags_per_file: int = 5,
+              exponent: float = 1.0,
+              seed: int = 0) -> List[str]:
+    """
+    Creates the files under folder, returns their paths relative to it.
+    folder must not exist, or be empty.
+    """
+    os.makedirs(folder, exist_ok=True)
+    if os.listdir(folder):
+        raise FileExistsError(f'The folder is not empty: {folder}')
+
+    rand = random.Random(seed)
+    tag_names = [f'tag-{i}' for i in range(tags)]
+    cum_weights = zipf_weights(tags, exponent)
+    tags_per_file = min(tags_per_file, tags)
+    dirs = make_dirs(files, depth)
+    for directory in dirs:
+        os.makedirs(os.path.join(folder, directory), exist_ok=True)
+
+    start = datetime(2020, 1, 1)
+    filepaths = []
+    with SidecarWriter(safe=False) as writer:
+        for i in range(files):
+            suffix, mimetype = SUFFIXES[i % len(SUFFIXES)]
+            filename = f'file-{i}{suffix}'
+            filepath = os.path.join(dirs[i % len(dirs)], filename)
+            content = b'x' * rand.randrange(1, 4096)
+            with open(os.path.join(folder, filepath), 'wb') as f:
+                f.write(content)
+
+            file_tags = set()
+            while len(file_tags) < tags_per_file:
+                file_tags.update(rand.choices(
+                    tag_names, cum_weights=cum_weights,
+                    k=tags_per_file - len(file_tags)))
+
+            time = (start + timedelta(seconds=i)).isoformat()
+            biji_dict = dict(filepath=filepath,
+                             filename=filename,
+                             suffix=suffix,
+                             mimetype=mimetype,
+                             filesize=len(content),
+                             updatedAt=time,
+                             backupAt='',
+                             bijiCTime=time,
+                             bijiMTime=time,
+                             tags=sorted(file_tags))
+            writer.write(
+                os.path.join(folder, f'{filepath}.biji.json'),
+                json.dumps(biji_dict, sort_keys=True, ensure_ascii=False))
+            filepaths.append(filepath)
+    return filepaths
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Builds a synthetic HOME folder.')
+    parser.add_argument('--folder', default=str(TESTING_FILES_FOLDER))
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--tags', type=int, default=500)
+    parser.add_argument('--tags-per-file', type=int, default=5)
+    parser.add_argument('--zipf', type=float, default=1.0,
+                        help='the exponent of the Zipf distribution')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    filepaths = make_home(args.folder, args.files, args.depth, args.tags,
+                          args.tags_per_file, args.zipf, args.seed)
+    print(f'{len(filepaths)} files in {args.folder}')
+
+
+if __name__ == '__main__':
+    main()
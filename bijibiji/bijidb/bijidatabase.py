@@ -1,10 +1,24 @@
+import os
 import sqlite3
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice, permutations
 from pathlib import Path
-from typing import Set, List, Tuple
+from typing import Set, List, Tuple, Dict, Iterable, Iterator, Optional
 
-from .. import DB_NAME
+from .. import DB_NAME, config, instrument
+from . import compact_schema, fts, profiles, tag_query
+from .migrations import MIGRATIONS, REBUILD_TAG_PAIRS, migrate, \
+    needs_migration
 
+# Number of records written in one transaction by the batch writer.
+BATCH_SIZE = 1000
+
+# Keeps the number of '?' in a statement below SQLITE_MAX_VARIABLE_NUMBER.
+MAX_VARIABLES = 500
+
+# The schema of version 0, later changes are in migrations.py.
 CREATE_TABLES = """
     CREATE TABLE bijis (
         filepath    text        PRIMARY KEY COLLATE NOCASE,
@@ -69,8 +83,12 @@ INSERT_INTO_TAGS = """
     INSERT INTO tags (tag, usedAt) VALUES (:tag, :usedAt)
     """
 
+INSERT_OR_IGNORE_INTO_TAGS = """
+    INSERT OR IGNORE INTO tags (tag, usedAt) VALUES (:tag, :usedAt)
+    """
+
 INSERT_INTO_TAG_BIJI = """
-    INSERT INTO tag_biji (tag, filepath) VALUES (:tag, :filepath)
+    INSERT OR IGNORE INTO tag_biji (tag, filepath) VALUES (:tag, :filepath)
     """
 
 UPDATE_BIJI = """
@@ -93,6 +111,10 @@ UNLINK_TAG = """
     DELETE FROM tag_biji WHERE tag = :tag and filepath = :filepath
     """
 
+UNLINK_ALL_TAGS = """
+    DELETE FROM tag_biji WHERE filepath = :filepath
+    """
+
 UPDATE_TAG = """
     UPDATE tags SET tag = :new WHERE tag = :old
     """
@@ -109,12 +131,86 @@ GET_TAGS = """
     SELECT tag FROM tag_biji WHERE filepath = :filepath
     """
 
+GET_TAGS_OF_FILES = """
+    SELECT DISTINCT tag FROM tag_biji WHERE filepath IN (VALUES {})
+    """
+
 GET_BIJIS = """
     SELECT filepath FROM tag_biji WHERE tag = :tag
     """
 
+# tags.count is kept by the triggers of migrations.TAG_COUNTS.
 GET_TAGS_ORDER_BY_COUNT = """
-    SELECT tag, COUNT(*) AS count FROM tag_biji GROUP BY tag ORDER BY count
+    SELECT tag, count FROM tags WHERE count > 0 ORDER BY count
+    """
+
+GET_TAG_ROWS = """
+    SELECT tag, count, usedAt FROM tags
+    """
+
+GET_TAG_PAIRS = """
+    SELECT tag_b, tag_pairs.count AS pairs, tags.count AS count
+    FROM tag_pairs JOIN tags ON tags.tag = tag_pairs.tag_b
+    WHERE tag_a = :tag
+    ORDER BY tag_pairs.count DESC LIMIT :limit
+    """
+
+# The tags of each of the files, the first column identifies a file.
+GET_FILE_TAGS = """
+    SELECT filepath, tag FROM tag_biji WHERE filepath IN (VALUES {})
+    """
+
+# The changes of tag_pairs made by BijiDatabase._count_tag_pairs(), a new
+# pair starts from 0.
+ADD_TO_TAG_PAIR = """
+    INSERT OR REPLACE INTO tag_pairs (tag_a, tag_b, count)
+    VALUES (:tag_a, :tag_b, coalesce((
+        SELECT count FROM tag_pairs WHERE tag_a = :tag_a AND tag_b = :tag_b
+    ), 0) + :count)
+    """
+
+DELETE_EMPTY_TAG_PAIR = """
+    DELETE FROM tag_pairs
+    WHERE tag_a = :tag_a AND tag_b = :tag_b AND count <= 0
+    """
+
+GET_TAG_ROWS_OF = """
+    SELECT tag, count, usedAt FROM tags WHERE tag IN (VALUES {})
+    """
+
+# The orders of the tag rows by a column then the tag, formatted into the
+# GET_TAG_ROWS_* queries: column, the comparison of the rows after a row,
+# of the rows up to a row, and the direction.
+TAG_ROW_ORDERS = {
+    'tag': dict(column='tag', after='>', up_to='<', direction='ASC'),
+    'count': dict(column='count', after='>', up_to='<', direction='ASC'),
+    'usedAt': dict(column='usedAt', after='<', up_to='>', direction='DESC'),
+}
+
+# Pages of the tags in an order of TAG_ROW_ORDERS, the first page, then
+# the page after the row (:value, :tag) by the index of the column.
+GET_TAG_ROWS_FIRST_PAGE = """
+    SELECT tag, count, usedAt FROM tags
+    ORDER BY {column} {direction}, tag {direction} LIMIT :limit
+    """
+
+GET_TAG_ROWS_PAGE = """
+    SELECT tag, count, usedAt FROM tags
+    WHERE {column} {after}= :value
+      AND ({column} {after} :value OR tag {after} :tag)
+    ORDER BY {column} {direction}, tag {direction} LIMIT :limit
+    """
+
+GET_TAG_ROWS_UP_TO = """
+    SELECT tag, count, usedAt FROM tags
+    WHERE {column} {up_to}= :value
+      AND ({column} {up_to} :value OR tag {up_to}= :tag)
+    ORDER BY {column} {direction}, tag {direction}
+    """
+
+GET_BIJIS_PAGE = """
+    SELECT filepath FROM tag_biji WHERE tag = :tag
+    ORDER BY filepath LIMIT :limit OFFSET :offset
     """
 
 GET_TAGS_ORDER_BY_TAG = """
@@ -131,9 +227,22 @@ GET_TAGS_ORDER_BY_TIME = """
 #     GROUP BY tag_biji.tag ORDER BY usedAt DESC
 #     """
 
-GET_TAGS_NOT_USED = tags_by_count = """
-    SELECT tags.tag AS tag FROM tags LEFT OUTER JOIN tag_biji 
-    ON tags.tag = tag_biji.tag WHERE tag_biji.tag is NULL
+GET_TAGS_NOT_USED = """
+    SELECT tag FROM tags WHERE count = 0
+    """
+
+# Tags whose count is not the number of their rows in tag_biji.
+GET_WRONG_TAG_COUNTS = """
+    SELECT tag, count, actual FROM (
+        SELECT tag, count, (
+            SELECT COUNT(*) FROM tag_biji WHERE tag_biji.tag = tags.tag
+        ) AS actual FROM tags
+    ) WHERE count <> actual
+    """
+
+UPDATE_TAG_COUNTS = """
+    UPDATE tags SET count =
+        (SELECT COUNT(*) FROM tag_biji WHERE tag_biji.tag = tags.tag)
     """
 
 GET_ALL_TAGS_DESC = """
@@ -144,6 +253,10 @@ GET_MTIME = """
     SELECT bijiMTime FROM bijis WHERE filepath = :filepath
     """
 
+GET_ALL_MTIMES = """
+    SELECT filepath, bijiMTime FROM bijis
+    """
+
 GET_TAG_ATIME = """
     SELECT usedAt FROM tags WHERE tag = :tag
     """
@@ -156,33 +269,302 @@ DELETE_BIJI = """
     DELETE FROM bijis WHERE filepath = :filepath
     """
 
+# A record moved onto another one replaces it,
+# the NOCASE comparison keeps a record renamed only in case.
+DELETE_RENAME_TARGET = """
+    DELETE FROM bijis WHERE filepath = :new AND filepath <> :old
+    """
+
+UPDATE_FILEPATH = """
+    UPDATE bijis SET filepath = :new, filename = :filename
+    WHERE filepath = :old
+    """
+
+# The statements of a rename, tag_biji follows by ON UPDATE CASCADE.
+RENAME_BIJI = [DELETE_RENAME_TARGET, UPDATE_FILEPATH]
+
+GET_BIJI_JSON_STATS = """
+    SELECT filepath, mtime_ns, size, inode, bijiMTime FROM biji_json_stats
+    """
+
+REPLACE_BIJI_JSON_STAT = """
+    INSERT OR REPLACE INTO biji_json_stats (
+        filepath, mtime_ns, size, inode, bijiMTime
+    ) VALUES (?, ?, ?, ?, ?)
+    """
+
+DELETE_BIJI_JSON_STAT = """
+    DELETE FROM biji_json_stats WHERE filepath = ?
+    """
+
+GET_FINGERPRINTS = """
+    SELECT filepath, size, inode, hash, mtime_ns FROM fingerprints
+    """
+
+# Nothing is saved for a filepath without a record.
+REPLACE_FINGERPRINT = """
+    INSERT OR REPLACE INTO fingerprints (
+        filepath, size, inode, hash, mtime_ns
+    )
+    SELECT filepath, :size, :inode, :hash, :mtime_ns FROM bijis
+    WHERE filepath = :filepath
+    """
+
+
+class Statements:
+    """
+    The SQL of the default schema, BijiDatabase.sql is this class or
+    CompactStatements, depending on the database.
+    """
+    MIGRATIONS = MIGRATIONS
+    QUERY = tag_query.QueryStatements
+    FTS = fts.FtsStatements
+
+    CREATE_TABLES = CREATE_TABLES
+    INSERT_INTO_BIJIS = INSERT_INTO_BIJIS
+    INSERT_INTO_TAGS = INSERT_INTO_TAGS
+    INSERT_OR_IGNORE_INTO_TAGS = INSERT_OR_IGNORE_INTO_TAGS
+    INSERT_INTO_TAG_BIJI = INSERT_INTO_TAG_BIJI
+    UPDATE_BIJI = UPDATE_BIJI
+    DELETE_TAG = DELETE_TAG
+    UNLINK_TAG = UNLINK_TAG
+    UNLINK_ALL_TAGS = UNLINK_ALL_TAGS
+    UPDATE_TAG = UPDATE_TAG
+    UPDATE_TAG_TIME = UPDATE_TAG_TIME
+    UPDATE_BIJI_MTIME = UPDATE_BIJI_MTIME
+    GET_TAGS = GET_TAGS
+    GET_TAGS_OF_FILES = GET_TAGS_OF_FILES
+    GET_BIJIS = GET_BIJIS
+    GET_TAGS_ORDER_BY_COUNT = GET_TAGS_ORDER_BY_COUNT
+    GET_TAGS_ORDER_BY_TAG = GET_TAGS_ORDER_BY_TAG
+    GET_TAG_ROWS = GET_TAG_ROWS
+    GET_TAG_ROWS_OF = GET_TAG_ROWS_OF
+    GET_TAG_ROWS_FIRST_PAGE = GET_TAG_ROWS_FIRST_PAGE
+    GET_TAG_ROWS_PAGE = GET_TAG_ROWS_PAGE
+    GET_TAG_ROWS_UP_TO = GET_TAG_ROWS_UP_TO
+    GET_TAG_PAIRS = GET_TAG_PAIRS
+    REBUILD_TAG_PAIRS = REBUILD_TAG_PAIRS
+    GET_FILE_TAGS = GET_FILE_TAGS
+    ADD_TO_TAG_PAIR = ADD_TO_TAG_PAIR
+    DELETE_EMPTY_TAG_PAIR = DELETE_EMPTY_TAG_PAIR
+    GET_BIJIS_PAGE = GET_BIJIS_PAGE
+    GET_TAGS_ORDER_BY_TIME = GET_TAGS_ORDER_BY_TIME
+    GET_TAGS_NOT_USED = GET_TAGS_NOT_USED
+    GET_WRONG_TAG_COUNTS = GET_WRONG_TAG_COUNTS
+    UPDATE_TAG_COUNTS = UPDATE_TAG_COUNTS
+    GET_ALL_TAGS_DESC = GET_ALL_TAGS_DESC
+    GET_MTIME = GET_MTIME
+    GET_ALL_MTIMES = GET_ALL_MTIMES
+    GET_TAG_ATIME = GET_TAG_ATIME
+    GET_ALL_FILEPATHS = GET_ALL_FILEPATHS
+    DELETE_BIJI = DELETE_BIJI
+    RENAME_BIJI = RENAME_BIJI
+    GET_BIJI_JSON_STATS = GET_BIJI_JSON_STATS
+    REPLACE_BIJI_JSON_STAT = REPLACE_BIJI_JSON_STAT
+    DELETE_BIJI_JSON_STAT = DELETE_BIJI_JSON_STAT
+    GET_FINGERPRINTS = GET_FINGERPRINTS
+    REPLACE_FINGERPRINT = REPLACE_FINGERPRINT
+
+
+class CompactStatements(Statements):
+    """ The SQL of the compact schema, see compact_schema.py. """
+    MIGRATIONS = compact_schema.MIGRATIONS
+    QUERY = compact_schema.CompactQueryStatements
+    FTS = compact_schema.CompactFtsStatements
+
+    CREATE_TABLES = compact_schema.CREATE_TABLES
+    INSERT_INTO_TAG_BIJI = compact_schema.INSERT_INTO_TAG_BIJI
+    UPDATE_BIJI = compact_schema.UPDATE_BIJI
+    UNLINK_TAG = compact_schema.UNLINK_TAG
+    UNLINK_ALL_TAGS = compact_schema.UNLINK_ALL_TAGS
+    UPDATE_BIJI_MTIME = compact_schema.UPDATE_BIJI_MTIME
+    GET_TAGS = compact_schema.GET_TAGS
+    GET_TAGS_OF_FILES = compact_schema.GET_TAGS_OF_FILES
+    GET_BIJIS = compact_schema.GET_BIJIS
+    GET_BIJIS_PAGE = compact_schema.GET_BIJIS_PAGE
+    GET_WRONG_TAG_COUNTS = compact_schema.GET_WRONG_TAG_COUNTS
+    UPDATE_TAG_COUNTS = compact_schema.UPDATE_TAG_COUNTS
+    GET_TAG_PAIRS = compact_schema.GET_TAG_PAIRS
+    REBUILD_TAG_PAIRS = compact_schema.REBUILD_TAG_PAIRS
+    GET_FILE_TAGS = compact_schema.GET_FILE_TAGS
+    ADD_TO_TAG_PAIR = compact_schema.ADD_TO_TAG_PAIR
+    DELETE_EMPTY_TAG_PAIR = compact_schema.DELETE_EMPTY_TAG_PAIR
+    GET_MTIME = compact_schema.GET_MTIME
+    DELETE_BIJI = compact_schema.DELETE_BIJI
+    RENAME_BIJI = compact_schema.RENAME_BIJI
+    GET_FINGERPRINTS = compact_schema.GET_FINGERPRINTS
+    REPLACE_FINGERPRINT = compact_schema.REPLACE_FINGERPRINT
+
+
+def get_statements(conn: sqlite3.Connection) -> type(Statements):
+    """ Tells the schema of a database by its application_id. """
+    application_id = conn.execute('PRAGMA application_id').fetchone()[0]
+    if application_id == compact_schema.COMPACT_APPLICATION_ID:
+        return CompactStatements
+    return Statements
+
+
+def _tags_by_file(bijis: List[dict]) -> Dict[str, Set[str]]:
+    """ The tags of bijis in the form of BijiDatabase.get_file_tags(). """
+    return {biji['filepath']: set(biji['tags']) for biji in bijis}
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
 
 class BijiDatabase:
+    """
+    All methods work on the connection of the class, which is opened once
+    per process by connect_db() or open_db() and shared by every caller.
+    Use new_connection() to get a copy of the class bound to a connection
+    of its own, e.g. in another thread.
+    """
 
-    db: sqlite3.Connection
+    db: Optional[sqlite3.Connection] = None
 
-    @staticmethod
-    def create_db() -> None:
-        db_path = Path(DB_NAME)
+    # Relative paths are relative to the cwd, which is the HOME folder.
+    db_path: str = os.environ.get('BIJIBIJI_DB', DB_NAME)
+
+    _connected_path: str = ''
+
+    # The SQL of the connected database, set by connect_db().
+    sql: type(Statements) = Statements
+
+    # Whether the database has the search table of fts, set by connect_db().
+    fts_enabled: bool = False
+
+    # The profile of the connection, set by connect_db() or set_profile().
+    profile: profiles.Profile = profiles.get_profile(None)
+
+    @classmethod
+    def create_db(cls,
+                  db_path: Optional[str] = None,
+                  compact: bool = False) -> None:
+        """ compact=True creates the schema in compact_schema.py. """
+        db_path = Path(db_path or cls.db_path)
 
         if db_path.exists():
             raise FileExistsError(f'The file exists: {db_path}')
 
-        conn = sqlite3.connect(DB_NAME)
-        conn.executescript(CREATE_TABLES)
+        statements = CompactStatements if compact else Statements
+        conn = sqlite3.connect(str(db_path))
+        conn.executescript(statements.CREATE_TABLES)
+        if compact:
+            conn.execute('PRAGMA application_id = '
+                         f'{compact_schema.COMPACT_APPLICATION_ID}')
+        migrate(conn, statements.MIGRATIONS)
+        if fts.fts_available(conn):
+            fts.create_fts(conn, statements.FTS)
         conn.commit()
         conn.close()
 
     @classmethod
-    def connect_db(cls) -> None:
-        db_path = Path(DB_NAME)
+    def connect_db(cls,
+                   db_path: Optional[str] = None,
+                   profile: Optional[str] = None) -> None:
+        """
+        Does nothing if the class is already connected to the same file,
+        otherwise closes the old connection before opening the new one.
+        profile is a name in profiles.PROFILES, defaults to the config.
+        """
+        db_path = Path(db_path or cls.db_path)
+        resolved_path = os.path.abspath(str(db_path))
+        profile = profiles.get_profile(profile or config.get('db_profile'))
+
+        if cls.is_connected():
+            if resolved_path == cls._connected_path:
+                return
+            cls.close_db()
 
         if not db_path.exists():
             raise FileNotFoundError(f'Not Found: {db_path}')
 
-        cls.db = sqlite3.connect(DB_NAME)
+        cls.db = sqlite3.connect(resolved_path,
+                                 factory=instrument.connection_factory())
         cls.db.row_factory = sqlite3.Row
         cls.db.execute('PRAGMA foreign_keys = ON')
+        # Before the upgrades, so that query_only refuses them.
+        cls.set_profile(profile.name)
+        cls.sql = get_statements(cls.db)
+        try:
+            if profile.query_only:
+                if needs_migration(cls.db, cls.sql.MIGRATIONS) \
+                        or fts.fts_outdated(cls.db):
+                    raise sqlite3.OperationalError(
+                        f'{db_path} needs an upgrade, which the '
+                        f'{profile.name} profile does not write, '
+                        f'open it with another profile first.')
+            else:
+                migrate(cls.db, cls.sql.MIGRATIONS)
+                if fts.fts_outdated(cls.db):
+                    fts.rebuild_fts(cls.db, cls.sql.FTS)
+        except BaseException:
+            cls.db.close()
+            cls.db = None
+            raise
+        cls.fts_enabled = fts.has_fts(cls.db)
+        cls.db_path = str(db_path)
+        cls._connected_path = resolved_path
+
+    @classmethod
+    def open_db(cls,
+                db_path: Optional[str] = None,
+                compact: bool = False,
+                profile: Optional[str] = None) -> None:
+        """
+        Connects to the database, creates it first if it doesn't exist,
+        compact only matters to a new database.
+        """
+        try:
+            cls.connect_db(db_path, profile)
+        except FileNotFoundError:
+            cls.create_db(db_path, compact)
+            cls.connect_db(db_path, profile)
+
+    @classmethod
+    def is_connected(cls) -> bool:
+        return cls.db is not None
+
+    @classmethod
+    @contextmanager
+    def connection(cls, db_path: Optional[str] = None):
+        """ with BijiDatabase.connection() as db: ... """
+        cls.open_db(db_path)
+        try:
+            yield cls
+        finally:
+            cls.close_db()
+
+    @classmethod
+    def new_connection(cls,
+                       db_path: Optional[str] = None,
+                       profile: Optional[str] = None):
+        """
+        Returns a subclass bound to a new connection of its own,
+        because a sqlite3 connection can't be shared between threads.
+        The profile defaults to the one of this class.
+        Call close_db() on the returned class when done.
+        """
+        bound = type(cls.__name__, (cls,), dict(db=None, _connected_path=''))
+        bound.connect_db(db_path or cls.db_path, profile or cls.profile.name)
+        return bound
+
+    @classmethod
+    def set_profile(cls, name: str) -> None:
+        """ Applies a profile of profiles.PROFILES to the connection. """
+        profile = profiles.get_profile(name)
+        profiles.apply_profile(cls.db, profile)
+        cls.profile = profile
+
+    @classmethod
+    def checkpoint(cls, mode: str = 'PASSIVE') -> Tuple[int, int, int]:
+        """ See profiles.checkpoint(). """
+        return profiles.checkpoint(cls.db, mode)
 
     @classmethod
     def commit(cls) -> None:
@@ -190,40 +572,204 @@ class BijiDatabase:
 
     @classmethod
     def close_db(cls) -> None:
-        cls.db.close()
+        if cls.db is not None:
+            if cls.profile.checkpoint_on_close:
+                try:
+                    cls.checkpoint('TRUNCATE')
+                except sqlite3.OperationalError:
+                    # Left to the next checkpoint.
+                    pass
+            cls.db.close()
+            cls.db = None
+            cls._connected_path = ''
 
     @classmethod
     def update_biji(cls, biji_dict) -> None:
-        cls.db.execute(UPDATE_BIJI, biji_dict)
+        cls.db.execute(cls.sql.UPDATE_BIJI, biji_dict)
 
     @classmethod
     def update_tag_time(cls, tag: str) -> None:
         used_at = datetime.now().isoformat()
-        cls.db.execute(UPDATE_TAG_TIME, dict(tag=tag, usedAt=used_at))
+        cls.db.execute(cls.sql.UPDATE_TAG_TIME,
+                       dict(tag=tag, usedAt=used_at))
 
     @classmethod
     def update_biji_mtime(cls, filepath: str, mtime: str) -> None:
-        cls.db.execute(UPDATE_BIJI_MTIME, dict(filepath=filepath,
-                                               bijiMTime=mtime))
+        cls.db.execute(cls.sql.UPDATE_BIJI_MTIME,
+                       dict(filepath=filepath, bijiMTime=mtime))
         cls.db.commit()
 
     @classmethod
     def unlink_tag(cls, tag: str, filepath: str) -> None:
-        cls.db.execute(UNLINK_TAG, dict(tag=tag, filepath=filepath))
+        old_tags = cls.get_file_tags([filepath])
+        cls.db.execute(cls.sql.UNLINK_TAG,
+                       dict(tag=tag, filepath=filepath))
+        cls._count_tag_pairs(old_tags, cls.get_file_tags([filepath]))
         cls.update_tag_time(tag)
+        cls._refresh_fts_tags([filepath])
 
     @classmethod
     def insert_to_tag_biji(cls, tag: str, filepath: str) -> None:
-        cls.db.execute(INSERT_INTO_TAG_BIJI, dict(tag=tag, filepath=filepath))
+        old_tags = cls.get_file_tags([filepath])
+        cls.db.execute(cls.sql.INSERT_INTO_TAG_BIJI,
+                       dict(tag=tag, filepath=filepath))
+        cls._count_tag_pairs(old_tags, cls.get_file_tags([filepath]))
         cls.update_tag_time(tag)
+        cls._refresh_fts_tags([filepath])
 
     @classmethod
     def insert_to_tags(cls, tags: Set[str]) -> None:
         """ Inserts into the 'tags' table, ignore if the tag exists. """
         used_at = datetime.now().isoformat()
-        for tag in tags:
-            if not cls.get_tag_atime(tag):
-                cls.db.execute(INSERT_INTO_TAGS, dict(tag=tag, usedAt=used_at))
+        cls.db.executemany(cls.sql.INSERT_OR_IGNORE_INTO_TAGS,
+                           (dict(tag=tag, usedAt=used_at) for tag in tags))
+
+    @classmethod
+    def insert_bijis(cls,
+                     bijis: Iterable[dict],
+                     batch_size: int = BATCH_SIZE) -> None:
+        """
+        Inserts new records and links their tags,
+        bijis are dicts as Biji._asdict() returns.
+        Commits once per batch_size records.
+        """
+        for batch in _batches(bijis, batch_size):
+            cls.db.executemany(cls.sql.INSERT_INTO_BIJIS, batch)
+            cls._link_tags(batch, set())
+            cls._count_tag_pairs({}, _tags_by_file(batch))
+            cls.db.commit()
+
+    @classmethod
+    def update_bijis(cls,
+                     bijis: Iterable[dict],
+                     batch_size: int = BATCH_SIZE) -> None:
+        """
+        Updates existing records and replaces their tags,
+        bijis are dicts as Biji._asdict() returns.
+        Commits once per batch_size records.
+        """
+        for batch in _batches(bijis, batch_size):
+            old_tags = cls.get_file_tags(
+                [biji['filepath'] for biji in batch])
+            cls.db.executemany(cls.sql.UPDATE_BIJI, batch)
+            cls.db.executemany(cls.sql.UNLINK_ALL_TAGS, batch)
+            cls._link_tags(batch, set().union(*old_tags.values()))
+            cls._count_tag_pairs(old_tags, _tags_by_file(batch))
+            cls.db.commit()
+
+    @classmethod
+    def delete_bijis(cls,
+                     filepaths: Iterable[str],
+                     batch_size: int = BATCH_SIZE) -> None:
+        """ Commits once per batch_size records. """
+        for batch in _batches(filepaths, batch_size):
+            old_tags = cls.get_file_tags(batch)
+            cls.db.executemany(
+                cls.sql.DELETE_BIJI,
+                (dict(filepath=filepath) for filepath in batch))
+            cls._count_tag_pairs(old_tags, {})
+            cls.db.commit()
+
+    @classmethod
+    def rename_bijis(cls, renames: Iterable[Tuple[str, str]]) -> None:
+        """
+        Moves records from old to new filepaths keeping their tags,
+        renames are (old, new) pairs. Commits once.
+        """
+        params = [dict(old=old, new=new, filename=os.path.basename(new))
+                  for old, new in renames]
+        try:
+            for param in params:
+                # A record replaced by the rename loses its pairs.
+                target = cls.get_file_tags([param['new']])
+                if target.keys() != cls.get_file_tags([param['old']]).keys():
+                    cls._count_tag_pairs(target, {})
+                for statement in cls.sql.RENAME_BIJI:
+                    cls.db.execute(statement, param)
+        except sqlite3.Error:
+            cls.db.rollback()
+            raise
+        cls.db.commit()
+
+    @classmethod
+    def replace_tags(cls,
+                     mtimes: Dict[str, Optional[str]],
+                     old_tags: Set[str],
+                     new_tag: str = '',
+                     delete_old_tags: bool = False) -> None:
+        """
+        Replaces old_tags with new_tag ('' to only remove them) on the
+        files in mtimes, which maps a filepath to its new bijiMTime (None
+        leaves bijiMTime as it is), then deletes old_tags from 'tags' if
+        delete_old_tags. All in one transaction.
+        """
+        used_at = datetime.now().isoformat()
+        try:
+            tags_before = cls.get_file_tags(list(mtimes))
+            cls.db.executemany(
+                cls.sql.UNLINK_TAG,
+                (dict(tag=tag, filepath=filepath)
+                 for filepath in mtimes for tag in old_tags))
+            if new_tag:
+                cls.insert_to_tags({new_tag})
+                cls.db.executemany(
+                    cls.sql.INSERT_INTO_TAG_BIJI,
+                    (dict(tag=new_tag, filepath=filepath)
+                     for filepath in mtimes))
+            cls.db.executemany(
+                cls.sql.UPDATE_BIJI_MTIME,
+                (dict(filepath=filepath, bijiMTime=mtime)
+                 for filepath, mtime in mtimes.items() if mtime))
+            cls.db.executemany(
+                cls.sql.UPDATE_TAG_TIME,
+                (dict(tag=tag, usedAt=used_at)
+                 for tag in old_tags | {new_tag} if tag))
+            cls._count_tag_pairs(tags_before, cls.get_file_tags(list(mtimes)))
+            if delete_old_tags:
+                cls.db.executemany(
+                    cls.sql.DELETE_TAG,
+                    (dict(tag=tag) for tag in old_tags if tag != new_tag))
+            cls._refresh_fts_tags(mtimes)
+        except sqlite3.Error:
+            cls.db.rollback()
+            raise
+        cls.db.commit()
+
+    @classmethod
+    def _link_tags(cls, bijis: List[dict], unlinked_tags: Set[str]) -> None:
+        """
+        Inserts tags of bijis into 'tags' and 'tag_biji', updates usedAt
+        once for each distinct tag, including the tags just unlinked.
+        """
+        links = []
+        for biji in bijis:
+            for tag in set(biji['tags']):
+                links.append(dict(tag=tag, filepath=biji['filepath']))
+
+        new_tags = set(link['tag'] for link in links)
+        cls.insert_to_tags(new_tags)
+        cls.db.executemany(cls.sql.INSERT_INTO_TAG_BIJI, links)
+
+        used_at = datetime.now().isoformat()
+        cls.db.executemany(
+            cls.sql.UPDATE_TAG_TIME,
+            (dict(tag=tag, usedAt=used_at)
+             for tag in new_tags | unlinked_tags))
+
+        if cls.fts_enabled:
+            cls.db.executemany(
+                cls.sql.FTS.SET_TAGS,
+                (dict(filepath=biji['filepath'],
+                      tags=' '.join(sorted(set(biji['tags']))))
+                 for biji in bijis))
+
+    @classmethod
+    def _refresh_fts_tags(cls, filepaths: Iterable[str]) -> None:
+        """ Sets the tags of filepaths in the search table, see fts. """
+        if cls.fts_enabled:
+            cls.db.executemany(
+                cls.sql.FTS.REFRESH_TAGS,
+                (dict(filepath=filepath) for filepath in filepaths))
 
     @classmethod
     def get_tag_atime(cls, tag: str) -> str:
@@ -232,7 +778,7 @@ class BijiDatabase:
         return an empty string if it doesn't exists.
         """
         result: sqlite3.Row = cls.db.execute(
-            GET_TAG_ATIME, dict(tag=tag)).fetchone()
+            cls.sql.GET_TAG_ATIME, dict(tag=tag)).fetchone()
         if result:
             return result['usedAt']
         else:
@@ -241,21 +787,112 @@ class BijiDatabase:
     @classmethod
     def get_tags(cls, filepath: str) -> Set[str]:
         tags = set()
-        cur = cls.db.execute(GET_TAGS, dict(filepath=filepath))
+        cur = cls.db.execute(cls.sql.GET_TAGS, dict(filepath=filepath))
         for row in cur:
             tags.add(row['tag'])
         return tags
 
+    @classmethod
+    def get_file_tags(cls, filepaths: List[str]) -> Dict[object, Set[str]]:
+        """
+        The tags of each of the filepaths which has any, keyed by an id of
+        the file in the database.
+        """
+        tags = {}
+        for batch in _batches(filepaths, MAX_VARIABLES):
+            placeholders = ', '.join(['(?)'] * len(batch))
+            for file, tag in cls.db.execute(
+                    cls.sql.GET_FILE_TAGS.format(placeholders), batch):
+                tags.setdefault(file, set()).add(tag)
+        return tags
+
+    @classmethod
+    def _count_tag_pairs(cls,
+                         old_tags: Dict[object, Set[str]],
+                         new_tags: Dict[object, Set[str]]) -> None:
+        """
+        Subtracts the pairs of the tag sets in old_tags from tag_pairs and
+        adds those in new_tags, the tags of the files before and after a
+        change, in one statement per changed pair.
+        """
+        counts = Counter()
+        for tag_sets, sign in ((old_tags, -1), (new_tags, 1)):
+            for tags in tag_sets.values():
+                for pair in permutations(tags, 2):
+                    counts[pair] += sign
+        changes = [dict(tag_a=tag_a, tag_b=tag_b, count=count)
+                   for (tag_a, tag_b), count in counts.items() if count]
+        cls.db.executemany(cls.sql.ADD_TO_TAG_PAIR, changes)
+        cls.db.executemany(
+            cls.sql.DELETE_EMPTY_TAG_PAIR,
+            (change for change in changes if change['count'] < 0))
+
+    @classmethod
+    def get_tags_of_files(cls, filepaths: List[str]) -> Set[str]:
+        """ Returns all the tags linked to any of the filepaths. """
+        tags = set()
+        for batch in _batches(filepaths, MAX_VARIABLES):
+            placeholders = ', '.join(['(?)'] * len(batch))
+            for row in cls.db.execute(
+                    cls.sql.GET_TAGS_OF_FILES.format(placeholders), batch):
+                tags.add(row['tag'])
+        return tags
+
     @classmethod
     def get_bijis(cls, tag: str) -> Set[str]:
         bijis = set()
-        for row in cls.db.execute(GET_BIJIS, dict(tag=tag)):
+        for row in cls.db.execute(cls.sql.GET_BIJIS, dict(tag=tag)):
             bijis.add(row['filepath'])
         return bijis
 
+    @classmethod
+    def get_bijis_page(cls, tag: str, limit: int, offset: int) -> List[str]:
+        """ A page of get_bijis(tag), in a stable order. """
+        return [row['filepath'] for row in cls.db.execute(
+            cls.sql.GET_BIJIS_PAGE,
+            dict(tag=tag, limit=limit, offset=offset))]
+
+    @classmethod
+    def query_bijis(cls,
+                    expression: str,
+                    limit: Optional[int] = None,
+                    offset: int = 0) -> Iterator[str]:
+        """
+        Yields the filepaths matching a tag query such as
+        'photo AND (travel OR "new york") AND NOT private',
+        see tag_query for the syntax. Raises tag_query.QuerySyntaxError.
+        """
+        return tag_query.query_bijis(
+            cls.db, expression, limit, offset, cls.sql.QUERY)
+
+    @classmethod
+    def count_bijis(cls, expression: str) -> int:
+        return tag_query.count_bijis(cls.db, expression, cls.sql.QUERY)
+
+    @classmethod
+    def search_bijis(cls,
+                     text: str,
+                     limit: Optional[int] = None,
+                     offset: int = 0) -> List[str]:
+        """
+        The filepaths whose filename, folders or tags contain the words
+        of text, the best first, see fts for the syntax.
+        """
+        return fts.search_bijis(cls.db, cls.sql.FTS, text, limit, offset)
+
+    @classmethod
+    def count_search(cls, text: str) -> int:
+        return fts.count_bijis(cls.db, cls.sql.FTS, text)
+
+    @classmethod
+    def rebuild_fts(cls) -> None:
+        """ Creates the search table again, see fts. """
+        fts.rebuild_fts(cls.db, cls.sql.FTS)
+        cls.fts_enabled = True
+
     @classmethod
     def insert_to_bijis(cls, biji_dict: dict) -> None:
-        cls.db.execute(INSERT_INTO_BIJIS, biji_dict)
+        cls.db.execute(cls.sql.INSERT_INTO_BIJIS, biji_dict)
 
     @classmethod
     def get_mtime(cls, filepath: str) -> str:
@@ -264,24 +901,68 @@ class BijiDatabase:
         return an empty string if it does not exist.
         """
         result: sqlite3.Row = cls.db.execute(
-            GET_MTIME, dict(filepath=filepath)).fetchone()
+            cls.sql.GET_MTIME, dict(filepath=filepath)).fetchone()
         if result:
             return result['bijiMTime']
         else:
             return ''
 
+    @classmethod
+    def get_all_mtimes(cls) -> Dict[str, str]:
+        """ Reads bijiMTime of all records at once, keyed by filepath. """
+        return {row['filepath']: row['bijiMTime']
+                for row in cls.db.execute(cls.sql.GET_ALL_MTIMES)}
+
+    @classmethod
+    def get_biji_json_stats(cls) -> Dict[str, Tuple[int, int, int, str]]:
+        """ filepath -> (mtime_ns, size, inode, bijiMTime) """
+        return {row['filepath']: tuple(row)[1:]
+                for row in cls.db.execute(cls.sql.GET_BIJI_JSON_STATS)}
+
+    @classmethod
+    def save_biji_json_stats(cls,
+                             stats: Iterable[Tuple[str, int, int, int, str]],
+                             deleted: Iterable[str] = ()) -> None:
+        """
+        stats are (filepath, mtime_ns, size, inode, bijiMTime),
+        deleted are the filepaths whose '.biji.json' is gone.
+        """
+        cls.db.executemany(cls.sql.REPLACE_BIJI_JSON_STAT, stats)
+        cls.db.executemany(cls.sql.DELETE_BIJI_JSON_STAT,
+                           ((filepath,) for filepath in deleted))
+        cls.db.commit()
+
+    @classmethod
+    def get_fingerprints(cls) -> Dict[str, Tuple[int, int, str, int]]:
+        """
+        filepath -> (size, inode, hash, mtime_ns), see bijiscan/moves.py.
+        """
+        return {row['filepath']: tuple(row)[1:]
+                for row in cls.db.execute(cls.sql.GET_FINGERPRINTS)}
+
+    @classmethod
+    def save_fingerprints(
+            cls,
+            fingerprints: Iterable[Tuple[str, int, int, str, int]]) -> None:
+        """ fingerprints are (filepath, size, inode, hash, mtime_ns). """
+        cls.db.executemany(
+            cls.sql.REPLACE_FINGERPRINT,
+            (dict(filepath=filepath, size=size, inode=inode, hash=hash_,
+                  mtime_ns=mtime_ns)
+             for filepath, size, inode, hash_, mtime_ns in fingerprints))
+        cls.db.commit()
+
     @classmethod
     def get_all_filepaths(cls) -> sqlite3.Cursor:
-        return cls.db.execute(GET_ALL_FILEPATHS)
+        return cls.db.execute(cls.sql.GET_ALL_FILEPATHS)
 
     @classmethod
     def delete_biji(cls, filepath: str) -> None:
-        cls.db.execute(DELETE_BIJI, dict(filepath=filepath))
-        cls.db.commit()
+        cls.delete_bijis([filepath])
 
     @classmethod
     def get_all_tags_desc(cls) -> sqlite3.Cursor:
-        return cls.db.execute(GET_ALL_TAGS_DESC)
+        return cls.db.execute(cls.sql.GET_ALL_TAGS_DESC)
 
     # @classmethod
     # def get_tags_order_by_tag(cls) -> List[Tuple[str, int]]:
@@ -292,31 +973,128 @@ class BijiDatabase:
 
     @classmethod
     def get_tags_order_by_tag(cls) -> sqlite3.Cursor:
-        return cls.db.execute(GET_TAGS_ORDER_BY_TAG)
+        return cls.db.execute(cls.sql.GET_TAGS_ORDER_BY_TAG)
 
     @classmethod
     def get_tags_order_by_count(cls) -> List[Tuple[str, int]]:
         result = cls.get_tags_not_used()
-        for row in cls.db.execute(GET_TAGS_ORDER_BY_COUNT):
+        for row in cls.db.execute(cls.sql.GET_TAGS_ORDER_BY_COUNT):
             result.append((row['tag'], row['count']))
         return result
 
+    @classmethod
+    def get_tag_rows(cls,
+                     tags: Optional[Iterable[str]] = None
+                     ) -> List[Tuple[str, int, str]]:
+        """
+        (tag, count, usedAt) of all tags, or of the existing ones of tags,
+        in no particular order.
+        """
+        if tags is None:
+            return [(row['tag'], row['count'], row['usedAt'])
+                    for row in cls.db.execute(cls.sql.GET_TAG_ROWS)]
+        rows = []
+        for batch in _batches(tags, MAX_VARIABLES):
+            placeholders = ', '.join(['(?)'] * len(batch))
+            rows.extend((row['tag'], row['count'], row['usedAt'])
+                        for row in cls.db.execute(
+                            cls.sql.GET_TAG_ROWS_OF.format(placeholders),
+                            batch))
+        return rows
+
+    @classmethod
+    def get_tag_rows_page(cls,
+                          order: str = 'tag',
+                          after: Optional[Tuple[object, str]] = None,
+                          limit: int = -1) -> List[Tuple[str, int, str]]:
+        """
+        (tag, count, usedAt) of at most limit tags in order, a key of
+        TAG_ROW_ORDERS, from the first or after the row whose (order
+        column, tag) is after, -1 for no limit.
+        """
+        if after is None:
+            sql = cls.sql.GET_TAG_ROWS_FIRST_PAGE
+            params = dict(limit=limit)
+        else:
+            sql = cls.sql.GET_TAG_ROWS_PAGE
+            params = dict(value=after[0], tag=after[1], limit=limit)
+        return [(row['tag'], row['count'], row['usedAt'])
+                for row in cls.db.execute(
+                    sql.format(**TAG_ROW_ORDERS[order]), params)]
+
+    @classmethod
+    def get_tag_rows_up_to(cls,
+                           order: str,
+                           last: Tuple[object, str]
+                           ) -> List[Tuple[str, int, str]]:
+        """
+        (tag, count, usedAt) of the tags in order up to the row whose
+        (order column, tag) is last.
+        """
+        return [(row['tag'], row['count'], row['usedAt'])
+                for row in cls.db.execute(
+                    cls.sql.GET_TAG_ROWS_UP_TO.format(**TAG_ROW_ORDERS[order]),
+                    dict(value=last[0], tag=last[1]))]
+
+    @classmethod
+    def get_wrong_tag_counts(cls) -> List[Tuple[str, int, int]]:
+        """ (tag, count, actual count) of the tags with a wrong count. """
+        return [(row['tag'], row['count'], row['actual'])
+                for row in cls.db.execute(cls.sql.GET_WRONG_TAG_COUNTS)]
+
+    @classmethod
+    def fix_tag_counts(cls) -> None:
+        """ Counts the files of every tag again. """
+        cls.db.execute(cls.sql.UPDATE_TAG_COUNTS)
+        cls.db.commit()
+
+    @classmethod
+    def get_tag_pairs(cls,
+                      tag: str,
+                      limit: int = -1) -> List[Tuple[str, int, int]]:
+        """
+        (other tag, number of files having both, number of files of the
+        other tag) of the tags used with tag, the most frequent first.
+        """
+        return [(row['tag_b'], row['pairs'], row['count'])
+                for row in cls.db.execute(cls.sql.GET_TAG_PAIRS,
+                                          dict(tag=tag, limit=limit))]
+
+    @classmethod
+    def rebuild_tag_pairs(cls) -> None:
+        """ Counts the pairs of tags again, in one transaction. """
+        try:
+            for statement in cls.sql.REBUILD_TAG_PAIRS:
+                cls.db.execute(statement)
+        except sqlite3.Error:
+            cls.db.rollback()
+            raise
+        cls.db.commit()
+
+    @classmethod
+    def count_files(cls) -> int:
+        return cls.db.execute(cls.sql.QUERY.COUNT_FILES).fetchone()[0]
+
     @classmethod
     def get_tags_order_by_time(cls) -> sqlite3.Cursor:
-        return cls.db.execute(GET_TAGS_ORDER_BY_TIME)
+        return cls.db.execute(cls.sql.GET_TAGS_ORDER_BY_TIME)
 
     @classmethod
     def get_tags_not_used(cls) -> List[Tuple[str, int]]:
         result = []
-        for row in cls.db.execute(GET_TAGS_NOT_USED):
+        for row in cls.db.execute(cls.sql.GET_TAGS_NOT_USED):
             result.append((row['tag'], 0))
         return result
 
     @classmethod
     def delete_tag(cls, tag: str) -> None:
-        cls.db.execute(DELETE_TAG, dict(tag=tag))
+        filepaths = cls.get_bijis(tag) if cls.fts_enabled else ()
+        cls.db.execute(cls.sql.DELETE_TAG, dict(tag=tag))
+        cls._refresh_fts_tags(filepaths)
 
     @classmethod
     def update_tag(cls, old_tag: str, new_tag: str) -> None:
-        cls.db.execute(UPDATE_TAG, dict(old=old_tag, new=new_tag))
+        cls.db.execute(cls.sql.UPDATE_TAG, dict(old=old_tag, new=new_tag))
+        if cls.fts_enabled:
+            cls._refresh_fts_tags(cls.get_bijis(new_tag))
         cls.db.commit()
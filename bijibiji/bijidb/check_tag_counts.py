@@ -0,0 +1,29 @@
+"""
+Checks tags.count against tag_biji, and fixes the wrong counts with --fix.
+
+    python -m bijibiji.bijidb.check_tag_counts [--fix]
+
+The counts are kept by triggers, so a wrong count means that the database
+was changed by a program which dropped or bypassed them.
+"""
+from .bijidatabase import BijiDatabase
+
+if __name__ == '__main__':
+
+    import sys
+
+    from .. import change_cwd
+    change_cwd()
+
+    biji_db = BijiDatabase
+    biji_db.connect_db()
+    wrong_counts = biji_db.get_wrong_tag_counts()
+    for tag, count, actual in wrong_counts:
+        print(f'{tag}: {count} (should be {actual})')
+    print(f'{len(wrong_counts)} wrong count(s).')
+
+    if wrong_counts and '--fix' in sys.argv:
+        biji_db.fix_tag_counts()
+        print('Fixed.')
+    biji_db.close_db()
+    sys.exit(1 if wrong_counts and '--fix' not in sys.argv else 0)
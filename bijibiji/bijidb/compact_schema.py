@@ -0,0 +1,436 @@
+"""
+An optional compact schema with integer keys.
+
+A path is stored once as (dir_id, filename), where 'dirs' holds every
+directory once, and a link in tag_biji is a pair of integers instead of
+the full path and tag text. The view 'bijis' and the statements below
+keep the string based interface of BijiDatabase, BijiDatabase.sql is
+CompactStatements when the database is marked with the application_id.
+
+Create one with BijiDatabase.create_db(compact=True), and compare it with
+the default schema by 'python -m bijibiji.bijibench.compare_schemas'.
+"""
+from .fts import FTS_TABLE, FtsStatements
+from .tag_query import QueryStatements
+
+# PRAGMA application_id of the compact schema, 'bijc'.
+COMPACT_APPLICATION_ID = 0x62696a63
+
+
+def _dir_of(filepath: str) -> str:
+    """
+    SQL of the directory part of filepath with the trailing separator,
+    'a/b/c.txt' -> 'a/b/', 'c.txt' -> ''.
+    """
+    return f"rtrim({filepath}, " \
+           f"replace(replace({filepath}, '/', ''), '\\', ''))"
+
+
+def _name_of(filepath: str) -> str:
+    """ SQL of the last part of filepath. """
+    return f"substr({filepath}, length({_dir_of(filepath)}) + 1)"
+
+
+def _file_id(filepath: str) -> str:
+    """ SQL of the file_id of filepath, an index lookup in each table. """
+    return f"""(
+        SELECT file_id FROM files JOIN dirs USING (dir_id)
+        WHERE dirs.path = {_dir_of(filepath)}
+        AND files.filename = {_name_of(filepath)}
+    )"""
+
+
+_TAG_ID = '(SELECT tag_id FROM tags WHERE tag = :tag)'
+
+FILE_ID = _file_id(':filepath')
+
+CREATE_TABLES = f"""
+    CREATE TABLE dirs (
+        dir_id      integer     PRIMARY KEY,
+        path        text        NOT NULL UNIQUE COLLATE NOCASE
+    );
+
+    CREATE TABLE files (
+        file_id     integer     PRIMARY KEY,
+        dir_id      integer     NOT NULL REFERENCES dirs(dir_id),
+        filename    text        NOT NULL COLLATE NOCASE,
+        suffix      text        NOT NULL,
+        mimetype    text,
+        filesize    integer     NOT NULL,
+        updatedAt   text        NOT NULL,
+        backupAt    text        NOT NULL,
+        bijiCTime   text        NOT NULL,
+        bijiMTime   text        NOT NULL check(bijiMTime <> ''),
+        UNIQUE (dir_id, filename)
+    );
+
+    CREATE TABLE tags (
+        tag_id      integer     PRIMARY KEY,
+        tag         text        NOT NULL UNIQUE,
+        usedAt      text        NOT NULL check(usedAt <> '')
+    );
+
+    CREATE INDEX tags_usedAt ON tags(usedAt);
+
+    CREATE TABLE tag_biji (
+        tag_id      integer     NOT NULL
+                                REFERENCES tags(tag_id)
+                                ON DELETE CASCADE,
+        file_id     integer     NOT NULL
+                                REFERENCES files(file_id)
+                                ON DELETE CASCADE,
+        PRIMARY KEY (tag_id, file_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX tag_biji_file_idx ON tag_biji(file_id, tag_id);
+
+    CREATE VIEW bijis AS
+        SELECT
+            dirs.path || files.filename AS filepath,
+            files.filename AS filename,
+            suffix,
+            mimetype,
+            filesize,
+            updatedAt,
+            backupAt,
+            bijiCTime,
+            bijiMTime
+        FROM files JOIN dirs USING (dir_id);
+
+    CREATE TRIGGER bijis_insert INSTEAD OF INSERT ON bijis
+    BEGIN
+        INSERT OR IGNORE INTO dirs (path) VALUES ({_dir_of('NEW.filepath')});
+        INSERT INTO files (
+            dir_id,
+            filename,
+            suffix,
+            mimetype,
+            filesize,
+            updatedAt,
+            backupAt,
+            bijiCTime,
+            bijiMTime
+        ) VALUES (
+            (SELECT dir_id FROM dirs
+             WHERE path = {_dir_of('NEW.filepath')}),
+            {_name_of('NEW.filepath')},
+            NEW.suffix,
+            NEW.mimetype,
+            NEW.filesize,
+            NEW.updatedAt,
+            NEW.backupAt,
+            NEW.bijiCTime,
+            NEW.bijiMTime
+        );
+    END;
+
+    CREATE TABLE biji_json_stats (
+        filepath    text        PRIMARY KEY COLLATE NOCASE,
+        mtime_ns    integer     NOT NULL,
+        size        integer     NOT NULL,
+        inode       integer     NOT NULL,
+        bijiMTime   text        NOT NULL
+    );
+    """
+
+# tags.count, the same as migrations.TAG_COUNTS of the default schema.
+# tag_biji.tag_id never changes by a cascade, a tag is renamed in place.
+TAG_COUNTS = [
+    """
+    ALTER TABLE tags ADD COLUMN count integer NOT NULL DEFAULT 0
+    """,
+    """
+    UPDATE tags SET count =
+        (SELECT COUNT(*) FROM tag_biji WHERE tag_biji.tag_id = tags.tag_id)
+    """,
+    """
+    CREATE INDEX tags_count ON tags(count)
+    """,
+    """
+    CREATE TRIGGER tag_biji_insert AFTER INSERT ON tag_biji
+    BEGIN
+        UPDATE tags SET count = count + 1 WHERE tag_id = NEW.tag_id;
+    END
+    """,
+    """
+    CREATE TRIGGER tag_biji_delete AFTER DELETE ON tag_biji
+    BEGIN
+        UPDATE tags SET count = count - 1 WHERE tag_id = OLD.tag_id;
+    END
+    """,
+    """
+    CREATE TRIGGER tag_biji_update AFTER UPDATE OF tag_id ON tag_biji
+    WHEN OLD.tag_id <> NEW.tag_id
+    BEGIN
+        UPDATE tags SET count = count - 1 WHERE tag_id = OLD.tag_id;
+        UPDATE tags SET count = count + 1 WHERE tag_id = NEW.tag_id;
+    END
+    """,
+]
+
+# tag_pairs, the same as migrations.TAG_PAIRS of the default schema.
+FILL_TAG_PAIRS = """
+    INSERT INTO tag_pairs (tag_a, tag_b, count)
+    SELECT a.tag_id, b.tag_id, COUNT(*) FROM tag_biji AS a
+    JOIN tag_biji AS b ON b.file_id = a.file_id AND b.tag_id <> a.tag_id
+    GROUP BY a.tag_id, b.tag_id
+    """
+
+REBUILD_TAG_PAIRS = ['DELETE FROM tag_pairs', FILL_TAG_PAIRS]
+
+TAG_PAIRS = [
+    """
+    CREATE TABLE tag_pairs (
+        tag_a       integer     NOT NULL
+                                REFERENCES tags(tag_id)
+                                ON DELETE CASCADE,
+        tag_b       integer     NOT NULL
+                                REFERENCES tags(tag_id)
+                                ON DELETE CASCADE,
+        count       integer     NOT NULL,
+        PRIMARY KEY (tag_a, tag_b)
+    ) WITHOUT ROWID
+    """,
+    FILL_TAG_PAIRS,
+    """
+    CREATE INDEX tag_pairs_count ON tag_pairs(tag_a, count)
+    """,
+]
+
+# fingerprints, the same as migrations.FINGERPRINTS of the default schema.
+# A renamed record keeps its file_id.
+FINGERPRINTS = [
+    """
+    CREATE TABLE fingerprints (
+        file_id     integer     PRIMARY KEY
+                                REFERENCES files(file_id)
+                                ON DELETE CASCADE,
+        size        integer     NOT NULL,
+        inode       integer     NOT NULL,
+        hash        text        NOT NULL,
+        mtime_ns    integer     NOT NULL
+    )
+    """,
+]
+
+# CREATE_TABLES is version 0 of the compact schema.
+MIGRATIONS = [
+    (1, TAG_COUNTS),
+    (2, TAG_PAIRS),
+    (3, FINGERPRINTS),
+]
+
+GET_FINGERPRINTS = """
+    SELECT dirs.path || files.filename AS filepath,
+        size, inode, hash, mtime_ns
+    FROM fingerprints JOIN files USING (file_id) JOIN dirs USING (dir_id)
+    """
+
+# Nothing is saved for a filepath without a record.
+REPLACE_FINGERPRINT = f"""
+    INSERT OR REPLACE INTO fingerprints (
+        file_id, size, inode, hash, mtime_ns
+    )
+    SELECT file_id, :size, :inode, :hash, :mtime_ns FROM files
+    WHERE file_id = {FILE_ID}
+    """
+
+GET_TAG_PAIRS = """
+    SELECT tag AS tag_b, pairs.count AS pairs, tags.count AS count
+    FROM tag_pairs AS pairs JOIN tags ON tags.tag_id = pairs.tag_b
+    WHERE pairs.tag_a = (SELECT tag_id FROM tags WHERE tag = :tag)
+    ORDER BY pairs.count DESC LIMIT :limit
+    """
+
+INSERT_INTO_TAG_BIJI = f"""
+    INSERT OR IGNORE INTO tag_biji (tag_id, file_id)
+    SELECT tag_id, {FILE_ID} FROM tags WHERE tag = :tag
+    """
+
+UPDATE_BIJI = f"""
+    UPDATE files SET
+        suffix = :suffix,
+        mimetype = :mimetype,
+        updatedAt = :updatedAt,
+        backupAt = :backupAt,
+        bijiCTime = :bijiCTime,
+        bijiMTime = :bijiMTime
+    WHERE file_id = {FILE_ID}
+    """
+
+UNLINK_TAG = f"""
+    DELETE FROM tag_biji WHERE tag_id = {_TAG_ID} AND file_id = {FILE_ID}
+    """
+
+UNLINK_ALL_TAGS = f"""
+    DELETE FROM tag_biji WHERE file_id = {FILE_ID}
+    """
+
+UPDATE_BIJI_MTIME = f"""
+    UPDATE files SET bijiMTime = :bijiMTime WHERE file_id = {FILE_ID}
+    """
+
+GET_TAGS = f"""
+    SELECT tag FROM tag_biji JOIN tags USING (tag_id)
+    WHERE file_id = {FILE_ID}
+    """
+
+GET_TAGS_OF_FILES = f"""
+    SELECT DISTINCT tags.tag AS tag FROM (VALUES {{}}) AS paths
+    JOIN tag_biji ON tag_biji.file_id = {_file_id('paths.column1')}
+    JOIN tags USING (tag_id)
+    """
+
+GET_FILE_TAGS = f"""
+    SELECT DISTINCT tag_biji.file_id, tags.tag FROM (VALUES {{}}) AS paths
+    JOIN tag_biji ON tag_biji.file_id = {_file_id('paths.column1')}
+    JOIN tags USING (tag_id)
+    """
+
+ADD_TO_TAG_PAIR = """
+    INSERT OR REPLACE INTO tag_pairs (tag_a, tag_b, count)
+    SELECT a.tag_id, b.tag_id, coalesce((
+        SELECT count FROM tag_pairs WHERE tag_a = a.tag_id AND tag_b = b.tag_id
+    ), 0) + :count
+    FROM tags AS a, tags AS b WHERE a.tag = :tag_a AND b.tag = :tag_b
+    """
+
+DELETE_EMPTY_TAG_PAIR = """
+    DELETE FROM tag_pairs WHERE count <= 0
+    AND tag_a = (SELECT tag_id FROM tags WHERE tag = :tag_a)
+    AND tag_b = (SELECT tag_id FROM tags WHERE tag = :tag_b)
+    """
+
+GET_BIJIS = f"""
+    SELECT dirs.path || files.filename AS filepath
+    FROM tag_biji JOIN files USING (file_id) JOIN dirs USING (dir_id)
+    WHERE tag_id = {_TAG_ID}
+    """
+
+GET_WRONG_TAG_COUNTS = """
+    SELECT tag, count, actual FROM (
+        SELECT tag, count, (
+            SELECT COUNT(*) FROM tag_biji
+            WHERE tag_biji.tag_id = tags.tag_id
+        ) AS actual FROM tags
+    ) WHERE count <> actual
+    """
+
+UPDATE_TAG_COUNTS = """
+    UPDATE tags SET count =
+        (SELECT COUNT(*) FROM tag_biji WHERE tag_biji.tag_id = tags.tag_id)
+    """
+
+GET_BIJIS_PAGE = f"""
+    SELECT dirs.path || files.filename AS filepath
+    FROM tag_biji JOIN files USING (file_id) JOIN dirs USING (dir_id)
+    WHERE tag_id = {_TAG_ID}
+    ORDER BY file_id LIMIT :limit OFFSET :offset
+    """
+
+GET_MTIME = f"""
+    SELECT bijiMTime FROM files WHERE file_id = {FILE_ID}
+    """
+
+DELETE_BIJI = f"""
+    DELETE FROM files WHERE file_id = {FILE_ID}
+    """
+
+_NEW_DIR = _dir_of(':new')
+
+RENAME_BIJI = [
+    f"""
+    DELETE FROM files WHERE file_id = {_file_id(':new')}
+    AND file_id <> {_file_id(':old')}
+    """,
+    f"""
+    INSERT OR IGNORE INTO dirs (path) VALUES ({_NEW_DIR})
+    """,
+    f"""
+    UPDATE files SET
+        dir_id = (SELECT dir_id FROM dirs WHERE path = {_NEW_DIR}),
+        filename = {_name_of(':new')}
+    WHERE file_id = {_file_id(':old')}
+    """,
+]
+
+
+class CompactQueryStatements(QueryStatements):
+    """ The tag query compiler on the compact schema, key is file_id. """
+    TAG_SET = 'SELECT file_id AS key FROM tag_biji ' \
+              'WHERE tag_id = (SELECT tag_id FROM tags WHERE tag = ?)'
+
+    TAG_EXISTS = 'EXISTS (SELECT 1 FROM tag_biji ' \
+                 'WHERE tag_id = (SELECT tag_id FROM tags WHERE tag = ?) ' \
+                 'AND file_id = {key})'
+
+    ALL_FILES = 'SELECT file_id AS key FROM files'
+
+    COUNT_FILES = 'SELECT COUNT(*) FROM files'
+
+    RESULT = 'SELECT dirs.path || files.filename AS filepath ' \
+             'FROM (SELECT DISTINCT key FROM ({})) AS keys ' \
+             'JOIN files ON files.file_id = keys.key ' \
+             'JOIN dirs USING (dir_id) ' \
+             'ORDER BY filepath COLLATE NOCASE LIMIT ? OFFSET ?'
+
+
+_FILE_TAGS = """coalesce((
+    SELECT group_concat(tag, ' ') FROM tag_biji JOIN tags USING (tag_id)
+    WHERE file_id = {}
+), '')"""
+
+_NEW_DIR_PATH = '(SELECT path FROM dirs WHERE dir_id = NEW.dir_id)'
+
+
+class CompactFtsStatements(FtsStatements):
+    """
+    The FTS of the compact schema, the rowid is files.file_id. A tag is
+    renamed in place, tag_biji doesn't change, the rows of its files are
+    refreshed by BijiDatabase.update_tag().
+    """
+    CREATE = [
+        FtsStatements.CREATE[0],
+        f"""
+        CREATE TRIGGER biji_fts_insert AFTER INSERT ON files
+        BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, filepath, filename, dirs, tags)
+            VALUES (NEW.file_id, {_NEW_DIR_PATH} || NEW.filename,
+                    NEW.filename, {_NEW_DIR_PATH}, '');
+        END
+        """,
+        f"""
+        CREATE TRIGGER biji_fts_delete AFTER DELETE ON files
+        BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = OLD.file_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER biji_fts_rename AFTER UPDATE OF dir_id, filename
+        ON files WHEN OLD.dir_id <> NEW.dir_id
+        OR OLD.filename IS NOT NEW.filename
+        BEGIN
+            UPDATE {FTS_TABLE} SET
+                filepath = {_NEW_DIR_PATH} || NEW.filename,
+                filename = NEW.filename,
+                dirs = {_NEW_DIR_PATH}
+            WHERE rowid = NEW.file_id;
+        END
+        """,
+    ]
+
+    FILL = [f"""
+        INSERT INTO {FTS_TABLE} (rowid, filepath, filename, dirs, tags)
+        SELECT file_id, dirs.path || files.filename, files.filename,
+            dirs.path, {_FILE_TAGS.format('files.file_id')}
+        FROM files JOIN dirs USING (dir_id)
+        """]
+
+    SET_TAGS = f"""
+        UPDATE {FTS_TABLE} SET tags = :tags WHERE rowid = {FILE_ID}
+        """
+
+    REFRESH_TAGS = f"""
+        UPDATE {FTS_TABLE} SET tags = {_FILE_TAGS.format(FILE_ID)}
+        WHERE rowid = {FILE_ID}
+        """
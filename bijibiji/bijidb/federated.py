@@ -0,0 +1,80 @@
+"""
+Tag queries across the databases of all roots, see bijibiji/roots.py.
+
+Each database is queried by a thread with a read-only connection of its
+own, and the results, sorted by filepath in each database, are merged
+into one list of (root name, filepath). The databases are not ATTACHed:
+a root may have the compact schema and another one the default schema,
+and SQLite attaches at most 10 databases by default.
+
+    python -m bijibiji.bijidb.federated 'photo AND NOT private'
+
+A root without a database yet has no files. The database of a root made
+by an older version raises sqlite3.OperationalError, until a scan of the
+root upgrades it.
+"""
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..bijiscan.scan_engine import nocase
+from ..roots import Root, get_roots
+from . import tag_query
+from .bijidatabase import BijiDatabase
+
+
+def _each_root(func: Callable[[type(BijiDatabase)], object],
+               roots: Optional[List[Root]]) -> Dict[str, object]:
+    """ root name -> func(db) of the roots with a database, in parallel. """
+    roots = [root for root in roots or get_roots()
+             if os.path.exists(root.db_path)]
+
+    def run(root: Root):
+        db = BijiDatabase.new_connection(root.db_path, 'read-only')
+        try:
+            return func(db)
+        finally:
+            db.close_db()
+
+    if not roots:
+        return {}
+    with ThreadPoolExecutor(len(roots)) as executor:
+        results = executor.map(run, roots)
+        return {root.name: result for root, result in zip(roots, results)}
+
+
+def query_roots(expression: str,
+                limit: Optional[int] = None,
+                offset: int = 0,
+                roots: Optional[List[Root]] = None) -> List[Tuple[str, str]]:
+    """
+    (root name, filepath) of the files matching a tag query, in the order
+    of filepath and then root. Raises tag_query.QuerySyntaxError.
+    """
+    tag_query.parse(expression)
+    end = None if limit is None else offset + limit
+    pages = _each_root(
+        lambda db: list(db.query_bijis(expression, end)), roots)
+    merged = heapq.merge(
+        *([(nocase(filepath), name, filepath) for filepath in filepaths]
+          for name, filepaths in pages.items()))
+    return [(name, filepath) for _, name, filepath in merged][offset:end]
+
+
+def count_roots(expression: str,
+                roots: Optional[List[Root]] = None) -> Dict[str, int]:
+    """ root name -> number of files matching a tag query. """
+    tag_query.parse(expression)
+    return _each_root(lambda db: db.count_bijis(expression), roots)
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    expression = ' '.join(sys.argv[1:])
+    for name, count in count_roots(expression).items():
+        print(f'{name}: {count} file(s)', file=sys.stderr)
+    for name, filepath in query_roots(expression):
+        print(f'{name}\t{filepath}')
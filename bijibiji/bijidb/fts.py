@@ -0,0 +1,345 @@
+"""
+Full-text search of the filenames, folders and tags of the records.
+
+The FTS5 table biji_fts has one row per record, with the filename, the
+folder part of the path and the tags joined by spaces. Its trigram
+tokenizer makes a term match anywhere in a column, case-insensitively,
+from an index, and the results are ranked by bm25 with the filename
+weighing the most. Triggers on the tables of the schema keep the paths in
+sync. The tags are set by BijiDatabase once per record after its tags
+change (SET_TAGS, REFRESH_TAGS), a trigger per link would rewrite the
+row once per tag.
+
+The rowid of a row is an explicit key, the INTEGER PRIMARY KEY of the
+table biji_fts_ids of the default schema, files.file_id of the compact
+one, which a VACUUM keeps.
+
+    report 2020         both terms, anywhere in filename, folders or tags
+    "annual report"     a phrase
+    rep*                the filenames starting with 'rep'
+
+A term shorter than 3 characters can't use the trigram index, it is
+checked by LIKE on the rows matched by the other terms.
+
+The table is created with a new database if the SQLite has FTS5 with the
+trigram tokenizer (3.34 or newer). For an existing database, run
+
+    python -m bijibiji.bijidb.fts rebuild
+
+A table made by an older version, with the triggers on tag_biji, is
+rebuilt when the database is connected.
+
+Without the table, search_bijis() falls back to LIKE on the filepaths.
+"""
+import re
+import sqlite3
+from typing import Iterator, List, Optional, Tuple
+
+FTS_TABLE = 'biji_fts'
+
+# bm25 weights of filepath (not indexed), filename, dirs and tags.
+WEIGHTS = '0.0, 10.0, 2.0, 5.0'
+
+# The trigram tokenizer needs at least this many characters.
+MIN_TERM = 3
+
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+# The folder part of the filepath of a row of 'bijis', 'a/b/c.txt' -> 'a/b/'.
+_DIRS = 'substr({0}filepath, 1, length({0}filepath) - length({0}filename))'
+
+_NEW_DIRS = _DIRS.format('NEW.')
+
+_TAGS_OF = "coalesce((SELECT group_concat(tag, ' ') FROM tag_biji " \
+           "WHERE filepath = {}), '')"
+
+_FTS_ID = '(SELECT fts_id FROM biji_fts_ids WHERE filepath = {})'
+
+# The triggers on tag_biji of the older versions.
+_OLD_TRIGGERS = ('biji_fts_link', 'biji_fts_unlink', 'biji_fts_relink')
+
+
+class FtsStatements:
+    """ The FTS of the default schema, keyed by biji_fts_ids. """
+    CREATE = [
+        f"""
+        CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            filepath UNINDEXED, filename, dirs, tags, tokenize = 'trigram'
+        )
+        """,
+        """
+        CREATE TABLE biji_fts_ids (
+            fts_id      integer     PRIMARY KEY,
+            filepath    text        NOT NULL UNIQUE COLLATE NOCASE
+                                    REFERENCES bijis(filepath)
+                                    ON UPDATE CASCADE
+                                    ON DELETE CASCADE
+        )
+        """,
+        f"""
+        CREATE TRIGGER biji_fts_insert AFTER INSERT ON bijis
+        BEGIN
+            INSERT INTO biji_fts_ids (filepath) VALUES (NEW.filepath);
+            INSERT INTO {FTS_TABLE} (rowid, filepath, filename, dirs, tags)
+            VALUES (last_insert_rowid(), NEW.filepath, NEW.filename,
+                    {_NEW_DIRS}, '');
+        END
+        """,
+        # Also by the cascade from 'bijis'.
+        f"""
+        CREATE TRIGGER biji_fts_delete AFTER DELETE ON biji_fts_ids
+        BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = OLD.fts_id;
+        END
+        """,
+        # biji_fts_ids has followed by the cascade.
+        f"""
+        CREATE TRIGGER biji_fts_rename AFTER UPDATE OF filepath, filename
+        ON bijis WHEN OLD.filepath IS NOT NEW.filepath
+        OR OLD.filename IS NOT NEW.filename
+        BEGIN
+            UPDATE {FTS_TABLE} SET
+                filepath = NEW.filepath,
+                filename = NEW.filename,
+                dirs = {_NEW_DIRS}
+            WHERE rowid = {_FTS_ID.format('NEW.filepath')};
+        END
+        """,
+    ]
+
+    DROP = [
+        f'DROP TABLE IF EXISTS {FTS_TABLE}',
+        'DROP TABLE IF EXISTS biji_fts_ids',
+        'DROP TRIGGER IF EXISTS biji_fts_insert',
+        'DROP TRIGGER IF EXISTS biji_fts_delete',
+        'DROP TRIGGER IF EXISTS biji_fts_rename',
+    ] + [f'DROP TRIGGER IF EXISTS {name}' for name in _OLD_TRIGGERS]
+
+    FILL = [
+        """
+        INSERT INTO biji_fts_ids (filepath) SELECT filepath FROM bijis
+        """,
+        f"""
+        INSERT INTO {FTS_TABLE} (rowid, filepath, filename, dirs, tags)
+        SELECT fts_id, bijis.filepath, filename, {_DIRS.format('bijis.')},
+            {_TAGS_OF.format('bijis.filepath')}
+        FROM bijis JOIN biji_fts_ids USING (filepath)
+        """,
+    ]
+
+    OPTIMIZE = f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"
+
+    # The tags of a record, joined by spaces.
+    SET_TAGS = f"""
+        UPDATE {FTS_TABLE} SET tags = :tags
+        WHERE rowid = {_FTS_ID.format(':filepath')}
+        """
+
+    # The same, read from tag_biji.
+    REFRESH_TAGS = f"""
+        UPDATE {FTS_TABLE} SET tags = {_TAGS_OF.format(':filepath')}
+        WHERE rowid = {_FTS_ID.format(':filepath')}
+        """
+
+    FROM = f'FROM {FTS_TABLE}'
+
+    # Without the FTS table, {} is the conditions on filepath.
+    FALLBACK = 'SELECT filepath FROM bijis WHERE {} ' \
+               'ORDER BY filepath LIMIT ? OFFSET ?'
+
+    FALLBACK_COUNT = 'SELECT COUNT(*) FROM bijis WHERE {}'
+
+
+def fts_available(conn: sqlite3.Connection) -> bool:
+    """ Whether the SQLite has FTS5 with the trigram tokenizer. """
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts_probe "
+                     "USING fts5(a, tokenize = 'trigram')")
+    except sqlite3.OperationalError:
+        return False
+    conn.execute('DROP TABLE temp.fts_probe')
+    return True
+
+
+def has_fts(conn: sqlite3.Connection) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (FTS_TABLE,)).fetchone() is not None
+
+
+def fts_outdated(conn: sqlite3.Connection) -> bool:
+    """ Whether the table was made by an older version, see rebuild. """
+    placeholders = ', '.join('?' * len(_OLD_TRIGGERS))
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+        f"AND name IN ({placeholders})", _OLD_TRIGGERS).fetchone() is not None
+
+
+def create_fts(conn: sqlite3.Connection,
+               statements: type(FtsStatements)) -> None:
+    """ Creates the table and its triggers, and fills it. """
+    for statement in statements.CREATE + statements.FILL:
+        conn.execute(statement)
+    conn.execute(statements.OPTIMIZE)
+    conn.commit()
+
+
+def drop_fts(conn: sqlite3.Connection,
+             statements: type(FtsStatements)) -> None:
+    for statement in statements.DROP:
+        conn.execute(statement)
+    conn.commit()
+
+
+def rebuild_fts(conn: sqlite3.Connection,
+                statements: type(FtsStatements)) -> None:
+    """ Drops and creates the table again, in one transaction. """
+    try:
+        for statement in statements.DROP:
+            conn.execute(statement)
+        create_fts(conn, statements)
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _terms(text: str) -> Iterator[Tuple[str, bool]]:
+    """ Yields (term, is_prefix) of text, a quoted phrase is one term. """
+    for match in _TERM.finditer(text):
+        if match.group(1) is not None:
+            if match.group(1):
+                yield match.group(1), False
+        elif len(match.group(2)) > 1 and match.group(2).endswith('*'):
+            yield match.group(2)[:-1], True
+        else:
+            yield match.group(2), False
+
+
+def compile_search(text: str) -> Tuple[str, List[str], bool]:
+    """
+    Returns (conditions, parameters, ranked) of the WHERE clause,
+    ranked is False if there is nothing for MATCH.
+    """
+    phrases = []
+    conditions = []
+    parameters = []
+    for term, is_prefix in _terms(text):
+        if is_prefix:
+            if len(term) >= MIN_TERM:
+                # The index finds the filenames containing it.
+                phrases.append('filename : ' + _quote(term))
+            conditions.append(f"{FTS_TABLE}.filename LIKE ? ESCAPE '\\'")
+            parameters.append(_like(term) + '%')
+        elif len(term) >= MIN_TERM:
+            phrases.append(_quote(term))
+        else:
+            conditions.append(
+                f"({FTS_TABLE}.filename LIKE ? ESCAPE '\\' "
+                f"OR {FTS_TABLE}.dirs LIKE ? ESCAPE '\\' "
+                f"OR {FTS_TABLE}.tags LIKE ? ESCAPE '\\')")
+            parameters.extend(['%' + _like(term) + '%'] * 3)
+
+    if phrases:
+        conditions.insert(0, f'{FTS_TABLE} MATCH ?')
+        parameters.insert(0, ' '.join(phrases))
+    return ' AND '.join(conditions), parameters, bool(phrases)
+
+
+def _compile_fallback(text: str) -> Tuple[str, List[str]]:
+    """ compile_search() on 'bijis', without ranking. """
+    conditions = []
+    parameters = []
+    for term, is_prefix in _terms(text):
+        if is_prefix:
+            conditions.append("filename LIKE ? ESCAPE '\\'")
+            parameters.append(_like(term) + '%')
+        else:
+            conditions.append("filepath LIKE ? ESCAPE '\\'")
+            parameters.append('%' + _like(term) + '%')
+    return ' AND '.join(conditions), parameters
+
+
+def search_bijis(conn: sqlite3.Connection,
+                 statements: type(FtsStatements),
+                 text: str,
+                 limit: Optional[int] = None,
+                 offset: int = 0) -> List[str]:
+    """ The filepaths matching text, the best first. """
+    limit = -1 if limit is None else limit
+    if not has_fts(conn):
+        conditions, parameters = _compile_fallback(text)
+        if not conditions:
+            return []
+        rows = conn.execute(statements.FALLBACK.format(conditions),
+                            parameters + [limit, offset])
+        return [row[0] for row in rows]
+
+    conditions, parameters, ranked = compile_search(text)
+    if not conditions:
+        return []
+    order = f'bm25({FTS_TABLE}, {WEIGHTS})' if ranked \
+        else f'{FTS_TABLE}.filepath'
+    rows = conn.execute(
+        f'SELECT {FTS_TABLE}.filepath {statements.FROM} '
+        f'WHERE {conditions} ORDER BY {order} LIMIT ? OFFSET ?',
+        parameters + [limit, offset])
+    return [row[0] for row in rows]
+
+
+def count_bijis(conn: sqlite3.Connection,
+                statements: type(FtsStatements),
+                text: str) -> int:
+    if not has_fts(conn):
+        conditions, parameters = _compile_fallback(text)
+        if not conditions:
+            return 0
+        return conn.execute(statements.FALLBACK_COUNT.format(conditions),
+                            parameters).fetchone()[0]
+
+    conditions, parameters, _ = compile_search(text)
+    if not conditions:
+        return 0
+    return conn.execute(
+        f'SELECT COUNT(*) {statements.FROM} WHERE {conditions}',
+        parameters).fetchone()[0]
+
+
+if __name__ == '__main__':
+
+    import sys
+    import time
+
+    from .. import change_cwd
+    from .bijidatabase import BijiDatabase
+
+    usage = 'python -m bijibiji.bijidb.fts rebuild | drop | search TEXT'
+    if len(sys.argv) < 2 or sys.argv[1] not in ('rebuild', 'drop', 'search'):
+        sys.exit(usage)
+
+    change_cwd()
+    biji_db = BijiDatabase
+    biji_db.connect_db()
+    command = sys.argv[1]
+    start = time.perf_counter()
+    if command == 'rebuild':
+        if not fts_available(biji_db.db):
+            sys.exit('This SQLite has no FTS5 with the trigram tokenizer.')
+        biji_db.rebuild_fts()
+        print(f'Rebuilt in {time.perf_counter() - start:.1f}s.')
+    elif command == 'drop':
+        drop_fts(biji_db.db, biji_db.sql.FTS)
+        biji_db.fts_enabled = False
+    else:
+        for filepath in biji_db.search_bijis(' '.join(sys.argv[2:]), 50):
+            print(filepath)
+        print(f'{(time.perf_counter() - start) * 1000:.1f}ms',
+              file=sys.stderr)
+    biji_db.close_db()
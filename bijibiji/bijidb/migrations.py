@@ -0,0 +1,221 @@
+"""
+Versioned schema migrations, keyed on PRAGMA user_version.
+
+CREATE_TABLES in bijidatabase is the schema of version 0, every database
+is upgraded in place by migrate() when it is connected. Each migration
+runs in a transaction of its own with foreign keys turned off, so that
+tables can be rebuilt, and is committed together with its user_version.
+"""
+import sqlite3
+from typing import List, Tuple
+
+# Makes (tag, filepath) the primary key of tag_biji, adds the reverse index
+# and gives tag_biji.filepath the same NOCASE collation as bijis.filepath,
+# so that GET_TAGS, GET_BIJIS, UNLINK_TAG and the cascades from 'bijis' and
+# 'tags' are index lookups instead of full table scans.
+TAG_BIJI_PRIMARY_KEY = [
+    """
+    CREATE TABLE tag_biji_new (
+        tag         text        NOT NULL
+                                REFERENCES tags(tag)
+                                ON UPDATE CASCADE
+                                ON DELETE CASCADE,
+        filepath    text        NOT NULL COLLATE NOCASE
+                                REFERENCES bijis(filepath)
+                                ON UPDATE CASCADE
+                                ON DELETE CASCADE,
+        PRIMARY KEY (tag, filepath)
+    ) WITHOUT ROWID
+    """,
+    """
+    INSERT OR IGNORE INTO tag_biji_new (tag, filepath)
+    SELECT tag, filepath FROM tag_biji
+    WHERE tag IN (SELECT tag FROM tags)
+    AND filepath IN (SELECT filepath FROM bijis)
+    """,
+    """
+    DROP TABLE tag_biji
+    """,
+    """
+    ALTER TABLE tag_biji_new RENAME TO tag_biji
+    """,
+    """
+    CREATE INDEX tag_biji_filepath_idx ON tag_biji(filepath, tag)
+    """,
+]
+
+# The stat cache of the '.biji.json' files, it may already exist in
+# databases connected by an older version.
+BIJI_JSON_STATS = [
+    """
+    CREATE TABLE IF NOT EXISTS biji_json_stats (
+        filepath    text        PRIMARY KEY COLLATE NOCASE,
+        mtime_ns    integer     NOT NULL,
+        size        integer     NOT NULL,
+        inode       integer     NOT NULL,
+        bijiMTime   text        NOT NULL
+    )
+    """,
+]
+
+# tags.count is the number of files of each tag, kept by the triggers on
+# tag_biji, so that sorting by count and finding the unused tags don't
+# group the whole tag_biji. A tag renamed in 'tags' takes its count with
+# it, the cascaded updates of tag_biji are skipped by the WHEN clause,
+# because the old tag doesn't exist any more. The UPDATE backfills the
+# counts once, 'python -m bijibiji.bijidb.check_tag_counts' checks them.
+TAG_COUNTS = [
+    """
+    ALTER TABLE tags ADD COLUMN count integer NOT NULL DEFAULT 0
+    """,
+    """
+    UPDATE tags SET count =
+        (SELECT COUNT(*) FROM tag_biji WHERE tag_biji.tag = tags.tag)
+    """,
+    """
+    CREATE INDEX tags_count ON tags(count)
+    """,
+    """
+    CREATE TRIGGER tag_biji_insert AFTER INSERT ON tag_biji
+    BEGIN
+        UPDATE tags SET count = count + 1 WHERE tag = NEW.tag;
+    END
+    """,
+    """
+    CREATE TRIGGER tag_biji_delete AFTER DELETE ON tag_biji
+    BEGIN
+        UPDATE tags SET count = count - 1 WHERE tag = OLD.tag;
+    END
+    """,
+    """
+    CREATE TRIGGER tag_biji_update AFTER UPDATE OF tag ON tag_biji
+    WHEN OLD.tag <> NEW.tag
+    AND EXISTS (SELECT 1 FROM tags WHERE tag = OLD.tag)
+    BEGIN
+        UPDATE tags SET count = count - 1 WHERE tag = OLD.tag;
+        UPDATE tags SET count = count + 1 WHERE tag = NEW.tag;
+    END
+    """,
+]
+
+# tag_pairs.count is the number of files having both tag_a and tag_b,
+# each pair is stored in both orders, so that the pairs of a tag are a
+# range of the primary key, and tag_pairs_count finds the most frequent
+# pairs of a tag. BijiDatabase adds and subtracts the pairs of the files
+# it writes once per batch, from their tags before and after, and deletes
+# the pairs which drop to 0. Renamed and deleted tags are followed by the
+# cascades, like TAG_COUNTS. FILL_TAG_PAIRS backfills the table,
+# REBUILD_TAG_PAIRS is run by 'python -m bijibiji.bijidb.rebuild_tag_pairs'.
+FILL_TAG_PAIRS = """
+    INSERT INTO tag_pairs (tag_a, tag_b, count)
+    SELECT a.tag, b.tag, COUNT(*) FROM tag_biji AS a
+    JOIN tag_biji AS b ON b.filepath = a.filepath AND b.tag <> a.tag
+    GROUP BY a.tag, b.tag
+    """
+
+REBUILD_TAG_PAIRS = ['DELETE FROM tag_pairs', FILL_TAG_PAIRS]
+
+TAG_PAIRS = [
+    """
+    CREATE TABLE tag_pairs (
+        tag_a       text        NOT NULL
+                                REFERENCES tags(tag)
+                                ON UPDATE CASCADE
+                                ON DELETE CASCADE,
+        tag_b       text        NOT NULL
+                                REFERENCES tags(tag)
+                                ON UPDATE CASCADE
+                                ON DELETE CASCADE,
+        count       integer     NOT NULL,
+        PRIMARY KEY (tag_a, tag_b)
+    ) WITHOUT ROWID
+    """,
+    FILL_TAG_PAIRS,
+    """
+    CREATE INDEX tag_pairs_count ON tag_pairs(tag_a, count)
+    """,
+]
+
+# The fingerprint of the original file of each record, saved by the
+# scanner and used to find the files moved with their '.biji.json' files,
+# see bijiscan/moves.py. It follows a renamed record by the cascade.
+FINGERPRINTS = [
+    """
+    CREATE TABLE fingerprints (
+        filepath    text        PRIMARY KEY COLLATE NOCASE
+                                REFERENCES bijis(filepath)
+                                ON UPDATE CASCADE
+                                ON DELETE CASCADE,
+        size        integer     NOT NULL,
+        inode       integer     NOT NULL,
+        hash        text        NOT NULL,
+        mtime_ns    integer     NOT NULL
+    ) WITHOUT ROWID
+    """,
+]
+
+MIGRATIONS: List[Tuple[int, List[str]]] = [
+    (1, TAG_BIJI_PRIMARY_KEY),
+    (2, BIJI_JSON_STATS),
+    (3, TAG_COUNTS),
+    (4, TAG_PAIRS),
+    (5, FINGERPRINTS),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def needs_migration(conn: sqlite3.Connection,
+                    migrations: List[Tuple[int, List[str]]] = MIGRATIONS
+                    ) -> bool:
+    """
+    Whether migrate() has migrations to apply, raises RuntimeError if the
+    database is newer than migrations.
+    """
+    version = get_version(conn)
+    latest = migrations[-1][0] if migrations else 0
+    if version > latest:
+        raise RuntimeError(f'The database (version {version}) is newer than '
+                           f'this program (version {latest}).')
+    return version < latest
+
+
+def migrate(conn: sqlite3.Connection,
+            migrations: List[Tuple[int, List[str]]] = MIGRATIONS) -> int:
+    """
+    Applies the pending migrations, returns the new version.
+    migrations is MIGRATIONS, or compact_schema.MIGRATIONS.
+    """
+    version = get_version(conn)
+    if not needs_migration(conn, migrations):
+        return version
+
+    conn.commit()
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    conn.execute('PRAGMA foreign_keys = OFF')
+    try:
+        for number, statements in migrations:
+            if number <= version:
+                continue
+            conn.execute('BEGIN')
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                if conn.execute('PRAGMA foreign_key_check').fetchone():
+                    raise sqlite3.IntegrityError(
+                        f'Migration {number} breaks foreign keys.')
+                conn.execute(f'PRAGMA user_version = {number}')
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            version = number
+    finally:
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.isolation_level = isolation_level
+    return version
@@ -0,0 +1,114 @@
+"""
+Connection profiles, the PRAGMAs set by BijiDatabase.connect_db().
+
+    interactive     the GUI, WAL so that it can read while a scanner writes
+    bulk-load       the scanner, bigger caches and fewer checkpoints,
+                    the WAL is checkpointed and truncated on close
+    read-only       reports and lookups, writes are refused, and so is a
+                    database that needs an upgrade
+    legacy          the rollback journal with synchronous=FULL, the old
+                    behaviour, for a database on a network file system
+                    where WAL doesn't work
+
+The profile is chosen by the profile argument of connect_db(), otherwise
+by 'db_profile' in the config, see bijibiji/config.py. journal_mode is
+stored in the database file, the other settings only last as long as the
+connection. With WAL, synchronous=NORMAL doesn't sync on commit, only on
+checkpoints, and a power loss may lose the last commits but doesn't
+corrupt the database.
+
+Compare them by 'python -m bijibiji.bijibench.compare_profiles'.
+"""
+import sqlite3
+from typing import NamedTuple, Optional, Tuple
+
+
+class Profile(NamedTuple):
+    name: str
+    # None leaves a setting as it is.
+    journal_mode: Optional[str]
+    synchronous: Optional[str]
+    # Negative is in KiB, positive in pages.
+    cache_size: Optional[int]
+    mmap_size: Optional[int]
+    temp_store: Optional[str]
+    # Milliseconds to wait for a lock before 'database is locked'.
+    busy_timeout: Optional[int]
+    # Pages of WAL before an automatic checkpoint.
+    wal_autocheckpoint: Optional[int]
+    query_only: bool = False
+    checkpoint_on_close: bool = False
+
+
+PROFILES = {profile.name: profile for profile in [
+    Profile(name='interactive',
+            journal_mode='WAL',
+            synchronous='NORMAL',
+            cache_size=-16 * 1024,
+            mmap_size=64 * 1024 * 1024,
+            temp_store='MEMORY',
+            busy_timeout=5000,
+            wal_autocheckpoint=1000),
+    Profile(name='bulk-load',
+            journal_mode='WAL',
+            synchronous='NORMAL',
+            cache_size=-256 * 1024,
+            mmap_size=256 * 1024 * 1024,
+            temp_store='MEMORY',
+            busy_timeout=30000,
+            wal_autocheckpoint=10000,
+            checkpoint_on_close=True),
+    Profile(name='read-only',
+            journal_mode=None,
+            synchronous=None,
+            cache_size=-64 * 1024,
+            mmap_size=256 * 1024 * 1024,
+            temp_store='MEMORY',
+            busy_timeout=5000,
+            wal_autocheckpoint=None,
+            query_only=True),
+    Profile(name='legacy',
+            journal_mode='DELETE',
+            synchronous='FULL',
+            cache_size=-2000,
+            mmap_size=0,
+            temp_store='DEFAULT',
+            busy_timeout=5000,
+            wal_autocheckpoint=None),
+]}
+
+DEFAULT_PROFILE = 'interactive'
+
+
+def get_profile(name: Optional[str]) -> Profile:
+    try:
+        return PROFILES[name or DEFAULT_PROFILE]
+    except KeyError:
+        raise ValueError(f'Unknown profile: {name}, '
+                         f'one of {", ".join(PROFILES)}') from None
+
+
+def apply_profile(conn: sqlite3.Connection, profile: Profile) -> None:
+    if profile.journal_mode is not None:
+        try:
+            conn.execute(f'PRAGMA journal_mode = {profile.journal_mode}')
+        except sqlite3.OperationalError:
+            # Another connection is using the database,
+            # it keeps its journal mode.
+            pass
+    for pragma in ('synchronous', 'cache_size', 'mmap_size', 'temp_store',
+                   'busy_timeout', 'wal_autocheckpoint'):
+        value = getattr(profile, pragma)
+        if value is not None:
+            conn.execute(f'PRAGMA {pragma} = {value}')
+    conn.execute(f'PRAGMA query_only = {int(profile.query_only)}')
+
+
+def checkpoint(conn: sqlite3.Connection,
+               mode: str = 'PASSIVE') -> Tuple[int, int, int]:
+    """
+    Copies the WAL into the database, mode is PASSIVE, FULL, RESTART or
+    TRUNCATE. Returns (busy, pages in the WAL, pages checkpointed), the
+    same as PRAGMA wal_checkpoint, (0, -1, -1) if not in WAL mode.
+    """
+    return tuple(conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone())
@@ -0,0 +1,25 @@
+"""
+Counts the pairs of tags in tag_pairs again, e.g. nightly.
+
+    python -m bijibiji.bijidb.rebuild_tag_pairs
+
+The pairs are kept by BijiDatabase, the rebuild fixes them after the
+database was changed by a program which bypassed it.
+"""
+from .bijidatabase import BijiDatabase
+
+if __name__ == '__main__':
+
+    import time
+
+    from .. import change_cwd
+    change_cwd()
+
+    biji_db = BijiDatabase
+    biji_db.connect_db()
+    start = time.perf_counter()
+    biji_db.rebuild_tag_pairs()
+    pairs = biji_db.db.execute('SELECT COUNT(*) FROM tag_pairs').fetchone()[0]
+    print(f'{pairs // 2} pairs of tags in '
+          f'{time.perf_counter() - start:.1f}s.')
+    biji_db.close_db()
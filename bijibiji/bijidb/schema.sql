@@ -1,3 +1,5 @@
+-- The latest schema (PRAGMA user_version = 5), see migrations.py.
+
 CREATE TABLE bijis (
     filepath    text        PRIMARY KEY COLLATE NOCASE,
     filename    text        NOT NULL,
@@ -18,16 +20,75 @@ CREATE INDEX bijis_bijiMTime_idx ON bijis(bijiMTime);
 
 CREATE TABLE tags (
     tag         text        PRIMARY KEY,
-    usedAt      text        NOT NULL check(usedAt <> '')
+    usedAt      text        NOT NULL check(usedAt <> ''),
+    count       integer     NOT NULL DEFAULT 0
 );
 
 CREATE INDEX tags_usedAt ON tags(usedat);
+CREATE INDEX tags_count ON tags(count);
 
 CREATE TABLE tag_biji (
-    tag         text        REFERENCES tags(tag)
+    tag         text        NOT NULL
+                            REFERENCES tags(tag)
                             ON UPDATE CASCADE
                             ON DELETE CASCADE,
-    filepath    text        REFERENCES bijis(filepath)
+    filepath    text        NOT NULL COLLATE NOCASE
+                            REFERENCES bijis(filepath)
                             ON UPDATE CASCADE
-                            ON DELETE CASCADE
+                            ON DELETE CASCADE,
+    PRIMARY KEY (tag, filepath)
+) WITHOUT ROWID;
+
+CREATE INDEX tag_biji_filepath_idx ON tag_biji(filepath, tag);
+
+CREATE TRIGGER tag_biji_insert AFTER INSERT ON tag_biji
+BEGIN
+    UPDATE tags SET count = count + 1 WHERE tag = NEW.tag;
+END;
+
+CREATE TRIGGER tag_biji_delete AFTER DELETE ON tag_biji
+BEGIN
+    UPDATE tags SET count = count - 1 WHERE tag = OLD.tag;
+END;
+
+CREATE TRIGGER tag_biji_update AFTER UPDATE OF tag ON tag_biji
+WHEN OLD.tag <> NEW.tag
+AND EXISTS (SELECT 1 FROM tags WHERE tag = OLD.tag)
+BEGIN
+    UPDATE tags SET count = count - 1 WHERE tag = OLD.tag;
+    UPDATE tags SET count = count + 1 WHERE tag = NEW.tag;
+END;
+
+CREATE TABLE tag_pairs (
+    tag_a       text        NOT NULL
+                            REFERENCES tags(tag)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE,
+    tag_b       text        NOT NULL
+                            REFERENCES tags(tag)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE,
+    count       integer     NOT NULL,
+    PRIMARY KEY (tag_a, tag_b)
+) WITHOUT ROWID;
+
+CREATE INDEX tag_pairs_count ON tag_pairs(tag_a, count);
+
+CREATE TABLE biji_json_stats (
+    filepath    text        PRIMARY KEY COLLATE NOCASE,
+    mtime_ns    integer     NOT NULL,
+    size        integer     NOT NULL,
+    inode       integer     NOT NULL,
+    bijiMTime   text        NOT NULL
 );
+
+CREATE TABLE fingerprints (
+    filepath    text        PRIMARY KEY COLLATE NOCASE
+                            REFERENCES bijis(filepath)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE,
+    size        integer     NOT NULL,
+    inode       integer     NOT NULL,
+    hash        text        NOT NULL,
+    mtime_ns    integer     NOT NULL
+) WITHOUT ROWID;
@@ -0,0 +1,337 @@
+"""
+A small query language over tags, compiled to SQL on the 'tag_biji' table.
+
+    photo AND (travel OR "new york") AND NOT private
+    photo travel -> the same as: photo AND travel
+
+Keywords (AND, OR, NOT) are case-insensitive, a tag containing spaces,
+parentheses or looking like a keyword must be quoted with " or '.
+NOT binds tighter than AND, AND binds tighter than OR.
+"""
+import sqlite3
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+KEYWORDS = ('AND', 'OR', 'NOT')
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+class Tag(NamedTuple):
+    name: str
+
+
+class And(NamedTuple):
+    operands: List['Node']
+
+
+class Or(NamedTuple):
+    operands: List['Node']
+
+
+class Not(NamedTuple):
+    operand: 'Node'
+
+
+Node = Union[Tag, And, Or, Not]
+
+# A token is (kind, text), kind is one of '(', ')', 'AND', 'OR', 'NOT', 'TAG'.
+Token = Tuple[str, str]
+
+
+def tokenize(expression: str) -> List[Token]:
+    tokens = []
+    i = 0
+    length = len(expression)
+    while i < length:
+        char = expression[i]
+        if char.isspace():
+            i += 1
+        elif char in '()':
+            tokens.append((char, char))
+            i += 1
+        elif char in '"\'':
+            chars = []
+            i += 1
+            while i < length and expression[i] != char:
+                if expression[i] == '\\' and i + 1 < length:
+                    i += 1
+                chars.append(expression[i])
+                i += 1
+            if i == length:
+                raise QuerySyntaxError(f'Unclosed quote: {expression}')
+            tokens.append(('TAG', ''.join(chars)))
+            i += 1
+        else:
+            start = i
+            while i < length and not expression[i].isspace() \
+                    and expression[i] not in '()"\'':
+                i += 1
+            word = expression[start:i]
+            if word.upper() in KEYWORDS:
+                tokens.append((word.upper(), word))
+            else:
+                tokens.append(('TAG', word))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: List[Token]) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[str]:
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][0]
+        return None
+
+    def take(self) -> Token:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            raise QuerySyntaxError('Empty query')
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError(f'Unexpected: {self.take()[1]}')
+        return node
+
+    def parse_or(self) -> Node:
+        operands = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.take()
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def parse_and(self) -> Node:
+        operands = [self.parse_not()]
+        while self.peek() in ('AND', 'NOT', 'TAG', '('):
+            if self.peek() == 'AND':
+                self.take()
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def parse_not(self) -> Node:
+        if self.peek() == 'NOT':
+            self.take()
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self) -> Node:
+        kind = self.peek()
+        if kind is None:
+            raise QuerySyntaxError('Unexpected end of query')
+        if kind == 'TAG':
+            return Tag(self.take()[1])
+        if kind == '(':
+            self.take()
+            node = self.parse_or()
+            if self.peek() != ')':
+                raise QuerySyntaxError("Missing ')'")
+            self.take()
+            return node
+        raise QuerySyntaxError(f'Unexpected: {self.take()[1]}')
+
+
+def parse(expression: str) -> Node:
+    return _Parser(tokenize(expression)).parse()
+
+
+def tags_in(node: Node) -> List[str]:
+    if isinstance(node, Tag):
+        return [node.name]
+    if isinstance(node, Not):
+        return tags_in(node.operand)
+    tags = []
+    for operand in node.operands:
+        tags.extend(tags_in(operand))
+    return tags
+
+
+class QueryStatements:
+    """
+    The SQL used by the compiler, key is the column identifying a file.
+    Overridden by compact_schema.CompactQueryStatements.
+    """
+    TAG_SET = 'SELECT filepath AS key FROM tag_biji WHERE tag = ?'
+
+    TAG_EXISTS = \
+        'EXISTS (SELECT 1 FROM tag_biji WHERE tag = ? AND filepath = {key})'
+
+    ALL_FILES = 'SELECT filepath AS key FROM bijis'
+
+    COUNT_FILES = 'SELECT COUNT(*) FROM bijis'
+
+    TAG_COUNTS = 'SELECT tag, count FROM tags WHERE tag IN ({})'
+
+    RESULT = 'SELECT DISTINCT key AS filepath FROM ({}) ' \
+             'ORDER BY filepath LIMIT ? OFFSET ?'
+
+    RESULT_COUNT = 'SELECT COUNT(DISTINCT key) FROM ({})'
+
+
+class _Compiler:
+    """
+    Compiles a query to
+        SELECT ... FROM (<driver>) WHERE <predicate>
+    where the driver is a small superset of the result, e.g. the files of
+    the least frequent tag of an AND, and the predicate is checked with
+    index lookups on tag_biji for every file from the driver.
+    """
+
+    def __init__(self,
+                 conn: sqlite3.Connection,
+                 statements: type(QueryStatements),
+                 tags: List[str]) -> None:
+        self.conn = conn
+        self.sql = statements
+        self.counts = self.get_counts(tags)
+        self._total = None
+
+    def get_counts(self, tags: List[str]) -> Dict[str, int]:
+        tags = list(set(tags))
+        placeholders = ', '.join('?' * len(tags))
+        counts = dict.fromkeys(tags, 0)
+        for tag, count in self.conn.execute(
+                self.sql.TAG_COUNTS.format(placeholders), tags):
+            counts[tag] = count
+        return counts
+
+    @property
+    def total(self) -> int:
+        if self._total is None:
+            self._total = self.conn.execute(self.sql.COUNT_FILES).fetchone()[0]
+        return self._total
+
+    def cost(self, node: Node) -> int:
+        """ The estimated number of files matching node. """
+        if isinstance(node, Tag):
+            return self.counts[node.name]
+        if isinstance(node, Not):
+            return self.total
+        costs = [self.cost(operand) for operand in node.operands]
+        if isinstance(node, And):
+            return min(costs)
+        return sum(costs)
+
+    def exact(self, node: Node) -> bool:
+        """ Whether the driver of node is exactly the result of node. """
+        if isinstance(node, Tag):
+            return True
+        if isinstance(node, Or):
+            return all(self.exact(operand) for operand in node.operands)
+        return False
+
+    def driver_operand(self, node: And) -> Optional[Node]:
+        """ The operand of the least cost that has a driver. """
+        return min((operand for operand in node.operands
+                    if self.driver(operand) is not None),
+                   key=self.cost, default=None)
+
+    def driver(self, node: Node) -> Optional[Tuple[str, list]]:
+        """ SQL selecting a superset of the files matching node. """
+        if isinstance(node, Tag):
+            return self.sql.TAG_SET, [node.name]
+        if isinstance(node, Not):
+            return None
+        if isinstance(node, And):
+            operand = self.driver_operand(node)
+            return None if operand is None else self.driver(operand)
+        parts = [self.driver(operand) for operand in node.operands]
+        if any(part is None for part in parts):
+            return None
+        sql = ' UNION '.join(part[0] for part in parts)
+        params = [param for part in parts for param in part[1]]
+        return sql, params
+
+    def predicate(self, node: Node, key: str) -> Tuple[str, list]:
+        if isinstance(node, Tag):
+            return self.sql.TAG_EXISTS.format(key=key), [node.name]
+        if isinstance(node, Not):
+            sql, params = self.predicate(node.operand, key)
+            return f'NOT {sql}', params
+        if isinstance(node, And):
+            # The least frequent tag fails first.
+            operands = sorted(node.operands, key=self.cost)
+            joiner = ' AND '
+        else:
+            # The most frequent tag succeeds first.
+            operands = sorted(node.operands, key=self.cost, reverse=True)
+            joiner = ' OR '
+        parts = [self.predicate(operand, key) for operand in operands]
+        sql = joiner.join(part[0] for part in parts)
+        params = [param for part in parts for param in part[1]]
+        return f'({sql})', params
+
+    def compile(self, node: Node) -> Tuple[str, list]:
+        """ Returns the SQL selecting the keys of the matching files. """
+        driver = self.driver(node)
+        rest = node
+        if driver is None:
+            driver = self.sql.ALL_FILES, []
+        elif self.exact(node):
+            rest = None
+        elif isinstance(node, And):
+            # No need to check the operand that the driver comes from.
+            operand = self.driver_operand(node)
+            if self.exact(operand):
+                others = [other for other in node.operands
+                          if other is not operand]
+                rest = others[0] if len(others) == 1 else And(others)
+
+        sql = f'SELECT candidates.key AS key FROM ({driver[0]}) AS candidates'
+        params = list(driver[1])
+        if rest is not None:
+            predicate, predicate_params = \
+                self.predicate(rest, 'candidates.key')
+            sql += f' WHERE {predicate}'
+            params += predicate_params
+        return sql, params
+
+
+def compile_query(conn: sqlite3.Connection,
+                  expression: str,
+                  statements: type(QueryStatements) = QueryStatements
+                  ) -> Tuple[str, list]:
+    node = parse(expression)
+    return _Compiler(conn, statements, tags_in(node)).compile(node)
+
+
+def query_bijis(conn: sqlite3.Connection,
+                expression: str,
+                limit: Optional[int] = None,
+                offset: int = 0,
+                statements: type(QueryStatements) = QueryStatements
+                ) -> Iterator[str]:
+    """
+    Yields the filepaths matching expression in the order of filepath,
+    the rows are read from the cursor as they are consumed.
+    """
+    sql, params = compile_query(conn, expression, statements)
+    params += [-1 if limit is None else limit, offset]
+    for row in conn.execute(statements.RESULT.format(sql), params):
+        yield row[0]
+
+
+def count_bijis(conn: sqlite3.Connection,
+                expression: str,
+                statements: type(QueryStatements) = QueryStatements) -> int:
+    sql, params = compile_query(conn, expression, statements)
+    return conn.execute(
+        statements.RESULT_COUNT.format(sql), params).fetchone()[0]
+
+
+if __name__ == '__main__':
+    import sys
+
+    from .. import change_cwd
+    from .bijidatabase import BijiDatabase
+
+    change_cwd()
+    BijiDatabase.connect_db()
+    for filepath in BijiDatabase.query_bijis(' '.join(sys.argv[1:])):
+        print(filepath)
+    BijiDatabase.close_db()
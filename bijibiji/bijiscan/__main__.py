@@ -0,0 +1,378 @@
+"""
+The headless scanner, one JSON object per line on stdout.
+
+    python -m bijibiji.bijiscan scan [--root Documents] [--full]
+    python -m bijibiji.bijiscan update [--dry-run] [--batch-size 1000]
+    python -m bijibiji.bijiscan prune-sidecars [--dry-run]
+    python -m bijibiji.bijiscan prune-records [--dry-run]
+    python -m bijibiji.bijiscan list [--root Documents]
+
+With --all-roots, the command runs on every root of bijibiji/roots.py,
+each in a process of its own and all at once, the lines get a "root" key
+with the name of the root, and the last line is the summary of all roots.
+
+Every line has an "event" key, e.g.
+    {"event": "not_in_database", "filepath": "a/b.txt"}
+and the last line is {"event": "summary", ...} with the counts and the
+time. update first moves the records of the files moved along with their
+'.biji.json' files, see moves.py, with a "moved" event for each.
+--progress prints the progress of the scan to stderr.
+
+A '.biji.json' that can't be read is reported by an "error" event and
+skipped. --dry-run writes nothing, not even the stat cache of the scan:
+it opens the database with the read-only profile, and fails if there is
+no database or it needs an upgrade, instead of creating or upgrading it.
+
+Exit codes:
+    0   nothing found, or everything found was handled
+    1   something found and not handled (scan, or --dry-run)
+    2   wrong arguments
+    3   some files could not be read or handled, see the "error" events,
+        or the command failed
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from .. import BASE_PATH, FILES_FOLDER
+from ..bijidb.bijidatabase import BijiDatabase, BATCH_SIZE
+from ..bijidb.profiles import PROFILES
+from ..bijitags.biji import Biji
+from ..roots import Root, get_roots
+from . import moves
+from .bijiscanner import load_bijis
+from .scan_engine import ScanResult, WALKED, default_jobs, iter_scan, \
+    nocase
+
+EXIT_OK = 0
+EXIT_FOUND = 1
+EXIT_ERROR = 3
+
+# Seconds between two progress lines.
+PROGRESS_INTERVAL = 1.0
+
+# The findings of a scan, in the order of ScanResult.
+FINDINGS = ('files_not_exist', 'not_in_database', 'need_to_update',
+            'biji_json_not_exists')
+
+
+def emit(event: str, **fields) -> None:
+    print(json.dumps(dict(event=event, **fields), ensure_ascii=False))
+
+
+class Progress:
+    """ Progress lines on stderr, if enabled. """
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.start = self.last = time.monotonic()
+        self.total = 0
+
+    def walked(self, files: int, to_parse: int) -> None:
+        self.total = files
+        if self.enabled:
+            print(f'{files} files found, {to_parse} to parse',
+                  file=sys.stderr)
+
+    def update(self, checked: int) -> None:
+        now = time.monotonic()
+        if not self.enabled or now - self.last < PROGRESS_INTERVAL:
+            return
+        self.last = now
+        total = f'/{self.total}' if self.total else ''
+        print(f'{checked}{total} files checked, '
+              f'{checked / (now - self.start):.0f} files/s',
+              file=sys.stderr)
+
+
+def run_scan(db: type(BijiDatabase), args, emit_findings: bool) -> ScanResult:
+    """
+    Returns the result of the scan, emits the findings as they come, and
+    the files that can't be read in any case.
+    """
+    result = ScanResult([], [], [], [], [], {}, {})
+    progress = Progress(args.progress)
+    for item in iter_scan(db, args.root, args.jobs, args.full,
+                          save_cache=not args.dry_run):
+        if item.kind == WALKED:
+            progress.walked(*item.detail)
+            continue
+        if item.kind == 'errors':
+            result.errors[item.filepath] = item.detail[0]
+            emit('error', filepath=item.filepath, error=item.detail[0])
+            continue
+        getattr(result, item.kind).append(item.filepath)
+        if item.kind == 'files':
+            progress.update(len(result.files))
+            continue
+        if item.kind == 'need_to_update':
+            result.outdated_mtimes[item.filepath] = item.detail
+        if not emit_findings:
+            continue
+        if item.kind == 'need_to_update':
+            emit(item.kind, filepath=item.filepath,
+                 mtime=item.detail[0], biji_mtime=item.detail[1])
+        else:
+            emit(item.kind, filepath=item.filepath)
+    return result
+
+
+def load_or_report(files: List[str], event: str, errors: Dict[str, str]):
+    """ load_bijis() that emits event for each file, or an error. """
+    for file in files:
+        for biji_dict in load_bijis([file], errors=errors):
+            yield biji_dict
+            emit(event, filepath=file)
+        if file in errors:
+            emit('error', filepath=file, error=errors[file])
+
+
+def exit_code(errors: int, found: bool) -> int:
+    if errors:
+        return EXIT_ERROR
+    return EXIT_FOUND if found else EXIT_OK
+
+
+def cmd_scan(db: type(BijiDatabase), args) -> dict:
+    result = run_scan(db, args, emit_findings=True)
+    summary = {kind: len(getattr(result, kind)) for kind in FINDINGS}
+    summary['files'] = len(result.files)
+    summary['errors'] = len(result.errors)
+    summary['exit'] = exit_code(
+        len(result.errors), any(summary[kind] for kind in FINDINGS))
+    return summary
+
+
+def cmd_update(db: type(BijiDatabase), args) -> dict:
+    """
+    Moves the records of the moved files, adds the new files and updates
+    the outdated records.
+    """
+    result = run_scan(db, args, emit_findings=args.dry_run)
+    found = moves.find_moves(db, result.biji_json_not_exists,
+                             result.not_in_database, args.jobs)
+    for move in found:
+        emit('moved', filepath=move.old, new_filepath=move.new)
+    summary = dict(files=len(result.files), moved=len(found),
+                   not_in_database=len(result.not_in_database) - len(found),
+                   need_to_update=len(result.need_to_update),
+                   errors=len(result.errors))
+    if args.dry_run:
+        summary['exit'] = exit_code(
+            len(result.errors),
+            bool(found or result.not_in_database or result.need_to_update))
+        return summary
+
+    result = moves.without_moves(result, found, moves.apply_moves(db, found))
+    summary['need_to_update'] = len(result.need_to_update)
+    errors = dict(result.errors)
+    db.insert_bijis(load_or_report(result.not_in_database, 'added', errors),
+                    args.batch_size)
+    db.update_bijis(load_or_report(result.need_to_update, 'updated', errors),
+                    args.batch_size)
+    summary['fingerprinted'] = moves.save_fingerprints(db, result.files,
+                                                       args.jobs)
+    summary['errors'] = len(errors)
+    summary['exit'] = exit_code(len(errors), False)
+    return summary
+
+
+def cmd_prune_sidecars(db: type(BijiDatabase), args) -> dict:
+    """ Deletes the '.biji.json' files whose original file is not found. """
+    result = run_scan(db, args, emit_findings=args.dry_run)
+    files = result.files_not_exist
+    summary = dict(files_not_exist=len(files), errors=len(result.errors))
+    if args.dry_run:
+        summary['exit'] = exit_code(len(result.errors), bool(files))
+        return summary
+
+    errors = len(result.errors)
+    for file in files:
+        try:
+            Biji.get_biji_json_path(file).unlink()
+        except OSError as e:
+            errors += 1
+            emit('error', filepath=file, error=f'{type(e).__name__}: {e}')
+            continue
+        emit('deleted', filepath=file)
+    summary['errors'] = errors
+    summary['exit'] = exit_code(errors, False)
+    return summary
+
+
+def cmd_prune_records(db: type(BijiDatabase), args) -> dict:
+    """ Deletes the records whose '.biji.json' file is not found. """
+    result = run_scan(db, args, emit_findings=args.dry_run)
+    files = result.biji_json_not_exists
+    summary = dict(biji_json_not_exists=len(files),
+                   errors=len(result.errors))
+    if args.dry_run:
+        summary['exit'] = exit_code(len(result.errors), bool(files))
+        return summary
+
+    db.delete_bijis(files, args.batch_size)
+    for file in files:
+        emit('deleted', filepath=file)
+    summary['exit'] = exit_code(len(result.errors), False)
+    return summary
+
+
+def cmd_list(db: type(BijiDatabase), args) -> dict:
+    """ The records in the database. """
+    prefix = nocase(args.root + os.sep) if args.root else ''
+    count = 0
+    for row in db.get_all_filepaths():
+        filepath = row['filepath']
+        if nocase(filepath).startswith(prefix):
+            count += 1
+            emit('record', filepath=filepath)
+    return dict(records=count, exit=EXIT_OK)
+
+
+COMMANDS = {
+    'scan': cmd_scan,
+    'update': cmd_update,
+    'prune-sidecars': cmd_prune_sidecars,
+    'prune-records': cmd_prune_records,
+    'list': cmd_list,
+}
+
+
+def root_argv(args, root: Root, jobs: int) -> List[str]:
+    """ The arguments of the process of a root. """
+    argv = [args.command, '--home', root.path, '--jobs', str(jobs),
+            '--batch-size', str(args.batch_size)]
+    if args.profile:
+        argv += ['--profile', args.profile]
+    if args.root:
+        argv += ['--root', args.root]
+    for flag in ('full', 'dry_run', 'progress'):
+        if getattr(args, flag):
+            argv.append('--' + flag.replace('_', '-'))
+    return argv
+
+
+def run_roots(args) -> int:
+    """
+    Runs the command on every root in parallel, passing on their lines
+    with the root added. Without --jobs, the roots share the CPUs.
+    """
+    roots = get_roots()
+    jobs = args.jobs or max(1, default_jobs() // len(roots))
+    lock = threading.Lock()
+    summaries = {}
+
+    def relay(root: Root, process: subprocess.Popen) -> None:
+        for line in process.stdout:
+            try:
+                fields = json.loads(line)
+            except ValueError:
+                continue
+            if fields['event'] == 'summary':
+                summaries[root.name] = fields
+            with lock:
+                print(json.dumps(dict(fields, root=root.name),
+                                 ensure_ascii=False), flush=True)
+
+    start = time.monotonic()
+    threads = []
+    for root in roots:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'bijibiji.bijiscan',
+             *root_argv(args, root, jobs)],
+            cwd=str(BASE_PATH), stdout=subprocess.PIPE,
+            env=dict(os.environ, PYTHONIOENCODING='utf-8'),
+            encoding='utf-8')
+        thread = threading.Thread(target=relay, args=(root, process))
+        thread.start()
+        threads.append((thread, process))
+    codes = []
+    for thread, process in threads:
+        thread.join()
+        codes.append(process.wait())
+
+    exit_code = max(codes)
+    counts = {}
+    for summary in summaries.values():
+        for key, value in summary.items():
+            if isinstance(value, int) and key != 'exit' \
+                    and not isinstance(value, bool):
+                counts[key] = counts.get(key, 0) + value
+    emit('summary', command=args.command, dry_run=args.dry_run,
+         roots=len(roots), seconds=round(time.monotonic() - start, 3),
+         exit=exit_code, **counts)
+    return exit_code
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='python -m bijibiji.bijiscan',
+        description="Compares the '.biji.json' files with the database.")
+    parser.add_argument('command', choices=list(COMMANDS))
+    parser.add_argument('--root', default='',
+                        help='only the files under this folder, '
+                             'relative to HOME')
+    parser.add_argument('--home', default=str(FILES_FOLDER),
+                        help='the HOME folder, where the database is')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='number of worker processes, '
+                             'defaults to the number of CPUs')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='records written in one transaction')
+    parser.add_argument('--full', action='store_true',
+                        help="re-read every '.biji.json', "
+                             "ignoring the stat cache")
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only tell what would be done')
+    parser.add_argument('--progress', action='store_true',
+                        help='print the progress to stderr')
+    parser.add_argument('--profile', default=None,
+                        choices=list(PROFILES),
+                        help="the connection profile, see "
+                             "bijidb/profiles.py, defaults to 'db_profile' "
+                             "of the config, read-only with --dry-run")
+    parser.add_argument('--all-roots', action='store_true',
+                        help='every root of the config, in parallel, '
+                             'instead of --home')
+    args = parser.parse_args(argv)
+    args.root = os.path.normpath(args.root) if args.root else ''
+    if args.all_roots:
+        try:
+            return run_roots(args)
+        except ValueError as e:
+            parser.error(str(e))
+
+    start = time.monotonic()
+    db = BijiDatabase
+    try:
+        os.chdir(args.home)
+        if args.dry_run:
+            db.connect_db(profile='read-only')
+        else:
+            db.open_db(profile=args.profile)
+        try:
+            summary = COMMANDS[args.command](db, args)
+        finally:
+            db.close_db()
+    except Exception as e:
+        # Not EXIT_FOUND, which is what an uncaught exception exits with.
+        traceback.print_exc()
+        emit('error', error=f'{type(e).__name__}: {e}')
+        summary = dict(exit=EXIT_ERROR)
+
+    seconds = time.monotonic() - start
+    exit_code = summary.pop('exit')
+    emit('summary', command=args.command, dry_run=args.dry_run,
+         seconds=round(seconds, 3), exit=exit_code, **summary)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,180 @@
+import time
+from collections import defaultdict
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional
 
+from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtWidgets import QWidget, QHBoxLayout, QGroupBox, QListWidget, \
-    QVBoxLayout, QPushButton, QApplication, QListWidgetItem, QMessageBox
+    QVBoxLayout, QPushButton, QApplication, QMessageBox, QProgressBar, \
+    QLabel
 
 from ..bijidb.bijidatabase import BijiDatabase
 from ..bijitags.biji import Biji
+from . import moves
+from .bijiscanner import load_bijis
+from .scan_engine import WALKED, ScanResult, iter_scan
+
+# Seconds between two updates of the lists while scanning.
+EMIT_INTERVAL = 0.2
+
+# Number of files handled by an action between two progress updates,
+# it is also the point where a cancelled action stops.
+ACTION_CHUNK = 200
+
+# The kinds held until the end of the scan, for the moves found in them.
+MOVE_KINDS = ('not_in_database', 'biji_json_not_exists')
+
+
+class ScanWorker(QThread):
+    """
+    Runs iter_scan() on a connection of its own, then applies the moves
+    of the files found with their '.biji.json' before emitting the new
+    files and the records without '.biji.json'.
+    """
+    # kind (a field name of ScanResult), filepaths
+    found = pyqtSignal(str, list)
+    # number of files, number of files to parse
+    walked = pyqtSignal(int, int)
+    # files checked, files per second
+    progress = pyqtSignal(int, float)
+
+    def __init__(self, full: bool = False, parent=None) -> None:
+        super().__init__(parent)
+        self.full = full
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def run(self) -> None:
+        db = BijiDatabase.new_connection()
+        pending: Dict[str, List[str]] = defaultdict(list)
+        held: Dict[str, List[str]] = defaultdict(list)
+        files = []
+        start = last_emit = time.monotonic()
+        items = iter_scan(db, full=self.full)
+        try:
+            for item in items:
+                if self.cancelled:
+                    break
+                if item.kind == WALKED:
+                    self.walked.emit(*item.detail)
+                elif item.kind == 'files':
+                    files.append(item.filepath)
+                elif item.kind == 'errors':
+                    print(item.filepath, f'... {item.detail[0]}')
+                elif item.kind in MOVE_KINDS:
+                    held[item.kind].append(item.filepath)
+                else:
+                    pending[item.kind].append(item.filepath)
+
+                now = time.monotonic()
+                if now - last_emit >= EMIT_INTERVAL:
+                    self.emit_pending(pending)
+                    self.progress.emit(len(files),
+                                       len(files) / (now - start))
+                    last_emit = now
+            if not self.cancelled:
+                self.apply_moves(db, held, pending)
+        finally:
+            items.close()
+            db.close_db()
+        if self.cancelled:
+            pending.update(held)
+        self.emit_pending(pending)
+        self.progress.emit(len(files),
+                           len(files) / max(time.monotonic() - start, 1e-6))
+
+    @staticmethod
+    def apply_moves(db: type(BijiDatabase),
+                    held: Dict[str, List[str]],
+                    pending: Dict[str, List[str]]) -> None:
+        """
+        Applies the moves found in held, adds what is left of it to
+        pending, with the moved records to update.
+        """
+        result = ScanResult(
+            files=[], files_not_exist=[],
+            not_in_database=held['not_in_database'], need_to_update=[],
+            biji_json_not_exists=held['biji_json_not_exists'],
+            outdated_mtimes={}, errors={})
+        found = moves.find_moves(db, result.biji_json_not_exists,
+                                 result.not_in_database)
+        result = moves.without_moves(result, found,
+                                     moves.apply_moves(db, found))
+        for move in found:
+            print(move.old, '->', move.new, '... moved')
+        for kind in MOVE_KINDS + ('need_to_update',):
+            pending[kind] += getattr(result, kind)
+
+    def emit_pending(self, pending: Dict[str, List[str]]) -> None:
+        for kind, filepaths in pending.items():
+            if filepaths:
+                self.found.emit(kind, filepaths)
+        pending.clear()
+
+
+class ActionWorker(QThread):
+    """ Applies an action of BijiScanner to files, a chunk at a time. """
+    # files done, all files
+    progress = pyqtSignal(int, int)
+    # the files done, when finished or cancelled
+    done = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, action: str, files: List[str], parent=None) -> None:
+        super().__init__(parent)
+        self.action = action
+        self.files = files
+        self.cancelled = False
 
+    def cancel(self) -> None:
+        self.cancelled = True
 
-# noinspection PyArgumentList,PyCallByClass
+    def run(self) -> None:
+        db = BijiDatabase.new_connection()
+        done = []
+        try:
+            for i in range(0, len(self.files), ACTION_CHUNK):
+                if self.cancelled:
+                    break
+                chunk = self.files[i:i + ACTION_CHUNK]
+                self.apply(db, chunk)
+                done.extend(chunk)
+                self.progress.emit(len(done), len(self.files))
+        except Exception as e:
+            self.failed.emit(f'{type(e).__name__}: {e}')
+        finally:
+            db.close_db()
+            self.done.emit(done)
+
+    def apply(self, db: type(BijiDatabase), files: List[str]) -> None:
+        errors: Dict[str, str] = {}
+        if self.action == 'add':
+            db.insert_bijis(load_bijis(files, errors=errors))
+        elif self.action == 'update':
+            db.update_bijis(load_bijis(files, errors=errors))
+        elif self.action == 'delete_records':
+            db.delete_bijis(files)
+        elif self.action == 'delete_biji_json':
+            for file in files:
+                Path(Biji.get_biji_json_path(file)).unlink()
+        for file, error in errors.items():
+            print(file, f'... {error}')
+        if self.action in ('add', 'update'):
+            # The fingerprints of the records written, for find_moves().
+            moves.save_fingerprints(
+                db, [file for file in files if file not in errors])
+
+
+# noinspection PyArgumentList,PyCallByClass,PyUnresolvedReferences
 class BijiScanner(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, full=False):
         super().__init__(parent)
+        self.full = full
 
         self.db = BijiDatabase
-        try:
-            self.db.connect_db()
-        except FileNotFoundError:
-            BijiDatabase.create_db()
-            self.db.connect_db()
+        self.db.open_db()
 
         self.no_file_box = QGroupBox()
         self.new_file_box = QGroupBox()
@@ -30,26 +186,29 @@ class BijiScanner(QWidget):
         self.outdated_list = QListWidget(self.outdated_box)
         self.no_json_list = QListWidget(self.no_json_box)
 
-        self.files_not_exists = []
-        self.not_in_database = []
-        self.need_to_update = []
-        self.biji_json_not_exists = []
+        # kind of ScanItem -> list
+        self.lists = {
+            'files_not_exist': self.no_file_list,
+            'not_in_database': self.new_file_list,
+            'need_to_update': self.outdated_list,
+            'biji_json_not_exists': self.no_json_list,
+        }
 
-        self.scan_all()
-        self.get_biji_json_not_exists()
+        self.progress_bar = QProgressBar()
+        self.status_label = QLabel('Scanning...')
+        self.cancel_btn = QPushButton('Cancel')
+        self.cancel_btn.clicked.connect(self.cancel)
 
-        self.update_list(self.no_file_list, self.files_not_exists)
-        self.update_list(self.new_file_list, self.not_in_database)
-        self.update_list(self.outdated_list, self.need_to_update)
-        self.update_list(self.no_json_list, self.biji_json_not_exists)
+        self.scan_worker: Optional[ScanWorker] = None
+        self.action_worker: Optional[ActionWorker] = None
+        self.action_list: Optional[QListWidget] = None
 
         self._init_ui_()
+        self.start_scan()
 
     def _init_ui_(self) -> None:
         self.setWindowTitle('BijiScanner - bijibiji')
 
-        layout = QHBoxLayout()
-
         self.no_file_box.setTitle('Files not exist')
         self.no_file_box.setToolTip(
             "'.biji.json' file exists, but the corresponding \n"
@@ -104,56 +263,125 @@ class BijiScanner(QWidget):
         no_json_box_layout.addLayout(no_json_box_buttons)
         self.no_json_box.setLayout(no_json_box_layout)
 
-        layout.addWidget(self.no_file_box)
-        layout.addWidget(self.new_file_box)
-        layout.addWidget(self.outdated_box)
-        layout.addWidget(self.no_json_box)
+        boxes = QHBoxLayout()
+        boxes.addWidget(self.no_file_box)
+        boxes.addWidget(self.new_file_box)
+        boxes.addWidget(self.outdated_box)
+        boxes.addWidget(self.no_json_box)
+
+        status = QHBoxLayout()
+        status.addWidget(self.progress_bar, 1)
+        status.addWidget(self.status_label)
+        status.addWidget(self.cancel_btn)
+
+        layout = QVBoxLayout()
+        layout.addLayout(boxes)
+        layout.addLayout(status)
         self.setLayout(layout)
 
     def closeEvent(self, event):
+        for worker in (self.scan_worker, self.action_worker):
+            if worker is not None:
+                worker.cancel()
+                worker.wait()
         self.db.close_db()
         event.accept()
 
+    def start_scan(self) -> None:
+        """ The lists are filled as the results come. """
+        self.progress_bar.setRange(0, 0)
+        self.scan_worker = ScanWorker(self.full, self)
+        self.scan_worker.found.connect(self.add_found)
+        self.scan_worker.walked.connect(self.show_walked)
+        self.scan_worker.progress.connect(self.show_scan_progress)
+        self.scan_worker.finished.connect(self.scan_finished)
+        self.scan_worker.start()
+
+    def add_found(self, kind: str, filepaths: List[str]) -> None:
+        self.lists[kind].addItems(filepaths)
+
+    def show_walked(self, files: int, to_parse: int) -> None:
+        self.progress_bar.setRange(0, files)
+
+    def show_scan_progress(self, checked: int, rate: float) -> None:
+        if self.progress_bar.maximum():
+            self.progress_bar.setValue(checked)
+        self.status_label.setText(
+            f'{checked} files checked, {rate:.0f} files/s')
+
+    def scan_finished(self) -> None:
+        cancelled = self.scan_worker.cancelled
+        self.scan_worker = None
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(1)
+        self.status_label.setText(
+            f'{self.status_label.text()}'
+            f'{" (cancelled)" if cancelled else ", done"}')
+        self.update_busy()
+
+    def cancel(self) -> None:
+        if self.action_worker is not None:
+            self.action_worker.cancel()
+        elif self.scan_worker is not None:
+            self.scan_worker.cancel()
+
     @staticmethod
-    def update_list(list_widget: QListWidget, items: List[str]) -> None:
-        if not items:
-            list_widget.parent().setEnabled(False)
+    def items_of(list_widget: QListWidget) -> List[str]:
+        return [list_widget.item(i).text()
+                for i in range(list_widget.count())]
+
+    def start_action(self, action: str, list_widget: QListWidget) -> None:
+        """ Acts on the files in the list so far, even while scanning. """
+        files = self.items_of(list_widget)
+        if not files or self.action_worker is not None:
             return
-        for item in items:
-            list_item = QListWidgetItem(list_widget)
-            list_item.setText(item)
-
-    def scan_all(self) -> None:
-        end = -len('.biji.json')
-
-        biji_paths = Path('.').glob('**/*.biji.json')
-        for biji_path in biji_paths:
-            file = str(biji_path)[:end]
-            if Path(file).exists():
-                biji = Biji.from_file(file)
-            else:
-                self.files_not_exists.append(file)
-                continue
-
-            mtime = self.db.get_mtime(file)
-            if not mtime:
-                self.not_in_database.append(file)
-                continue
-
-            if biji.bijiMTime > mtime:
-                self.need_to_update.append(file)
-
-    def get_biji_json_not_exists(self) -> None:
-        for row in self.db.get_all_filepaths():
-            filepath = row['filepath']
-            if not Biji.get_biji_json_path(filepath).exists():
-                self.biji_json_not_exists.append(filepath)
+        self.action_list = list_widget
+        self.action_worker = ActionWorker(action, files, self)
+        self.action_worker.progress.connect(self.show_action_progress)
+        self.action_worker.failed.connect(self.show_failed_message)
+        self.action_worker.done.connect(self.action_done)
+        self.action_worker.start()
+        self.update_busy()
+
+    def show_action_progress(self, done: int, total: int) -> None:
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.status_label.setText(f'{done} / {total} files')
+
+    def action_done(self, files: List[str]) -> None:
+        """ Removes the files done from the list. """
+        cancelled = self.action_worker.cancelled
+        self.action_worker.wait()
+        self.action_worker = None
+
+        done = set(files)
+        list_widget = self.action_list
+        for row in range(list_widget.count() - 1, -1, -1):
+            if list_widget.item(row).text() in done:
+                list_widget.takeItem(row)
+        self.update_busy()
+        if not cancelled:
+            self.show_done_message()
+
+    def update_busy(self) -> None:
+        """ One action at a time, and an empty list can not be acted on. """
+        idle = self.action_worker is None
+        for list_widget in self.lists.values():
+            list_widget.parent().setEnabled(
+                idle and (self.scan_worker is not None
+                          or list_widget.count() > 0))
+        self.cancel_btn.setEnabled(
+            not idle or self.scan_worker is not None)
 
     def show_done_message(self) -> None:
         QMessageBox.information(self, "Result.", "Done.\n", QMessageBox.Close)
 
+    def show_failed_message(self, message: str) -> None:
+        QMessageBox.information(
+            self, "Error", f"{message}\n", QMessageBox.Close)
+
     def delete_biji_json_files(self) -> None:
-        if not self.files_not_exists:
+        if not self.no_file_list.count():
             return
         answer = QMessageBox.question(
             self,
@@ -162,37 +390,16 @@ class BijiScanner(QWidget):
             defaultButton=QMessageBox.No)
         if answer == QMessageBox.No:
             return
-        for file in self.files_not_exists:
-            biji_json_file = Biji.get_biji_json_path(file)
-            Path(biji_json_file).unlink()
-        self.show_done_message()
-        self.no_file_box.setEnabled(False)
+        self.start_action('delete_biji_json', self.no_file_list)
 
     def add_to_database(self) -> None:
-        if not self.not_in_database:
-            return
-        for file in self.not_in_database:
-            biji = Biji.from_file(file)
-            biji.insert_biji_and_tags_to_db()
-        self.show_done_message()
-        self.new_file_box.setEnabled(False)
+        self.start_action('add', self.new_file_list)
 
     def update_database(self) -> None:
-        if not self.need_to_update:
-            return
-        for file in self.need_to_update:
-            biji = Biji.from_file(file)
-            biji.update_biji_and_tags_to_db()
-        self.show_done_message()
-        self.outdated_box.setEnabled(False)
+        self.start_action('update', self.outdated_list)
 
     def delete_records(self) -> None:
-        if not self.biji_json_not_exists:
-            return
-        for file in self.biji_json_not_exists:
-            self.db.delete_biji(file)
-        self.show_done_message()
-        self.no_json_box.setEnabled(False)
+        self.start_action('delete_records', self.no_json_list)
 
 
 if __name__ == '__main__':
@@ -203,6 +410,6 @@ if __name__ == '__main__':
     change_cwd()
 
     app = QApplication(sys.argv)
-    window = BijiScanner()
+    window = BijiScanner(full='--full' in sys.argv)
     window.show()
     sys.exit(app.exec_())
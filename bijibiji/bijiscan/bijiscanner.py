@@ -1,58 +1,101 @@
-from pathlib import Path
-from typing import List, Set
+from typing import Dict, List, Set, Optional, Iterable, Iterator
 
-from ..bijitags.biji import Biji
-from ..bijidb.bijidatabase import BijiDatabase
+from ..bijitags.biji import Biji, BijiRecord
+from ..bijitags.sidecar import write_sidecar
+from ..bijidb.bijidatabase import BijiDatabase, BATCH_SIZE
+from . import moves
+from .scan_engine import ScanResult, scan
 
 
-def scan_all(db: type(BijiDatabase)) -> List[str]:
+def scan_all(db: type(BijiDatabase),
+             jobs: Optional[int] = None,
+             full: bool = False) -> List[str]:
     """ Return files that both the file itself and the .biji.json exist. """
-    files = []
-    end = -len('.biji.json')
-
-    biji_paths = Path('.').glob('**/*.biji.json')
-    for biji_path in biji_paths:
-        file = str(biji_path)[:end]
-        if Path(file).exists():
-            biji = Biji.from_file(file)
-            files.append(file)
-        else:
-            print(file, '... Not Exists')
-            continue
+    result = scan(db, jobs=jobs, full=full)
 
-        mtime = db.get_mtime(file)
-        if not mtime:
-            print(file, '... Not in Database')
-            continue
+    for file in result.files_not_exist:
+        print(file, '... Not Exists')
 
-        if biji.bijiMTime > mtime:
-            print(file, f'Need to be updated: {mtime} -> {biji.bijiMTime}')
+    for file, error in result.errors.items():
+        print(file, f'... {error}')
 
-    print(f'There will be {len(files)} items in the database.')
-    return files
+    for file in result.not_in_database:
+        print(file, '... Not in Database')
 
+    for file in result.need_to_update:
+        mtime, biji_mtime = result.outdated_mtimes[file]
+        print(file, f'Need to be updated: {mtime} -> {biji_mtime}')
 
-def scan_all_and_update_db(db: type(BijiDatabase)) -> None:
-    end = -len('.biji.json')
+    print(f'There will be {len(result.files)} items in the database.')
+    return result.files
 
-    biji_paths = Path('.').glob('**/*.biji.json')
-    for biji_path in biji_paths:
-        file = str(biji_path)[:end]
-        if Path(file).exists():
-            biji = Biji.from_file(file)
-        else:
-            print(file, '... Not Exists')
-            continue
 
-        mtime = db.get_mtime(file)
-        if not mtime:
-            biji.insert_biji_and_tags_to_db()
-            print(file, '... added')
+def scan_all_and_update_db(db: type(BijiDatabase),
+                           jobs: Optional[int] = None,
+                           batch_size: int = BATCH_SIZE,
+                           full: bool = False,
+                           root: str = '') -> ScanResult:
+    """
+    Moves the records of the moved files, adds the new files and updates
+    the outdated records under root, returns the result of the scan
+    without the moved files, and with the files that failed to load in
+    errors.
+    """
+    result = scan(db, root=root, jobs=jobs, full=full)
+
+    for file in result.files_not_exist:
+        print(file, '... Not Exists')
+
+    for file, error in result.errors.items():
+        print(file, f'... {error}')
+
+    found = moves.find_moves(db, result.biji_json_not_exists,
+                             result.not_in_database, jobs)
+    outdated = moves.apply_moves(db, found)
+    for move in found:
+        print(move.old, '... moved to', move.new)
+    result = moves.without_moves(result, found, outdated)
+
+    failed: Dict[str, str] = {}
+    db.insert_bijis(
+        load_bijis(result.not_in_database, '... added', failed), batch_size)
+    db.update_bijis(
+        load_bijis(result.need_to_update, '... updated', failed), batch_size)
+    moves.save_fingerprints(db, result.files, jobs)
+    result.errors.update(failed)
+    return result._replace(
+        not_in_database=[file for file in result.not_in_database
+                         if file not in failed],
+        need_to_update=[file for file in result.need_to_update
+                        if file not in failed])
+
+
+def load_bijis(files: Iterable[str],
+               message: str = '',
+               errors: Optional[Dict[str, str]] = None) -> Iterator[dict]:
+    """
+    Reads '.biji.json' files lazily for the batch writer,
+    and fixes the filepath in the moved ones like Biji.from_file().
+    A file that can't be read is skipped and added to errors, like the
+    scan does, and printed along with the message of the others.
+    """
+    for file in files:
+        try:
+            record = BijiRecord.load(file)
+            if record.moved:
+                write_sidecar(str(Biji.get_biji_json_path(file)),
+                              record._asjson())
+            biji_dict = record._asdict()
+        except (OSError, ValueError) as e:
+            error = f'{type(e).__name__}: {e}'
+            if errors is not None:
+                errors[file] = error
+            if message:
+                print(file, f'... {error}')
             continue
-
-        if biji.bijiMTime > mtime:
-            biji.update_biji_and_tags_to_db()
-            print(file, '... updated')
+        yield biji_dict
+        if message:
+            print(file, message)
 
 
 def biji_json_not_exists(db: type(BijiDatabase)) -> List[str]:
@@ -68,11 +111,10 @@ def biji_json_not_exists(db: type(BijiDatabase)) -> List[str]:
 
 
 def delete_biji_json_not_exists(db: type(BijiDatabase)) -> None:
-    for row in db.get_all_filepaths():
-        filepath = row['filepath']
-        if not Biji.get_biji_json_path(filepath).exists():
-            db.delete_biji(filepath)
-            print(filepath, '... deleted')
+    filepaths = biji_json_not_exists(db)
+    db.delete_bijis(filepaths)
+    for filepath in filepaths:
+        print(filepath, '... deleted')
 
 
 def all_biji_in_db(db: type(BijiDatabase)) -> Set[str]:
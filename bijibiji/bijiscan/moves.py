@@ -0,0 +1,218 @@
+"""
+Finds the files moved along with their '.biji.json' files outside
+bijibiji, which a scan reports as a new file (not_in_database) and a
+record without its '.biji.json' (biji_json_not_exists), and moves their
+records in place, keeping the tags, instead of deleting and inserting.
+
+The database keeps a fingerprint of the original file of each record:
+its size, inode, mtime and a hash of the first and the last
+FINGERPRINT_CHUNK bytes. A new file is matched with a missing record by
+
+    1. size, inode and mtime, a move on the same file system, no hashing
+    2. size and hash, only the new files of the size of a missing record
+       are hashed, e.g. a file of the same inode but another mtime
+
+and only if exactly one record and one new file have the fingerprint,
+e.g. two copies of a file are left as new files.
+
+The scanner, bijiscan_gui and the watcher save the fingerprints of the
+records they write or check which have none, or whose file changed size,
+inode or mtime since, the first update after the fingerprints table is
+created reads every file once.
+"""
+import hashlib
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ..bijidb.bijidatabase import BijiDatabase
+from ..bijitags.biji import Biji, BijiRecord
+from ..bijitags.sidecar import write_sidecar
+from .scan_engine import ScanResult, nocase, parallel_map, read_biji_mtime
+
+# Bytes hashed at the start and at the end of a file.
+FINGERPRINT_CHUNK = 64 * 1024
+
+# (size, inode, hash, mtime_ns)
+Fingerprint = Tuple[int, int, str, int]
+
+# (filepath, size, inode, mtime_ns), a file stat but not hashed yet.
+_Item = Tuple[str, int, int, int]
+
+
+class Move(NamedTuple):
+    old: str
+    new: str
+    # Of the file at new.
+    fingerprint: Fingerprint
+
+
+def content_hash(filepath: str, size: int) -> str:
+    """ The hash of the first and the last FINGERPRINT_CHUNK bytes. """
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(filepath, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_CHUNK))
+        if size > 2 * FINGERPRINT_CHUNK:
+            f.seek(-FINGERPRINT_CHUNK, os.SEEK_END)
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def fingerprint(filepath: str) -> Optional[Fingerprint]:
+    """ None if the file can't be read. """
+    item = _stat_item(filepath)
+    return _hash_item(item) if item else None
+
+
+def _stat_item(filepath: str) -> Optional[_Item]:
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return filepath, stat.st_size, stat.st_ino, stat.st_mtime_ns
+
+
+def _hash_item(item: _Item) -> Optional[Fingerprint]:
+    """ fingerprint() with the stat already done, for parallel_map(). """
+    filepath, size, inode, mtime_ns = item
+    try:
+        return size, inode, content_hash(filepath, size), mtime_ns
+    except OSError:
+        return None
+
+
+def _unique_pairs(old: Dict[object, List[str]], new: Dict[object, list]):
+    """ Yields (old filepath, new item) of the keys unique on both sides. """
+    for key, old_paths in old.items():
+        new_items = new.get(key, [])
+        if len(old_paths) == 1 and len(new_items) == 1:
+            yield old_paths[0], new_items[0]
+
+
+def find_moves(db: type(BijiDatabase),
+               missing: List[str],
+               new: List[str],
+               jobs: Optional[int] = None) -> List[Move]:
+    """
+    Matches the records in missing, without their '.biji.json', with the
+    files in new, not in the database, by their fingerprints.
+    """
+    if not missing or not new:
+        return []
+    stored = {nocase(filepath): row
+              for filepath, row in db.get_fingerprints().items()}
+    # size -> inode -> old filepaths
+    records: Dict[int, Dict[int, List[str]]] = {}
+    for filepath in missing:
+        row = stored.get(nocase(filepath))
+        if row:
+            records.setdefault(row[0], {}) \
+                .setdefault(row[1], []).append(filepath)
+
+    # The new files of the sizes of the records, size -> inode -> items.
+    candidates: Dict[int, Dict[int, List[_Item]]] = {}
+    for item in filter(None, map(_stat_item, new)):
+        if item[1] in records:
+            candidates.setdefault(item[1], {}).setdefault(
+                item[2], []).append(item)
+
+    moves = []
+    to_hash: List[_Item] = []
+    for size, by_inode in candidates.items():
+        old_inodes = records[size]
+        # An inode of 0 is not known, e.g. on FAT.
+        known = {inode: paths for inode, paths in old_inodes.items()
+                 if inode}
+        for old, (filepath, _, inode, mtime_ns) in _unique_pairs(
+                known, by_inode):
+            # A file written since, or another file given a freed inode,
+            # is left to the hash.
+            if mtime_ns != stored[nocase(old)][3]:
+                continue
+            old_inodes[inode] = []
+            by_inode[inode] = []
+            moves.append(Move(old, filepath, stored[nocase(old)]))
+        if any(old_inodes.values()):
+            to_hash.extend(item for items in by_inode.values()
+                           for item in items)
+
+    # size, hash -> old filepaths and new items
+    old_hashes: Dict[Tuple[int, str], List[str]] = {}
+    for size, by_inode in records.items():
+        for paths in by_inode.values():
+            for filepath in paths:
+                old_hashes.setdefault(
+                    (size, stored[nocase(filepath)][2]), []).append(filepath)
+    new_hashes: Dict[Tuple[int, str], List[Tuple[str, Fingerprint]]] = {}
+    for item, row in zip(to_hash, parallel_map(_hash_item, to_hash, jobs)):
+        if row:
+            new_hashes.setdefault((row[0], row[2]), []).append((item[0], row))
+    for old, (filepath, row) in _unique_pairs(old_hashes, new_hashes):
+        moves.append(Move(old, filepath, row))
+    return moves
+
+
+def apply_moves(db: type(BijiDatabase), moves: List[Move]) -> List[str]:
+    """
+    Moves the records, fixes the filepath in the moved '.biji.json' files,
+    returns the new filepaths whose '.biji.json' is newer than the record.
+    A '.biji.json' that can't be read is returned too, for the update
+    to report it.
+    """
+    outdated = []
+    for move in moves:
+        try:
+            biji_mtime = read_biji_mtime(move.new)
+        except (OSError, ValueError):
+            biji_mtime = None
+        if biji_mtime is None or biji_mtime > db.get_mtime(move.old):
+            outdated.append(move.new)
+    db.rename_bijis((move.old, move.new) for move in moves)
+    db.save_fingerprints((move.new, *move.fingerprint) for move in moves)
+    for move in moves:
+        try:
+            record = BijiRecord.load(move.new)
+            if record.moved:
+                write_sidecar(str(Biji.get_biji_json_path(move.new)),
+                              record._asjson())
+        except (OSError, ValueError):
+            if move.new not in outdated:
+                outdated.append(move.new)
+    return outdated
+
+
+def without_moves(result: ScanResult, moves: List[Move],
+                  outdated: Iterable[str] = ()) -> ScanResult:
+    """ result after the moves, outdated are added to need_to_update. """
+    old = {nocase(move.old) for move in moves}
+    new = {nocase(move.new) for move in moves}
+    return result._replace(
+        not_in_database=[filepath for filepath in result.not_in_database
+                         if nocase(filepath) not in new],
+        biji_json_not_exists=[
+            filepath for filepath in result.biji_json_not_exists
+            if nocase(filepath) not in old],
+        need_to_update=result.need_to_update + list(outdated))
+
+
+def save_fingerprints(db: type(BijiDatabase),
+                      files: Iterable[str],
+                      jobs: Optional[int] = None) -> int:
+    """
+    Saves the fingerprints of the files in the database which have none,
+    or whose size, inode or mtime changed, returns the number of them.
+    """
+    files = list(files)
+    if not files:
+        return 0
+    stored = {nocase(filepath): row
+              for filepath, row in db.get_fingerprints().items()}
+    items = []
+    for item in filter(None, map(_stat_item, files)):
+        row = stored.get(nocase(item[0]))
+        if not row or (row[0], row[1], row[3]) != item[1:]:
+            items.append(item)
+    rows = [(item[0], *row)
+            for item, row in zip(items, parallel_map(_hash_item, items, jobs))
+            if row]
+    db.save_fingerprints(rows)
+    return len(rows)
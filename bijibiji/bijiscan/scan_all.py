@@ -2,10 +2,18 @@ from .bijiscanner import scan_all
 from ..bijidb.bijidatabase import BijiDatabase
 
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--full', action='store_true',
+                        help="re-read every '.biji.json', "
+                             "ignoring the stat cache")
+    args = parser.parse_args()
+
     from .. import change_cwd
     change_cwd()
 
     biji_db = BijiDatabase
     biji_db.connect_db()
-    scan_all(biji_db)
+    scan_all(biji_db, full=args.full)
     biji_db.close_db()
@@ -1,17 +1,27 @@
 from .bijiscanner import scan_all_and_update_db
 from ..bijidb.bijidatabase import BijiDatabase
+from ..bijidb.profiles import PROFILES
 
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--full', action='store_true',
+                        help="re-read every '.biji.json', "
+                             "ignoring the stat cache")
+    parser.add_argument('--compact', action='store_true',
+                        help='create a new database with the compact '
+                             'schema, see bijidb/compact_schema.py')
+    parser.add_argument('--profile', default='bulk-load',
+                        choices=list(PROFILES),
+                        help='the connection profile, see bijidb/profiles.py')
+    args = parser.parse_args()
+
     from .. import change_cwd
     change_cwd()
 
     biji_db = BijiDatabase
+    biji_db.open_db(compact=args.compact, profile=args.profile)
 
-    try:
-        biji_db.connect_db()
-    except FileNotFoundError:
-        biji_db.create_db()
-        biji_db.connect_db()
-
-    scan_all_and_update_db(biji_db)
+    scan_all_and_update_db(biji_db, full=args.full)
     biji_db.close_db()
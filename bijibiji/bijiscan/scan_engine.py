@@ -0,0 +1,314 @@
+"""
+The scan engine shared by bijiscanner, scan_all_and_update and bijiscan_gui.
+
+A single os.scandir walk finds every '.biji.json' file together with its
+original file (they are in the same directory listing), the json files are
+parsed on a pool of worker processes, and the records in the database are
+read at once into a dict instead of one SELECT per file.
+
+The stat signature (st_mtime_ns, st_size, st_ino) of every '.biji.json' is
+cached in the 'biji_json_stats' table, a rescan only parses the files whose
+signature has changed, unless full=True.
+"""
+import json
+import os
+import string
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, \
+    Optional, Tuple
+
+from ..bijidb.bijidatabase import BijiDatabase
+
+BIJI_JSON_SUFFIX = '.biji.json'
+
+# Number of files handled by a worker process in one task.
+CHUNK_SIZE = 256
+
+# bijiMTime is looked for in the first _HEADER_SIZE bytes of a '.biji.json'
+# file by read_biji_mtime(), before parsing the whole file.
+_HEADER_SIZE = 512
+
+_MTIME_KEY = b'"bijiMTime": "'
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+class ScanResult(NamedTuple):
+    # Both the original file and the '.biji.json' file exist.
+    files: List[str]
+    # '.biji.json' exists, but the original file is not found.
+    files_not_exist: List[str]
+    # New files that can be added to the database.
+    not_in_database: List[str]
+    # Files whose '.biji.json' is newer than the record in the database.
+    need_to_update: List[str]
+    # Records in the database without a '.biji.json' file.
+    biji_json_not_exists: List[str]
+    # filepath -> (bijiMTime in the database, bijiMTime in '.biji.json'),
+    # only for the files in need_to_update. The second one is None for a
+    # '.biji.json' without bijiMTime.
+    outdated_mtimes: Dict[str, Tuple[str, Optional[str]]]
+    # filepath -> the error reading its '.biji.json', the file is skipped.
+    errors: Dict[str, str]
+
+
+def nocase(filepath: str) -> str:
+    """ Folds ASCII letters, the same as the NOCASE collation of SQLite. """
+    return filepath.translate(_ASCII_LOWER)
+
+
+def default_jobs() -> int:
+    return os.cpu_count() or 1
+
+
+def _map_chunk(func: Callable, chunk: List) -> List:
+    return [func(item) for item in chunk]
+
+
+def parallel_map(func: Callable,
+                 items: Iterable,
+                 jobs: Optional[int] = None,
+                 chunk_size: int = CHUNK_SIZE) -> Iterator:
+    """
+    Maps func over items on a pool of worker processes,
+    yields the results in the order of items.
+    func must be a module level function so that it can be pickled.
+    Closing the generator early cancels the chunks not yet started.
+    """
+    items = list(items)
+    if jobs is None:
+        jobs = default_jobs()
+
+    if jobs <= 1 or len(items) <= chunk_size:
+        yield from map(func, items)
+        return
+
+    chunks = [items[i:i + chunk_size]
+              for i in range(0, len(items), chunk_size)]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(chunks))) as executor:
+        futures = [executor.submit(_map_chunk, func, chunk)
+                   for chunk in chunks]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def walk_biji_json(
+        root: str = '') -> Iterator[Tuple[str, bool, os.DirEntry]]:
+    """
+    Walks the directory tree under root (relative to the cwd, '' means the
+    cwd itself), yields (filepath, exists, entry) for every '.biji.json'
+    file, where filepath is the path of the original file, exists tells if
+    the original file is in the same directory listing, and entry is the
+    os.DirEntry of the '.biji.json' file.
+    Symbolic links to directories are not followed.
+    """
+    end = -len(BIJI_JSON_SUFFIX)
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory or '.') as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        prefix = directory + os.sep if directory else ''
+        names = set()
+        biji_json_entries = []
+        for entry in entries:
+            name = entry.name
+            if name.endswith(BIJI_JSON_SUFFIX) and name != BIJI_JSON_SUFFIX:
+                biji_json_entries.append(entry)
+                continue
+            names.add(name)
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(prefix + name)
+
+        for entry in biji_json_entries:
+            name = entry.name[:end]
+            yield prefix + name, name in names, entry
+
+
+def header_mtime(header: bytes) -> Optional[str]:
+    """
+    Returns bijiMTime in the first bytes of a '.biji.json' file written by
+    Biji._asjson(), None if it is not found there. The keys are sorted,
+    so bijiMTime comes third, after backupAt and bijiCTime. A quote in a
+    string is escaped, so the key can't be matched inside a value.
+    """
+    start = header.find(_MTIME_KEY)
+    if start < 1 or (header[start - 1:start] != b'{'
+                     and header[start - 2:start] != b', '):
+        return None
+    start += len(_MTIME_KEY)
+    end = header.find(b'"', start)
+    if end < 0:
+        return None
+    mtime = header[start:end]
+    if not mtime or b'\\' in mtime:
+        return None
+    try:
+        return mtime.decode('ascii')
+    except UnicodeDecodeError:
+        return None
+
+
+def read_biji_mtime(filepath: str) -> Optional[str]:
+    """
+    Returns bijiMTime in the '.biji.json' file of filepath, read from the
+    first bytes of the file if possible, otherwise by parsing all of it.
+    None if the file has no bijiMTime, then the record is always updated,
+    see iter_scan(). The rest of the file is parsed when the record is
+    inserted or updated.
+    """
+    with open(filepath + BIJI_JSON_SUFFIX, 'rb') as f:
+        header = f.read(_HEADER_SIZE)
+        mtime = header_mtime(header)
+        if mtime is None:
+            biji_dict: dict = json.loads(header + f.read())
+            mtime = biji_dict.get('bijiMTime')
+    return mtime or None
+
+
+def try_read_biji_mtime(filepath: str) -> Tuple[Optional[str], str]:
+    """
+    read_biji_mtime() for parallel_map(), returns (bijiMTime, '') or
+    (None, error) so that a broken '.biji.json' doesn't stop the scan.
+    """
+    try:
+        return read_biji_mtime(filepath), ''
+    except (OSError, ValueError) as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def _in_root(filepath: str, root: str) -> bool:
+    return not root or nocase(filepath).startswith(nocase(root + os.sep))
+
+
+def _stat_signature(entry: os.DirEntry) -> Tuple[int, int, int]:
+    stat = entry.stat(follow_symlinks=False)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class ScanItem(NamedTuple):
+    # A field name of ScanResult, or WALKED.
+    kind: str
+    filepath: str = ''
+    # (bijiMTime in the database, in '.biji.json') for need_to_update,
+    # (error,) for errors,
+    # (number of files, number of files to parse) for WALKED.
+    detail: Optional[Tuple] = None
+
+
+# The walk is done and the changed '.biji.json' files are being parsed.
+WALKED = 'walked'
+
+
+def iter_scan(db: type(BijiDatabase),
+              root: str = '',
+              jobs: Optional[int] = None,
+              full: bool = False,
+              save_cache: bool = True) -> Iterator[ScanItem]:
+    """
+    The same as scan(), yields the results as they are found, so that a
+    caller can show them while scanning, or stop early by closing the
+    generator. A file is classified as soon as its stat signature is
+    checked, the changed files after they are parsed at the end of the
+    walk. The stat cache is saved for the files parsed so far even if the
+    generator is closed early, unless save_cache is False, e.g. for a dry
+    run which writes nothing.
+    """
+    stats = {nocase(filepath): (filepath, stat)
+             for filepath, stat in db.get_biji_json_stats().items()
+             if _in_root(filepath, root)}
+    records = {nocase(filepath): (filepath, mtime)
+               for filepath, mtime in db.get_all_mtimes().items()}
+
+    def classify(filepath: str,
+                 biji_mtime: Optional[str]) -> Iterator[ScanItem]:
+        yield ScanItem('files', filepath)
+        record = records.pop(nocase(filepath), None)
+        if record is None:
+            yield ScanItem('not_in_database', filepath)
+        elif biji_mtime is None or biji_mtime > record[1]:
+            yield ScanItem('need_to_update', filepath,
+                           (record[1], biji_mtime))
+
+    new_stats = []
+    # Parsed but not cached, so that they are parsed again next time.
+    uncached = []
+    walked = False
+    try:
+        changed = []
+        files = 0
+        for filepath, exists, entry in walk_biji_json(root):
+            if not exists:
+                records.pop(nocase(filepath), None)
+                yield ScanItem('files_not_exist', filepath)
+                continue
+
+            files += 1
+            signature = _stat_signature(entry)
+            cached = stats.pop(nocase(filepath), None)
+            if not full and cached and cached[1][:3] == signature:
+                yield from classify(filepath, cached[1][3])
+            else:
+                changed.append((filepath, signature))
+        walked = True
+        yield ScanItem(WALKED, detail=(files, len(changed)))
+
+        changed_files = [filepath for filepath, _ in changed]
+        parsed = parallel_map(try_read_biji_mtime, changed_files, jobs)
+        try:
+            for (filepath, signature), (biji_mtime, error) in zip(changed,
+                                                                  parsed):
+                if error:
+                    # Not regarded as without '.biji.json' either.
+                    records.pop(nocase(filepath), None)
+                    uncached.append(filepath)
+                    yield ScanItem('errors', filepath, (error,))
+                    continue
+                # Without bijiMTime, the record is always updated.
+                if biji_mtime is None:
+                    uncached.append(filepath)
+                else:
+                    new_stats.append((filepath, *signature, biji_mtime))
+                yield from classify(filepath, biji_mtime)
+        finally:
+            parsed.close()
+
+        for filepath, _ in records.values():
+            if _in_root(filepath, root):
+                yield ScanItem('biji_json_not_exists', filepath)
+    finally:
+        # The cached files not found by a complete walk are gone.
+        deleted = [filepath for filepath, _ in stats.values()] \
+            if walked else []
+        if save_cache:
+            db.save_biji_json_stats(new_stats, deleted + uncached)
+
+
+def scan(db: type(BijiDatabase),
+         root: str = '',
+         jobs: Optional[int] = None,
+         full: bool = False) -> ScanResult:
+    """
+    Compares all '.biji.json' files under root with the database.
+    jobs is the number of worker processes, defaults to the number of CPUs.
+    With full=True every '.biji.json' is parsed, ignoring the stat cache.
+    """
+    result = ScanResult([], [], [], [], [], {}, {})
+    for item in iter_scan(db, root, jobs, full):
+        if item.kind == WALKED:
+            continue
+        if item.kind == 'errors':
+            result.errors[item.filepath] = item.detail[0]
+            continue
+        getattr(result, item.kind).append(item.filepath)
+        if item.kind == 'need_to_update':
+            result.outdated_mtimes[item.filepath] = item.detail
+    return result
@@ -0,0 +1,446 @@
+"""
+A long-running watcher that keeps the database in sync with the
+'.biji.json' files, on Linux inotify through ctypes.
+
+    python -m bijibiji.bijiscan.watcher [--root Documents]
+
+Every directory under root (HOME by default) is watched. The events are
+collected until nothing happens for DEBOUNCE seconds (at most MAX_DELAY
+seconds), then applied at once with the batch writer of BijiDatabase:
+
+    - a '.biji.json' written, created or moved in: insert or update,
+    - a '.biji.json' deleted or moved away: delete the record,
+    - a file moved together with its '.biji.json': rename the record,
+      so that it keeps its tags,
+    - a directory moved inside the tree: rename the records under it,
+    - a directory created, or moved in from outside: rescan it,
+    - a directory moved out of the tree: rescan it, deleting its records.
+
+When the kernel queue overflows events are lost anywhere, the watcher
+then rescans root, which the stat cache of the scanner keeps cheap.
+
+A '.biji.json' that can't be read, e.g. truncated or deleted before it
+is read, is reported and skipped, as are the rescans that fail, so that
+the watcher keeps running.
+
+The rescans at the start and after an overflow only report the records
+without '.biji.json', e.g. while HOME is not mounted, and keep them,
+unless --prune-records is given.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from ..bijidb.bijidatabase import BijiDatabase
+from ..bijitags.biji import Biji
+from . import moves
+from .bijiscanner import load_bijis, scan_all_and_update_db
+from .scan_engine import BIJI_JSON_SUFFIX, nocase, read_biji_mtime
+
+# From <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE \
+             | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+
+# Seconds without events before the changes are applied.
+DEBOUNCE = 0.5
+
+# Seconds after the first event at most, under a steady stream of events.
+MAX_DELAY = 5.0
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_EVENT_HEADER = struct.Struct('iIII')
+
+_READ_SIZE = 64 * 1024
+
+
+class Event(NamedTuple):
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+class Inotify:
+    """ A thin wrapper of the inotify system calls. """
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is only available on Linux')
+
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise('inotify_init1')
+
+    @staticmethod
+    def _raise(name: str, path: str = '') -> None:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f'{name}: {os.strerror(errno)}', path)
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path or '.'), mask)
+        if wd < 0:
+            self._raise('inotify_add_watch', path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        # Fails if the watch is already gone, e.g. the directory deleted.
+        self._rm_watch(self.fd, wd)
+
+    def read(self) -> Iterator[Event]:
+        """ Reads the available events, blocks if there is none. """
+        data = os.read(self.fd, _READ_SIZE)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = \
+                _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            yield Event(wd, mask, cookie, os.fsdecode(name))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def _join(directory: str, name: str) -> str:
+    return directory + os.sep + name if directory else name
+
+
+def _is_under(path: str, directory: str) -> bool:
+    """ Whether path is directory itself or inside it, as NOCASE. """
+    if not directory:
+        return True
+    path, directory = nocase(path), nocase(directory)
+    return path == directory or path.startswith(directory + os.sep)
+
+
+def _is_biji_json(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.endswith(BIJI_JSON_SUFFIX) and name != BIJI_JSON_SUFFIX
+
+
+def _outermost(directories: Set[str]) -> List[str]:
+    """ Drops the directories inside another one of them. """
+    result = []
+    for directory in sorted(directories, key=len):
+        if not any(_is_under(directory, outer) for outer in result):
+            result.append(directory)
+    return result
+
+
+class Watcher:
+    def __init__(self,
+                 db: type(BijiDatabase),
+                 root: str = '',
+                 debounce: float = DEBOUNCE,
+                 max_delay: float = MAX_DELAY,
+                 prune_records: bool = False) -> None:
+        """
+        prune_records deletes the records without '.biji.json' found by
+        any rescan, otherwise only those under a directory moved out.
+        """
+        self.db = db
+        self.root = root
+        self.prune_records = prune_records
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.inotify = Inotify()
+
+        # wd -> directory, and the reverse.
+        self.paths: Dict[int, str] = {}
+        self.wds: Dict[str, int] = {}
+        self._reset()
+
+    def _reset(self) -> None:
+        # Files whose '.biji.json' was written, created, moved or deleted.
+        self.changed: Set[str] = set()
+        # Moves of files that are not '.biji.json', old -> new.
+        self.moves: Dict[str, str] = {}
+        # Moves of '.biji.json', filepath of the old -> of the new.
+        self.biji_json_moves: Dict[str, str] = {}
+        self.dir_moves: List[Tuple[str, str]] = []
+        self.rescans: Set[str] = set()
+        # Directories moved out of the tree, their records are deleted.
+        self.moved_out: Set[str] = set()
+        self.overflow = False
+        # cookie -> (path, is a directory), until the IN_MOVED_TO comes.
+        self.moved_from: Dict[int, Tuple[str, bool]] = {}
+        self.first_event: Optional[float] = None
+        self.last_event: Optional[float] = None
+
+    def watch_tree(self, directory: str) -> None:
+        """ Watches directory and all directories under it. """
+        stack = [directory]
+        while stack:
+            directory = stack.pop()
+            try:
+                wd = self.inotify.add_watch(directory)
+            except OSError:
+                continue
+            self.paths[wd] = directory
+            self.wds[directory] = wd
+            try:
+                with os.scandir(directory or '.') as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(_join(directory, entry.name))
+            except OSError:
+                continue
+
+    def unwatch_tree(self, directory: str) -> None:
+        for path in [path for path in self.wds if _is_under(path, directory)]:
+            wd = self.wds.pop(path)
+            self.paths.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def move_watches(self, old: str, new: str) -> None:
+        """ The watches follow a moved directory, only the paths change. """
+        for path in [path for path in self.wds if _is_under(path, old)]:
+            wd = self.wds.pop(path)
+            moved = new + path[len(old):]
+            self.paths[wd] = moved
+            self.wds[moved] = wd
+
+    def handle(self, event: Event) -> bool:
+        """ Records an event, returns whether it matters. """
+        if event.mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            return True
+        if event.mask & IN_IGNORED:
+            directory = self.paths.pop(event.wd, None)
+            if self.wds.get(directory) == event.wd:
+                del self.wds[directory]
+            return False
+
+        directory = self.paths.get(event.wd)
+        if directory is None:
+            return False
+        path = _join(directory, event.name)
+
+        if event.mask & IN_ISDIR:
+            if event.mask & IN_MOVED_FROM:
+                self.moved_from[event.cookie] = (path, True)
+            elif event.mask & IN_MOVED_TO:
+                old = self.moved_from.pop(event.cookie, None)
+                if old is not None and old[1]:
+                    self.move_watches(old[0], path)
+                    self.dir_moves.append((old[0], path))
+                else:
+                    self.watch_tree(path)
+                    self.rescans.add(path)
+            elif event.mask & IN_CREATE:
+                # The files created before the watch is added are missed.
+                self.watch_tree(path)
+                self.rescans.add(path)
+            else:
+                return False
+        elif _is_biji_json(path):
+            filepath = path[:-len(BIJI_JSON_SUFFIX)]
+            self.changed.add(filepath)
+            if event.mask & IN_MOVED_FROM:
+                self.moved_from[event.cookie] = (path, False)
+            elif event.mask & IN_MOVED_TO:
+                old = self.moved_from.pop(event.cookie, None)
+                if old is not None and _is_biji_json(old[0]):
+                    self.biji_json_moves[
+                        old[0][:-len(BIJI_JSON_SUFFIX)]] = filepath
+        elif event.mask & IN_MOVED_FROM:
+            self.moved_from[event.cookie] = (path, False)
+            return False
+        elif event.mask & IN_MOVED_TO:
+            old = self.moved_from.pop(event.cookie, None)
+            if old is None or old[1]:
+                return False
+            self.moves[old[0]] = path
+        else:
+            return False
+
+        return True
+
+    def pending(self) -> bool:
+        return self.first_event is not None
+
+    def renames(self) -> List[Tuple[str, str]]:
+        """ The records to rename, (old, new) pairs. """
+        renames = []
+        if self.dir_moves:
+            filepaths = [row['filepath']
+                         for row in self.db.get_all_filepaths()]
+            for old, new in self.dir_moves:
+                for filepath in filepaths:
+                    if _is_under(filepath, old):
+                        renames.append((filepath, new + filepath[len(old):]))
+
+        for old, new in self.moves.items():
+            if self.biji_json_moves.get(old) == new:
+                renames.append((old, new))
+        return renames
+
+    def apply(self) -> None:
+        """ Applies the changes recorded since the last apply(). """
+        db = self.db
+
+        # Directories moved out of the tree.
+        for path, is_dir in self.moved_from.values():
+            if is_dir:
+                self.unwatch_tree(path)
+                self.rescans.add(path)
+                self.moved_out.add(path)
+
+        if self.overflow:
+            print(f'Event queue overflow, rescanning {self.root or "HOME"}')
+            self.rescans.add(self.root)
+
+        renames = self.renames()
+        db.rename_bijis(renames)
+        for old, new in renames:
+            print(old, '->', new, '... moved')
+
+        rescans = _outermost(self.rescans)
+        new_files = []
+        outdated = []
+        deleted = []
+        for filepath in sorted(self.changed):
+            if any(_is_under(filepath, root) for root in rescans):
+                continue
+            mtime = db.get_mtime(filepath)
+            if not Biji.get_biji_json_path(filepath).exists():
+                if mtime:
+                    deleted.append(filepath)
+                continue
+            if not os.path.exists(filepath):
+                # Left to bijiscan_gui, as 'Files not exist'.
+                continue
+            try:
+                biji_mtime = read_biji_mtime(filepath)
+            except (OSError, ValueError) as e:
+                print(filepath, f'... {e}')
+                continue
+            if not mtime:
+                new_files.append(filepath)
+            elif biji_mtime is None or biji_mtime > mtime:
+                outdated.append(filepath)
+
+        db.delete_bijis(deleted)
+        for filepath in deleted:
+            print(filepath, '... deleted')
+        failed: Dict[str, str] = {}
+        db.insert_bijis(load_bijis(new_files, '... added', failed))
+        db.update_bijis(load_bijis(outdated, '... updated', failed))
+        moves.save_fingerprints(
+            db, [filepath for filepath in new_files + outdated
+                 if filepath not in failed] + [new for _, new in renames])
+
+        for root in rescans:
+            self.watch_tree(root)
+            try:
+                result = scan_all_and_update_db(db, root=root)
+            except (OSError, ValueError) as e:
+                print(f'Rescanning {root or "HOME"} failed, '
+                      f'{type(e).__name__}: {e}')
+                continue
+            deleted = []
+            for filepath in result.biji_json_not_exists:
+                if self.prune_records or any(
+                        _is_under(filepath, path) for path in self.moved_out):
+                    deleted.append(filepath)
+                else:
+                    print(filepath, "... '.biji.json' not exists, kept")
+            db.delete_bijis(deleted)
+            for filepath in deleted:
+                print(filepath, '... deleted')
+
+        self._reset()
+
+    def run(self) -> None:
+        """ Syncs root once, then applies the changes until interrupted. """
+        self.watch_tree(self.root)
+        self.rescans.add(self.root)
+        self.apply()
+        print(f'Watching {len(self.paths)} directories under '
+              f'{self.root or "HOME"}')
+
+        while True:
+            timeout = None
+            if self.pending():
+                timeout = max(0.0, self.deadline() - time.monotonic())
+
+            ready, _, _ = select.select([self.inotify], [], [], timeout)
+            if ready:
+                matters = [self.handle(event)
+                           for event in self.inotify.read()]
+                if any(matters):
+                    now = time.monotonic()
+                    self.last_event = now
+                    if self.first_event is None:
+                        self.first_event = now
+
+            if self.pending() and time.monotonic() >= self.deadline():
+                self.apply()
+
+    def deadline(self) -> float:
+        return min(self.last_event + self.debounce,
+                   self.first_event + self.max_delay)
+
+    def close(self) -> None:
+        self.inotify.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Keeps the database in sync with the '.biji.json' "
+                    "files, on Linux inotify.")
+    parser.add_argument('--root', default='',
+                        help='the folder to watch, relative to HOME')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE,
+                        help='seconds without events before applying them')
+    parser.add_argument('--prune-records', action='store_true',
+                        help="delete the records without '.biji.json' "
+                             "found by the rescans")
+    args = parser.parse_args()
+
+    from .. import change_cwd
+    change_cwd()
+
+    biji_db = BijiDatabase
+    biji_db.open_db()
+    watcher = Watcher(biji_db, os.path.normpath(args.root).lstrip(os.sep)
+                      if args.root else '', debounce=args.debounce,
+                      prune_records=args.prune_records)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        if watcher.pending():
+            watcher.apply()
+    finally:
+        watcher.close()
+        biji_db.close_db()
@@ -4,9 +4,11 @@ import json
 import mimetypes
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple, Set
+from typing import Optional, Tuple, Set
 
+from .. import instrument
 from ..bijidb.bijidatabase import BijiDatabase
+from .sidecar import SidecarWriter, write_sidecar
 
 
 # noinspection PyPep8Naming
@@ -32,6 +34,10 @@ class Biji:
                            'bijiMTime',
                            'tags')
 
+    # Looked up lazily by get_db(), a Biji that only reads or writes
+    # the '.biji.json' file never connects to the database.
+    db = BijiDatabase
+
     def __init__(self, filepath: str, tags: Tuple[str] = ()) -> None:
         file_path = Path(filepath)
         filestat = file_path.lstat()
@@ -49,13 +55,12 @@ class Biji:
         self._tags = tags
 
         self.biji_json_path = self.get_biji_json_path(filepath)
-        self.db = BijiDatabase
 
-        try:
-            self.db.connect_db()
-        except FileNotFoundError:
-            self.db.create_db()
-            self.db.connect_db()
+    @classmethod
+    def get_db(cls) -> type(BijiDatabase):
+        """ Returns the database, connects to it on first use. """
+        cls.db.open_db()
+        return cls.db
 
     @staticmethod
     def get_biji_json_path(filepath: str) -> Path:
@@ -71,38 +76,47 @@ class Biji:
         Creates the '.biji.json' file if it does not exist.
         Inserts a new record if it does not exist in the database.
         """
-        for file in files:
-            biji_json_path = cls.get_biji_json_path(file)
+        new_bijis = []
+        outdated_bijis = []
+        # The files are replaced before the database is updated.
+        with SidecarWriter() as writer:
+            for file in files:
+                biji_json_path = cls.get_biji_json_path(file)
 
-            if biji_json_path.exists():
-                biji = cls.from_file(file)
-            else:
-                biji = cls(file)
+                if biji_json_path.exists():
+                    biji = cls.from_file(file)
+                else:
+                    biji = cls(file)
 
-            tags = set(biji.tags) - deleted_tags | new_added_tags
-            if tags != set(biji.tags):
-                biji.tags = tags
-                biji.write_file()
+                tags = set(biji.tags) - deleted_tags | new_added_tags
+                if tags != set(biji.tags):
+                    biji.tags = tags
+                    biji.write_file(writer)
 
-            bijiMTime = biji.get_mtime_from_db()
-            if not bijiMTime:
-                biji.insert_biji_and_tags_to_db()
-            elif biji._bijiMTime > bijiMTime:
-                biji.update_biji_and_tags_to_db()
+                bijiMTime = biji.get_mtime_from_db()
+                if not bijiMTime:
+                    new_bijis.append(biji._asdict())
+                elif biji._bijiMTime > bijiMTime:
+                    outdated_bijis.append(biji._asdict())
+
+        db = cls.get_db()
+        db.insert_bijis(new_bijis)
+        db.update_bijis(outdated_bijis)
 
     @classmethod
+    @instrument.timed('from_file')
     def from_file(cls, filepath: str) -> Biji:  # noqa:F821
-        biji_json_path = cls.get_biji_json_path(filepath)
-        biji_json = biji_json_path.read_text(encoding='utf-8')
-        biji_dict: dict = json.loads(biji_json)
-        biji = cls(filepath)
-
+        """
+        The file is only stat-ed if a field is missing in '.biji.json',
+        see BijiRecord. Use BijiRecord.load() to only read the file.
+        """
+        record = BijiRecord.load(filepath)
+        biji = cls.__new__(cls)
         for field in cls._fields:
-            if field in biji_dict:
-                biji.__dict__[f'_{field}'] = biji_dict[field]
+            biji.__dict__[f'_{field}'] = getattr(record, field)
+        biji.biji_json_path = cls.get_biji_json_path(filepath)
 
-        if biji._filepath != filepath:
-            biji._filepath = filepath
+        if record.moved:
             biji.write_file()
         return biji
 
@@ -130,49 +144,121 @@ class Biji:
     def _asjson(self) -> str:
         return json.dumps(self._asdict(), sort_keys=True, ensure_ascii=False)
 
-    def write_file(self) -> None:
-        self.biji_json_path.write_text(self._asjson(), encoding='utf-8')
+    @instrument.timed('write_file')
+    def write_file(self, writer: Optional[SidecarWriter] = None) -> None:
+        """
+        Replaces the '.biji.json' file atomically,
+        by writer if given, see sidecar.py.
+        """
+        if writer is None:
+            write_sidecar(str(self.biji_json_path), self._asjson())
+        else:
+            writer.write(str(self.biji_json_path), self._asjson())
 
     def insert_biji_to_db(self) -> None:
-        self.db.insert_to_bijis(self._asdict())
-        self.db.commit()
+        db = self.get_db()
+        db.insert_to_bijis(self._asdict())
+        db.commit()
 
     def insert_tags_to_db(self) -> None:
         """ Use this method only when self._filepath is new. """
+        db = self.get_db()
         tags = set(self._tags)
-        self.db.insert_to_tags(tags)
+        db.insert_to_tags(tags)
         for tag in tags:
-            self.db.insert_to_tag_biji(tag, self._filepath)
-        self.db.commit()
+            db.insert_to_tag_biji(tag, self._filepath)
+        db.commit()
 
     def insert_biji_and_tags_to_db(self) -> None:
-        self.insert_biji_to_db()
-        self.insert_tags_to_db()
+        self.get_db().insert_bijis([self._asdict()])
 
     def update_biji_to_db(self) -> None:
         """ updates the 'bijis' table, without updating the 'tags' table. """
-        self.db.update_biji(self._asdict())
-        self.db.commit()
+        db = self.get_db()
+        db.update_biji(self._asdict())
+        db.commit()
 
     def update_tags_to_db(self) -> None:
         """
         updates the 'tag_biji' table,
         and if necessary inserts new tags to the 'tags' table.
         """
-        old_tags = self.db.get_tags(self._filepath)
+        db = self.get_db()
+        old_tags = db.get_tags(self._filepath)
         for tag in old_tags:
-            self.db.unlink_tag(tag, self._filepath)
+            db.unlink_tag(tag, self._filepath)
 
         self.insert_tags_to_db()
-        self.db.commit()
+        db.commit()
 
     def update_biji_and_tags_to_db(self):
-        self.update_biji_to_db()
-        self.update_tags_to_db()
+        self.get_db().update_bijis([self._asdict()])
 
     def get_mtime_from_db(self) -> str:
         """
         Use bijiMTime to check if an record exists,
         return an empty string if it does not exist.
         """
-        return self.db.get_mtime(self._filepath)
+        return self.get_db().get_mtime(self._filepath)
+
+
+# noinspection PyPep8Naming
+class BijiRecord:
+    """
+    The fields of a '.biji.json' file, for reading many of them, e.g. by
+    the scanner. It is made from the parsed JSON without touching the
+    file or the database, a field missing in the JSON is computed like
+    Biji does, on first access only. Being slotted, a record takes much
+    less memory than a Biji.
+    """
+    __slots__ = Biji._fields + ('moved',)
+
+    def __init__(self, filepath: str, biji_dict: dict) -> None:
+        self.filepath = filepath
+        for field in Biji._fields[1:]:
+            if field in biji_dict:
+                setattr(self, field, biji_dict[field])
+        # The file has been moved along with its '.biji.json' file.
+        self.moved = biji_dict.get('filepath', filepath) != filepath
+
+    @classmethod
+    @instrument.timed('load_record')
+    def load(cls, filepath: str) -> BijiRecord:  # noqa:F821
+        biji_json_path = Biji.get_biji_json_path(filepath)
+        biji_json = biji_json_path.read_text(encoding='utf-8')
+        return cls(filepath, json.loads(biji_json))
+
+    def __getattr__(self, name: str):
+        """ Only called for a field that is not set yet. """
+        if name in ('filename', 'suffix'):
+            file_path = Path(self.filepath)
+            self.filename = file_path.name
+            self.suffix = file_path.suffix.lower()
+        elif name == 'mimetype':
+            self.mimetype = mimetypes.guess_type(
+                self.filepath, strict=False)[0]
+        elif name in ('filesize', 'updatedAt'):
+            filestat = Path(self.filepath).lstat()
+            self.filesize = filestat.st_size
+            self.updatedAt = datetime.fromtimestamp(
+                filestat.st_mtime).isoformat()
+        elif name in ('bijiCTime', 'bijiMTime'):
+            now = datetime.now().isoformat()
+            for field in ('bijiCTime', 'bijiMTime'):
+                try:
+                    object.__getattribute__(self, field)
+                except AttributeError:
+                    setattr(self, field, now)
+        elif name == 'backupAt':
+            self.backupAt = ''
+        elif name == 'tags':
+            self.tags = ()
+        else:
+            raise AttributeError(name)
+        return object.__getattribute__(self, name)
+
+    def _asdict(self) -> dict:
+        return {field: getattr(self, field) for field in Biji._fields}
+
+    def _asjson(self) -> str:
+        return json.dumps(self._asdict(), sort_keys=True, ensure_ascii=False)
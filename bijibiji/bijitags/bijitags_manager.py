@@ -1,14 +1,50 @@
-from PyQt5.QtCore import Qt, QModelIndex
+from typing import Optional
+
+from PyQt5.QtCore import Qt, QModelIndex, QThread, pyqtSignal
 from PyQt5.QtGui import QPalette
-from PyQt5.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QListWidget, \
-    QListWidgetItem, QApplication, QVBoxLayout, QComboBox, QPushButton, \
-    QMessageBox, QGroupBox, QInputDialog, qApp, QLabel, QFrame
+from PyQt5.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QListView, \
+    QApplication, QVBoxLayout, QComboBox, QPushButton, QMessageBox, \
+    QGroupBox, QInputDialog, qApp, QLabel, QFrame, QLineEdit, \
+    QProgressDialog
 
-from ..bijitags.biji import Biji
-from ..bijitags.helpers import get_checked_items
+from ..bijitags import bulk_tags
 from ..bijidb.bijidatabase import BijiDatabase
+from ..bijidb.tag_query import QuerySyntaxError
 from ..bijiscan.bijiscanner import biji_json_not_exists
 from .file_info_box import FileInfoBox
+from .list_models import TagListModel, TagSortProxy, FileListModel, \
+    TAG_ROLE, COUNT_ROLE, USED_AT_ROLE
+
+
+class BulkWorker(QThread):
+    """ Runs an operation of bulk_tags on a connection of its own. """
+    # files done, all files
+    progress = pyqtSignal(int, int)
+    # the BulkResult, when finished or cancelled
+    done = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, operation, args: tuple, parent=None) -> None:
+        super().__init__(parent)
+        self.operation = operation
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def run(self) -> None:
+        db = BijiDatabase.new_connection()
+        try:
+            result = self.operation(db, *self.args,
+                                    progress=self.progress.emit,
+                                    cancelled=lambda: self.cancelled)
+        except Exception as e:
+            self.failed.emit(f'{type(e).__name__}: {e}')
+            return
+        finally:
+            db.close_db()
+        self.done.emit(result)
 
 
 # noinspection PyArgumentList,PyUnresolvedReferences,PyCallByClass
@@ -16,6 +52,7 @@ class BijitagsManager(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.db = BijiDatabase
+        self.bulk_worker: Optional[BulkWorker] = None
         try:
             self.db.connect_db()
         except FileNotFoundError:
@@ -47,30 +84,42 @@ class BijitagsManager(QMainWindow):
             QApplication.instance().quit()
             sys.exit(1)
 
-        self.tags_by_count = None
-        self.tags_by_time = None
-        self.tags_by_alphabet = None
-
-        self.tag_list_by_count = QListWidget()
-        self.tag_list_by_count.doubleClicked.connect(self.edit_tag)
-        self.tag_list_by_count.currentItemChanged.connect(
-            self.update_file_list)
-
-        self.tag_list_by_time = QListWidget()
+        # A model per view, each fetches the tags in the order of its view,
+        # the checked tags are shared.
+        self.checked_tags = set()
+        self.tag_models = [
+            TagListModel(self.db, order, self.checked_tags, self)
+            for order in ('count', 'usedAt', 'tag')]
+        self.tags_by_count = TagSortProxy(
+            self.tag_models[0], COUNT_ROLE, show_count=True, parent=self)
+        self.tags_by_time = TagSortProxy(
+            self.tag_models[1], USED_AT_ROLE, Qt.DescendingOrder,
+            parent=self)
+        self.tags_by_alphabet = TagSortProxy(
+            self.tag_models[2], TAG_ROLE, parent=self)
+
+        self.tag_list_by_count = self.create_tag_list(self.tags_by_count)
+        self.tag_list_by_time = self.create_tag_list(self.tags_by_time)
         self.tag_list_by_time.setVisible(False)
-        self.tag_list_by_time.doubleClicked.connect(self.edit_tag)
-        self.tag_list_by_time.currentItemChanged.connect(
-            self.update_file_list)
-
-        self.tag_list_by_alphabet = QListWidget()
+        self.tag_list_by_alphabet = self.create_tag_list(
+            self.tags_by_alphabet)
         self.tag_list_by_alphabet.setVisible(False)
-        self.tag_list_by_alphabet.doubleClicked.connect(self.edit_tag)
-        self.tag_list_by_alphabet.currentItemChanged.connect(
-            self.update_file_list)
 
         self.files_box = QGroupBox('Files')
-        self.file_list = QListWidget()
-        self.file_list.currentItemChanged.connect(self.update_file_info)
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText(
+            'Search: photo AND (travel OR "new york") AND NOT private')
+        self.search_box.returnPressed.connect(self.search_files)
+        self.find_box = QLineEdit()
+        self.find_box.setPlaceholderText(
+            'Find files by name, folder or tag: report 2020, rep*')
+        self.find_box.returnPressed.connect(self.find_files)
+        self.file_model = FileListModel(self)
+        self.file_list = QListView()
+        self.file_list.setUniformItemSizes(True)
+        self.file_list.setModel(self.file_model)
+        self.file_list.selectionModel().currentChanged.connect(
+            self.update_file_info)
 
         self.file_info_box = FileInfoBox()
 
@@ -92,32 +141,25 @@ class BijitagsManager(QMainWindow):
         self.create_central_widget()
 
     def closeEvent(self, event):
+        if self.bulk_worker is not None:
+            self.bulk_worker.cancel()
+            self.bulk_worker.wait()
         self.db.close_db()
         event.accept()
 
-    @staticmethod
-    def generate_new_tags(old_tags: set, deleted: set, added: set) -> set:
-        return old_tags - deleted | added
-
-    @staticmethod
-    def update_tag_list(tags, tag_list: QListWidget) -> None:
-        tag_list.clear()
-        for row in tags:
-            item = QListWidgetItem(tag_list)
-            item.setData(Qt.UserRole, row[0])
-            if type(tags) is list:
-                item.setText(f"({row[1]}) {row[0]}")
-            else:
-                item.setText(row['tag'])
-            item.setCheckState(Qt.Unchecked)
+    def create_tag_list(self, proxy: TagSortProxy) -> QListView:
+        tag_list = QListView()
+        tag_list.setUniformItemSizes(True)
+        tag_list.setModel(proxy)
+        tag_list.doubleClicked.connect(self.edit_tag)
+        tag_list.selectionModel().currentChanged.connect(
+            self.update_file_list)
+        return tag_list
 
     def update_all_tag_lists(self) -> None:
-        self.tags_by_count = self.db.get_tags_order_by_count()
-        self.update_tag_list(self.tags_by_count, self.tag_list_by_count)
-        self.tags_by_time = self.db.get_tags_order_by_time()
-        self.update_tag_list(self.tags_by_time, self.tag_list_by_time)
-        self.tags_by_alphabet = self.db.get_tags_order_by_tag()
-        self.update_tag_list(self.tags_by_alphabet, self.tag_list_by_alphabet)
+        """ The views follow the row changes of their models. """
+        for model in self.tag_models:
+            model.refresh()
 
     # noinspection PyUnresolvedReferences
     def create_central_widget(self) -> None:
@@ -137,6 +179,9 @@ class BijitagsManager(QMainWindow):
         delete_button = QPushButton('Delete')
         delete_button.clicked.connect(self.delete_tags)
         buttons.addWidget(delete_button)
+        merge_button = QPushButton('Merge')
+        merge_button.clicked.connect(self.merge_tags)
+        buttons.addWidget(merge_button)
         add_button = QPushButton('Add')
         add_button.clicked.connect(self.add_tag)
         buttons.addWidget(add_button)
@@ -159,6 +204,8 @@ class BijitagsManager(QMainWindow):
 
         # Lists of files
         files_box_layout = QVBoxLayout()
+        files_box_layout.addWidget(self.find_box)
+        files_box_layout.addWidget(self.search_box)
         files_box_layout.addWidget(self.file_list)
         self.files_box.setLayout(files_box_layout)
 
@@ -185,14 +232,14 @@ class BijitagsManager(QMainWindow):
             self.tag_list_by_count.setVisible(False)
             self.tag_list_by_time.setVisible(False)
             self.tag_list_by_alphabet.setVisible(True)
-        self.update_file_list(self.current_tag_list.currentItem())
+        self.update_file_list(self.current_tag_list.currentIndex())
 
     def reload_tags(self) -> None:
         self.update_all_tag_lists()
 
     def delete_tags(self) -> None:
-        deleted_items = get_checked_items(self.current_tag_list)
-        if not deleted_items:
+        tags = set(self.checked_tags)
+        if not tags:
             return
 
         answer = QMessageBox.question(
@@ -204,39 +251,76 @@ class BijitagsManager(QMainWindow):
         if answer == QMessageBox.No:
             return
 
-        for item in deleted_items:
-            tag = item.data(Qt.UserRole)
-            self.delete_or_edit_tag(tag, '')
-            self.db.delete_tag(tag)
+        self.run_bulk('Deleting tags', bulk_tags.delete_tags, tags)
 
-        self.db.commit()
-        self.update_all_tag_lists()
+    def merge_tags(self) -> None:
+        tags = set(self.checked_tags)
+        if len(tags) < 2:
+            return
+
+        tag, ok = QInputDialog.getText(
+            self,
+            "Merge",
+            f"(all relative files will be affected.)\n"
+            f"Merge {len(tags)} tags into:")
+
+        tag = tag.strip()
+        if not ok or len(tag) == 0:
+            return
 
-    def delete_or_edit_tag(self, deleted: str, added: str) -> None:
+        self.run_bulk('Merging tags', bulk_tags.merge_tags, tags, tag)
 
-        if not deleted:
-            raise ValueError("'deleted' should be a non-empty string")
+    def run_bulk(self, title: str, operation, *args) -> None:
+        """
+        Runs an operation of bulk_tags on a BulkWorker, with a progress
+        dialog, the lists are updated when it is done.
+        """
+        if self.bulk_worker is not None:
+            return
+        dialog = QProgressDialog(title, 'Cancel', 0, 0, self)
+        dialog.setWindowTitle(title)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+
+        def show_progress(done: int, total: int) -> None:
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+
+        worker = BulkWorker(operation, args, self)
+        worker.progress.connect(show_progress)
+        worker.done.connect(lambda result: self.bulk_done(title, result))
+        worker.failed.connect(lambda error: self.bulk_failed(title, error))
+        worker.finished.connect(dialog.deleteLater)
+        worker.finished.connect(self.bulk_finished)
+        dialog.canceled.connect(worker.cancel)
+        self.bulk_worker = worker
+        worker.start()
+
+    def bulk_done(self, title: str, result: bulk_tags.BulkResult) -> None:
+        if result.cancelled or result.failed:
+            failed = '\n'.join(result.failed[:10])
+            QMessageBox.information(
+                self,
+                title,
+                f"{len(result.done)} files updated"
+                f"{', cancelled' if result.cancelled else ''}.\n"
+                f"{len(result.failed)} '.biji.json' files failed:\n"
+                f"{failed}\n",
+                QMessageBox.Close)
 
-        if added:
-            """ The situation of edit """
-            added = {added}
-        else:
-            """ The situation of delete """
-            added = set()
+    def bulk_failed(self, title: str, error: str) -> None:
+        QMessageBox.information(self, title, error, QMessageBox.Close)
 
-        for file in self.db.get_bijis(deleted):
-            biji = Biji.from_file(file)
-            biji.tags = self.generate_new_tags(set(biji.tags),
-                                               {deleted},
-                                               added)
-            biji.write_file()
-            self.db.update_biji_mtime(file, biji.bijiMTime)
+    def bulk_finished(self) -> None:
+        self.bulk_worker = None
+        self.update_all_tag_lists()
+        self.update_file_list(self.current_tag_list.currentIndex())
 
     def add_tag(self) -> None:
         pass
 
     def edit_tag(self, index: QModelIndex) -> None:
-        old_tag = index.data(Qt.UserRole)
+        old_tag = index.data(TAG_ROLE)
 
         tag, ok = QInputDialog.getText(
             self,
@@ -248,32 +332,69 @@ class BijitagsManager(QMainWindow):
         if not ok or len(tag) == 0:
             return
 
+        if tag == old_tag:
+            return
+
         if self.db.get_tag_atime(tag):
-            QMessageBox.information(
-                self, "Duplicated.", "The tag is already in the list.\n",
-                QMessageBox.Close)
+            answer = QMessageBox.question(
+                self,
+                "Duplicated",
+                f"The tag is already in the list.\n"
+                f"Merge '{old_tag}' into '{tag}'?",
+                defaultButton=QMessageBox.No)
+            if answer == QMessageBox.No:
+                return
+
+        self.run_bulk('Renaming tag', bulk_tags.rename_tag, old_tag, tag)
+
+    def update_file_list(self, current: QModelIndex) -> None:
+        if not current.isValid():
+            self.file_model.clear()
+            self.files_box.setTitle(f'Files')
             return
 
-        self.delete_or_edit_tag(old_tag, tag)
-        self.db.update_tag(old_tag, tag)
-        self.update_all_tag_lists()
+        tag = current.data(TAG_ROLE)
+        self.show_files(
+            lambda offset, limit: self.db.get_bijis_page(tag, limit, offset),
+            current.data(COUNT_ROLE))
 
-    def update_file_list(self, current: QListWidgetItem) -> None:
-        self.file_list.clear()
+    def search_files(self) -> None:
+        expression = self.search_box.text().strip()
+        if not expression:
+            self.update_file_list(self.current_tag_list.currentIndex())
+            return
 
-        if current is None:
-            self.files_box.setTitle(f'Files')
+        try:
+            total = self.db.count_bijis(expression)
+        except QuerySyntaxError as e:
+            QMessageBox.information(
+                self, "Search", f"[Syntax error]\n{e}\n", QMessageBox.Close)
             return
 
-        tag = current.data(Qt.UserRole)
-        for file in self.db.get_bijis(tag):
-            item = QListWidgetItem(self.file_list)
-            item.setText(file)
-        self.files_box.setTitle(f'Files - [{self.file_list.count()}]')
-        self.file_list.setCurrentRow(0)
+        self.show_files(
+            lambda offset, limit: list(
+                self.db.query_bijis(expression, limit, offset)),
+            total)
+
+    def find_files(self) -> None:
+        text = self.find_box.text().strip()
+        if not text:
+            self.update_file_list(self.current_tag_list.currentIndex())
+            return
+
+        self.show_files(
+            lambda offset, limit: self.db.search_bijis(text, limit, offset),
+            self.db.count_search(text))
+
+    def show_files(self, fetch, total: int) -> None:
+        """ fetch(offset, limit) returns a page of the files. """
+        self.file_model.set_source(fetch, total)
+        self.file_model.fetchMore()
+        self.files_box.setTitle(f'Files - [{total}]')
+        self.file_list.setCurrentIndex(self.file_model.index(0))
 
-    def update_file_info(self, current: QListWidgetItem) -> None:
-        self.file_info_box.update_file_info(current)
+    def update_file_info(self, current: QModelIndex) -> None:
+        self.file_info_box.update_file_index(current)
 
 
 if __name__ == '__main__':
@@ -15,11 +15,7 @@ class BijitagsWizard(QWizard):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.db = BijiDatabase
-        try:
-            self.db.connect_db()
-        except FileNotFoundError:
-            self.db.create_db()
-            self.db.connect_db()
+        self.db.open_db()
 
         print(os.getcwd())
 
@@ -0,0 +1,150 @@
+"""
+Renames, deletes and merges tags on all the files using them.
+
+The '.biji.json' files are rewritten on a pool of worker processes, in
+chunks, each replaced atomically by a SidecarWriter with one directory
+fsync per chunk. Then all the changes to the database are committed in one
+transaction.
+
+    rename_tag(db, 'photo', 'photos')
+    delete_tags(db, {'tmp', 'todo'})
+    merge_tags(db, {'pic', 'picture'}, 'photo')
+
+progress(done, total) is called after each chunk of files, and the
+operation stops when cancelled() returns True. A cancelled operation
+commits the files rewritten so far, and keeps the old tags, so that the
+database agrees with the '.biji.json' files. A file rewritten by a worker
+while cancelling is newer than its record, the next scan updates it.
+The records of the files that failed are left as they are, and the old
+tags are kept for them.
+"""
+import json
+from datetime import datetime
+from functools import partial
+from typing import Callable, FrozenSet, List, NamedTuple, Optional, Set
+
+from ..bijidb.bijidatabase import BijiDatabase
+from ..bijiscan.scan_engine import CHUNK_SIZE, parallel_map
+from .biji import Biji
+from .sidecar import SidecarWriter
+
+Progress = Callable[[int, int], None]
+Cancelled = Callable[[], bool]
+
+
+class BulkResult(NamedTuple):
+    # Files whose '.biji.json' has been rewritten.
+    done: List[str]
+    # Files whose '.biji.json' can not be read or written.
+    failed: List[str]
+    cancelled: bool
+
+
+def rewrite_biji_json(filepath: str,
+                      old_tags: FrozenSet[str],
+                      new_tag: str,
+                      mtime: str,
+                      writer: SidecarWriter) -> Optional[str]:
+    """
+    Replaces old_tags with new_tag in the '.biji.json' of filepath,
+    returns the new bijiMTime, or None if the file can not be rewritten.
+    """
+    biji_json_path = Biji.get_biji_json_path(filepath)
+    try:
+        biji_dict: dict = json.loads(biji_json_path.read_text(
+            encoding='utf-8'))
+        tags = set(biji_dict.get('tags', ())) - old_tags
+        if new_tag:
+            tags.add(new_tag)
+        biji_dict['tags'] = sorted(tags)
+        biji_dict['bijiMTime'] = mtime
+        writer.write(
+            str(biji_json_path),
+            json.dumps(biji_dict, sort_keys=True, ensure_ascii=False))
+    except (OSError, ValueError):
+        return None
+    return mtime
+
+
+def rewrite_chunk(filepaths: List[str],
+                  old_tags: FrozenSet[str],
+                  new_tag: str,
+                  mtime: str) -> List[Optional[str]]:
+    """ rewrite_biji_json() on a chunk of files, in one batch. """
+    try:
+        with SidecarWriter(batch_size=len(filepaths)) as writer:
+            mtimes = [rewrite_biji_json(
+                filepath, old_tags, new_tag, mtime, writer)
+                for filepath in filepaths]
+    except OSError:
+        return [None] * len(filepaths)
+    return mtimes
+
+
+def replace_tags(db: type(BijiDatabase),
+                 old_tags: Set[str],
+                 new_tag: str = '',
+                 jobs: Optional[int] = None,
+                 progress: Optional[Progress] = None,
+                 cancelled: Optional[Cancelled] = None) -> BulkResult:
+    """ Replaces old_tags with new_tag ('' to delete them) everywhere. """
+    files = set()
+    for tag in old_tags:
+        files |= db.get_bijis(tag)
+    files = sorted(files)
+
+    rewrite = partial(rewrite_chunk,
+                      old_tags=frozenset(old_tags),
+                      new_tag=new_tag,
+                      mtime=datetime.now().isoformat())
+    chunks = [files[i:i + CHUNK_SIZE]
+              for i in range(0, len(files), CHUNK_SIZE)]
+    result = BulkResult([], [], False)
+    # Of the files rewritten.
+    mtimes = {}
+    results = parallel_map(rewrite, chunks, jobs, chunk_size=1)
+    try:
+        for chunk, chunk_mtimes in zip(chunks, results):
+            for filepath, mtime in zip(chunk, chunk_mtimes):
+                if mtime:
+                    mtimes[filepath] = mtime
+                    result.done.append(filepath)
+                else:
+                    result.failed.append(filepath)
+            if progress:
+                progress(len(result.done) + len(result.failed), len(files))
+            if cancelled and cancelled():
+                result = result._replace(cancelled=True)
+                break
+    finally:
+        results.close()
+
+    db.replace_tags(mtimes, set(old_tags), new_tag,
+                    delete_old_tags=not result.cancelled
+                    and not result.failed)
+    return result
+
+
+def rename_tag(db: type(BijiDatabase),
+               old_tag: str,
+               new_tag: str,
+               **kwargs) -> BulkResult:
+    if not new_tag:
+        raise ValueError("'new_tag' should be a non-empty string")
+    return replace_tags(db, {old_tag}, new_tag, **kwargs)
+
+
+def delete_tags(db: type(BijiDatabase),
+                tags: Set[str],
+                **kwargs) -> BulkResult:
+    return replace_tags(db, tags, '', **kwargs)
+
+
+def merge_tags(db: type(BijiDatabase),
+               tags: Set[str],
+               into: str,
+               **kwargs) -> BulkResult:
+    """ Merges tags into one tag, which may be new or one of tags. """
+    if not into:
+        raise ValueError("'into' should be a non-empty string")
+    return replace_tags(db, set(tags) - {into}, into, **kwargs)
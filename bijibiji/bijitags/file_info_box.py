@@ -1,20 +1,28 @@
-from typing import Optional
+from typing import List, Optional
 
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import Qt, QModelIndex
 from PyQt5.QtWidgets import QGroupBox, QListWidget, QLabel, QFrame, \
     QListWidgetItem, QVBoxLayout
 
 from ..bijidb.bijidatabase import BijiDatabase
+from .thumbnails import ThumbnailCache
 
 
 # noinspection PyArgumentList
 class FileInfoBox(QGroupBox):
+    thumbnails: Optional[ThumbnailCache] = None
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.db = BijiDatabase
         self.preview_width = 200
         self.preview_margin = 50
+        self.current_file = ''
+
+        # Shared by all the boxes, so that a thumbnail is made only once.
+        if FileInfoBox.thumbnails is None:
+            FileInfoBox.thumbnails = ThumbnailCache(self.preview_width)
+        self.thumbnails.ready.connect(self.show_thumbnail)
 
         self.setTitle('File info')
         self.file_tag_list = QListWidget()
@@ -35,20 +43,56 @@ class FileInfoBox(QGroupBox):
         self.setFixedWidth(self.preview_width + self.preview_margin + 20)
 
     def update_file_info(self, item: Optional[QListWidgetItem]) -> None:
-        self.file_tag_list.clear()
         if item is None:
+            self.show_file_info('')
+            return
+
+        neighbours = []
+        file_list = item.listWidget()
+        if file_list is not None:
+            row = file_list.row(item)
+            neighbours = [file_list.item(row - 1), file_list.item(row + 1)]
+        self.show_file_info(item.text(),
+                            [n.text() for n in neighbours if n is not None])
+
+    def update_file_index(self, index: QModelIndex) -> None:
+        """ The same as update_file_info, for a view of a model. """
+        if not index.isValid():
+            self.show_file_info('')
+            return
+
+        neighbours = [index.sibling(index.row() - 1, 0),
+                      index.sibling(index.row() + 1, 0)]
+        self.show_file_info(index.data(),
+                            [n.data() for n in neighbours if n.isValid()])
+
+    def show_file_info(self, file: str, neighbours: List[str] = ()) -> None:
+        """ neighbours are the files whose thumbnails are prefetched. """
+        self.file_tag_list.clear()
+        self.current_file = file
+        if not file:
             self.file_preview.setText('Preview')
             return
 
-        file = item.text()
-        preview = QPixmap(file)
-        if preview.isNull():
-            self.file_preview.setText(f'{file}')
-        else:
-            thumb = preview.scaled(
-                self.preview_width, self.preview_width, Qt.KeepAspectRatio)
-            self.file_preview.setPixmap(thumb)
+        if not self.show_thumbnail(file):
+            self.file_preview.setText('Loading...')
+            self.thumbnails.request(file)
+        for neighbour in neighbours:
+            self.thumbnails.request(neighbour)
 
         for tag in self.db.get_tags(file):
             item = QListWidgetItem(self.file_tag_list)
             item.setText(tag)
+
+    def show_thumbnail(self, file: str) -> bool:
+        """ Returns False if the thumbnail of file is not ready yet. """
+        if file != self.current_file:
+            return True
+        thumb = self.thumbnails.get(file)
+        if thumb is None:
+            return False
+        if thumb.isNull():
+            self.file_preview.setText(f'{file}')
+        else:
+            self.file_preview.setPixmap(thumb)
+        return True
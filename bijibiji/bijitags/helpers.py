@@ -1,4 +1,4 @@
-from typing import Set, List
+from typing import Set
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QListWidget, QListWidgetItem
@@ -24,21 +24,11 @@ def check_all(list_widget: QListWidget) -> None:
 
 
 def delete_from_list(list_widget: QListWidget) -> Set[str]:
-    checked_items = get_checked_items(list_widget)
-
     deleted_items = set()
-    for item in checked_items:
-        deleted_items.add(item.text().strip())
-        row = list_widget.row(item)
-        list_widget.takeItem(row)
+    for row in reversed(range(list_widget.count())):
+        item: QListWidgetItem = list_widget.item(row)
+        if item.checkState() == Qt.Checked:
+            deleted_items.add(item.text().strip())
+            list_widget.takeItem(row)
 
     return deleted_items
-
-
-def get_checked_items(list_widget: QListWidget) -> List[QListWidgetItem]:
-    checked_items = []
-    for i in range(list_widget.count()):
-        item: QListWidgetItem = list_widget.item(i)
-        if item.checkState() == Qt.Checked:
-            checked_items.append(item)
-    return checked_items
@@ -0,0 +1,235 @@
+"""
+Models of the tag and file lists of BijitagsManager.
+
+TagListModel holds rows (tag, count, usedAt) of the tags in one of the
+orders of BijiDatabase.TAG_ROW_ORDERS, fetched TAG_FETCH_SIZE at a time
+in that order, by its index, as a view scrolls down (canFetchMore/
+fetchMore). The fetched rows are always the first ones of the order, so
+a TagSortProxy of the model sorts them right. refresh() applies the
+difference with the database for the fetched tags as row changes, so
+that the views keep their selection and scroll position after an edit,
+and the proxy moves the rows whose count or time changed.
+
+FileListModel fetches the files page by page as the view scrolls down,
+from a function fetch(offset, limit).
+"""
+from typing import Callable, List, Optional, Set, Tuple
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, \
+    QSortFilterProxyModel
+
+from ..bijidb.bijidatabase import BijiDatabase
+
+TAG_ROLE = Qt.UserRole
+COUNT_ROLE = Qt.UserRole + 1
+USED_AT_ROLE = Qt.UserRole + 2
+
+# Number of files fetched at a time by FileListModel.
+FETCH_SIZE = 500
+
+# Number of tags fetched at a time by TagListModel.
+TAG_FETCH_SIZE = 2000
+
+Fetch = Callable[[int, int], List[str]]
+
+# The column of the rows of TagListModel by which an order sorts them.
+ORDER_COLUMNS = {'tag': 0, 'count': 1, 'usedAt': 2}
+
+
+# noinspection PyMethodOverriding
+class TagListModel(QAbstractListModel):
+    def __init__(self,
+                 db: type(BijiDatabase),
+                 order: str = 'tag',
+                 checked: Optional[Set[str]] = None,
+                 parent=None) -> None:
+        """
+        order is a key of TAG_ROW_ORDERS, checked the checked tags,
+        which the models of the other orders may share.
+        """
+        super().__init__(parent)
+        self.db = db
+        self.order = order
+        # [tag, count, usedAt]
+        self.rows: List[list] = []
+        self.checked: Set[str] = set() if checked is None else checked
+        # (order column, tag) of the last row fetched, in the order.
+        self._last: Optional[Tuple[object, str]] = None
+        self._done = False
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        tag, count, used_at = self.rows[index.row()]
+        if role in (Qt.DisplayRole, TAG_ROLE):
+            return tag
+        if role == COUNT_ROLE:
+            return count
+        if role == USED_AT_ROLE:
+            return used_at
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if tag in self.checked else Qt.Unchecked
+        return None
+
+    def setData(self, index: QModelIndex, value, role: int = Qt.EditRole):
+        if not index.isValid() or role != Qt.CheckStateRole:
+            return False
+        tag = self.rows[index.row()][0]
+        if value == Qt.Checked:
+            self.checked.add(tag)
+        else:
+            self.checked.discard(tag)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    def flags(self, index: QModelIndex):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def canFetchMore(self, parent: QModelIndex = QModelIndex()) -> bool:
+        return not parent.isValid() and not self._done
+
+    def fetchMore(self, parent: QModelIndex = QModelIndex()) -> None:
+        if not self.canFetchMore(parent):
+            return
+        rows = self.db.get_tag_rows_page(self.order, self._last,
+                                         TAG_FETCH_SIZE)
+        if len(rows) < TAG_FETCH_SIZE:
+            self._done = True
+        if rows:
+            self._last = self._key(rows[-1])
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first,
+                                 first + len(rows) - 1)
+            self.rows.extend(list(row) for row in rows)
+            self.endInsertRows()
+
+    def _key(self, row) -> Tuple[object, str]:
+        return row[ORDER_COLUMNS[self.order]], row[0]
+
+    def refresh(self) -> None:
+        """
+        Applies the changes in the database to the fetched tags as row
+        changes, the new tags after them are left to fetchMore().
+        """
+        if self._done:
+            rows = self.db.get_tag_rows_page(self.order)
+        elif self._last is not None:
+            rows = self.db.get_tag_rows_up_to(self.order, self._last)
+        else:
+            return
+        if rows:
+            self._last = self._key(rows[-1])
+        new_rows = {tag: [tag, count, used_at]
+                    for tag, count, used_at in rows}
+
+        # Removes from the bottom, a run of rows at a time.
+        end = len(self.rows) - 1
+        while end >= 0:
+            if self.rows[end][0] in new_rows:
+                end -= 1
+                continue
+            start = end
+            while start > 0 and self.rows[start - 1][0] not in new_rows:
+                start -= 1
+            self.beginRemoveRows(QModelIndex(), start, end)
+            del self.rows[start:end + 1]
+            self.endRemoveRows()
+            end = start - 1
+
+        for i, row in enumerate(self.rows):
+            new_row = new_rows.pop(row[0])
+            if new_row != row:
+                self.rows[i] = new_row
+                index = self.index(i)
+                self.dataChanged.emit(index, index)
+
+        if new_rows:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first,
+                                 first + len(new_rows) - 1)
+            self.rows.extend(new_rows.values())
+            self.endInsertRows()
+
+        # Not by the rows, the models of the other orders may show others.
+        self.checked.intersection_update(
+            row[0] for row in self.db.get_tag_rows(self.checked))
+
+
+class TagSortProxy(QSortFilterProxyModel):
+    """ A sorted view of TagListModel, optionally showing the counts. """
+
+    def __init__(self,
+                 source: TagListModel,
+                 sort_role: int,
+                 order: Qt.SortOrder = Qt.AscendingOrder,
+                 show_count: bool = False,
+                 parent=None) -> None:
+        super().__init__(parent)
+        self.show_count = show_count
+        self.setSourceModel(source)
+        self.setSortRole(sort_role)
+        self.setSortCaseSensitivity(Qt.CaseSensitive)
+        self.setDynamicSortFilter(True)
+        self.sort(0, order)
+
+    def lessThan(self, left: QModelIndex, right: QModelIndex) -> bool:
+        """ Ties are sorted by the tag, as in the database. """
+        role = self.sortRole()
+        return (left.data(role), left.data(TAG_ROLE)) \
+            < (right.data(role), right.data(TAG_ROLE))
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if role == Qt.DisplayRole and self.show_count:
+            return f'({index.data(COUNT_ROLE)}) {index.data(TAG_ROLE)}'
+        return super().data(index, role)
+
+
+# noinspection PyMethodOverriding
+class FileListModel(QAbstractListModel):
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self.files: List[str] = []
+        self.total = 0
+        self._fetch: Optional[Fetch] = None
+        self._done = True
+
+    def set_source(self, fetch: Optional[Fetch], total: int = 0) -> None:
+        """ total is the number of all files, shown in the title. """
+        self.beginResetModel()
+        self.files = []
+        self.total = total
+        self._fetch = fetch
+        self._done = fetch is None
+        self.endResetModel()
+
+    def clear(self) -> None:
+        self.set_source(None)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.files)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if index.isValid() and role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return self.files[index.row()]
+        return None
+
+    def canFetchMore(self, parent: QModelIndex = QModelIndex()) -> bool:
+        return not parent.isValid() and not self._done
+
+    def fetchMore(self, parent: QModelIndex = QModelIndex()) -> None:
+        if not self.canFetchMore(parent):
+            return
+        files = self._fetch(len(self.files), FETCH_SIZE)
+        if len(files) < FETCH_SIZE:
+            self._done = True
+        if files:
+            first = len(self.files)
+            self.beginInsertRows(QModelIndex(), first,
+                                 first + len(files) - 1)
+            self.files.extend(files)
+            self.endInsertRows()
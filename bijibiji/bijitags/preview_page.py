@@ -3,6 +3,8 @@ from PyQt5.QtWidgets import QWizardPage, QListWidgetItem, QGroupBox, \
     QVBoxLayout, QListWidget, QHBoxLayout, QWizard, QLabel, QMessageBox
 
 from .biji import Biji
+from .tag_index import refresh_tags
+from ..bijidb.bijidatabase import BijiDatabase
 
 
 # noinspection PyArgumentList,PyAttributeOutsideInit,PyCallByClass
@@ -81,6 +83,7 @@ class PreviewPage(QWizardPage):
         Biji.update_tags_for_files(self.files,
                                    self.deleted_tags,
                                    self.new_added_tags)
+        refresh_tags(BijiDatabase, self.deleted_tags | self.new_added_tags)
         return True
 
     def create_files_box(self):
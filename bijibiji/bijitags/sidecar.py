@@ -0,0 +1,145 @@
+"""
+Atomic writes of the '.biji.json' files.
+
+A file is written to a temporary file in the same directory, which then
+replaces the file by os.replace(), so a crash leaves either the old or
+the new content, never a truncated file. The temporary name ends with
+'.tmp', so that the scanner never takes it for a '.biji.json' file.
+
+write_sidecar() writes one file, and fsyncs the file and its directory.
+SidecarWriter writes many files, and in safe mode fsyncs each directory
+once per batch instead of once per file:
+
+    1. write and fsync the temporary files of the batch,
+    2. replace the files,
+    3. fsync each directory of the batch once.
+
+Only the files written are synced, not the other filesystems and files
+that os.sync() would flush too.
+
+The fast mode skips the fsyncs, it still never leaves a truncated file
+when the program crashes, but may lose the last changes on a power loss.
+
+    with SidecarWriter() as writer:
+        for path, text in files:
+            writer.write(path, text)
+"""
+import os
+from typing import List, Set, Tuple
+
+# Number of files replaced after one barrier.
+BATCH_SIZE = 1000
+
+TEMP_SUFFIX = '.tmp'
+
+
+def temp_path(path: str) -> str:
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.{os.getpid()}{TEMP_SUFFIX}')
+
+
+def fsync_dir(directory: str) -> None:
+    """ Makes the renames in directory durable, where it is supported. """
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except OSError:
+        # Directories can not be opened on Windows.
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_temp(path: str, text: str, fsync: bool) -> str:
+    temp = temp_path(path)
+    try:
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        _remove(temp)
+        raise
+    return temp
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def write_sidecar(path: str, text: str, safe: bool = True) -> None:
+    """ Replaces the content of path with text atomically. """
+    temp = _write_temp(path, text, fsync=safe)
+    try:
+        os.replace(temp, path)
+    except BaseException:
+        _remove(temp)
+        raise
+    if safe:
+        fsync_dir(os.path.dirname(path))
+
+
+class SidecarWriter:
+    """
+    Writes files atomically in batches, see the module docstring.
+    A file is replaced only when its batch is flushed, at the latest when
+    the writer is closed, a write() that fails raises at once.
+    """
+
+    def __init__(self, safe: bool = True, batch_size: int = BATCH_SIZE):
+        self.safe = safe
+        self.batch_size = batch_size
+        # (temporary file, path) of the files not yet replaced.
+        self._pending: List[Tuple[str, str]] = []
+
+    def __enter__(self) -> 'SidecarWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, path: str, text: str) -> None:
+        if not self.safe:
+            write_sidecar(path, text, safe=False)
+            return
+        self._pending.append((_write_temp(path, text, fsync=True), path))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Replaces the files written so far. """
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        directories: Set[str] = set()
+        for i, (temp, path) in enumerate(pending):
+            try:
+                os.replace(temp, path)
+            except BaseException:
+                self._pending = pending[i:]
+                self.discard()
+                raise
+            directories.add(os.path.dirname(path))
+
+        for directory in directories:
+            fsync_dir(directory)
+
+    def discard(self) -> None:
+        """ Removes the temporary files not yet replaced. """
+        pending, self._pending = self._pending, []
+        for temp, _ in pending:
+            _remove(temp)
+
+    def close(self) -> None:
+        self.flush()
@@ -0,0 +1,171 @@
+"""
+An in-memory prefix index of the tags, for the completion of tags.
+
+The tags are kept sorted by their case-folded text, the tags starting
+with a prefix are a range found by bisect, and the range is ranked by the
+number of files of a tag and how recently it was used:
+
+    score = log(1 + count) + RECENT_WEIGHT * 0.5 ** (age in days / HALF_LIFE)
+
+A short prefix matches a large part of the tags, then the tags are taken
+in the order of their scores instead, until enough of them match.
+
+The index is loaded once per process by shared_index(), and the tags
+changed by the process are reloaded into it by refresh_tags().
+"""
+import bisect
+import heapq
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..bijidb.bijidatabase import BijiDatabase
+
+# Number of tags returned by complete().
+COMPLETIONS = 20
+
+RECENT_WEIGHT = 2.0
+
+# Days after which the recency of a tag counts half.
+HALF_LIFE = 30.0
+
+# A range larger than this is searched in the order of the scores.
+RANKED_SCAN = 2000
+
+# Sorts after every character, the end of the range of a prefix.
+_LAST = '\U0010ffff'
+
+_index: Optional['TagIndex'] = None
+
+
+def score(count: int, used_at: str, now: datetime) -> float:
+    try:
+        age = (now - datetime.fromisoformat(used_at)).total_seconds()
+    except (TypeError, ValueError):
+        return math.log1p(count)
+    recency = 0.5 ** (max(age, 0) / 86400 / HALF_LIFE)
+    return math.log1p(count) + RECENT_WEIGHT * recency
+
+
+class TagIndex:
+    def __init__(self,
+                 rows: Iterable[Tuple[str, int, str]] = (),
+                 now: Optional[datetime] = None) -> None:
+        """ rows are (tag, count, usedAt) as get_tag_rows() returns. """
+        self.now = now or datetime.now()
+        # tag -> (count, usedAt)
+        self.rows: Dict[str, Tuple[int, str]] = {}
+        self.scores: Dict[str, float] = {}
+        for tag, count, used_at in rows:
+            self.rows[tag] = (count, used_at)
+            self.scores[tag] = score(count, used_at, self.now)
+        # (case-folded tag, tag), sorted
+        self.keys: List[Tuple[str, str]] = sorted(
+            (tag.casefold(), tag) for tag in self.rows)
+        # (-score, tag), the best first
+        self.ranked: List[Tuple[float, str]] = sorted(
+            (-value, tag) for tag, value in self.scores.items())
+
+    @classmethod
+    def load(cls, db: type(BijiDatabase)) -> 'TagIndex':
+        return cls(db.get_tag_rows())
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.rows
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        key = prefix.casefold()
+        return (bisect.bisect_left(self.keys, (key,)),
+                bisect.bisect_left(self.keys, (key + _LAST,)))
+
+    def complete(self, prefix: str, limit: int = COMPLETIONS) -> List[str]:
+        """ The best tags starting with prefix, case-insensitively. """
+        if not prefix:
+            return [tag for _, tag in self.ranked[:limit]]
+        start, end = self._range(prefix)
+        if end - start <= RANKED_SCAN:
+            best = heapq.nsmallest(
+                limit, ((-self.scores[tag], tag)
+                        for _, tag in self.keys[start:end]))
+            return [tag for _, tag in best]
+
+        key = prefix.casefold()
+        result = []
+        for _, tag in self.ranked:
+            if tag.casefold().startswith(key):
+                result.append(tag)
+                if len(result) == limit:
+                    break
+        return result
+
+    def count(self, prefix: str) -> int:
+        """ The number of tags starting with prefix. """
+        start, end = self._range(prefix)
+        return end - start
+
+    def update(self, tag: str, count: int, used_at: str) -> None:
+        """ Adds a tag, or changes the count and usedAt of it. """
+        if tag in self.rows:
+            self._remove_ranked(tag)
+        else:
+            bisect.insort(self.keys, (tag.casefold(), tag))
+        self.rows[tag] = (count, used_at)
+        self.scores[tag] = score(count, used_at, datetime.now())
+        bisect.insort(self.ranked, (-self.scores[tag], tag))
+
+    def remove(self, tag: str) -> None:
+        if tag not in self.rows:
+            return
+        self._remove_ranked(tag)
+        key = (tag.casefold(), tag)
+        del self.keys[bisect.bisect_left(self.keys, key)]
+        del self.rows[tag]
+        del self.scores[tag]
+
+    def _remove_ranked(self, tag: str) -> None:
+        item = (-self.scores[tag], tag)
+        del self.ranked[bisect.bisect_left(self.ranked, item)]
+
+
+def shared_index(db: type(BijiDatabase)) -> TagIndex:
+    """ The index of this process, loaded from db at the first call. """
+    global _index
+    if _index is None:
+        _index = TagIndex.load(db)
+    return _index
+
+
+def refresh_tags(db: type(BijiDatabase), tags: Iterable[str]) -> None:
+    """ Reloads tags from db into the shared index, if it is loaded. """
+    if _index is None:
+        return
+    tags = set(tags)
+    for tag, count, used_at in db.get_tag_rows(tags):
+        _index.update(tag, count, used_at)
+        tags.discard(tag)
+    for tag in tags:
+        _index.remove(tag)
+
+
+if __name__ == '__main__':
+
+    import sys
+    import time
+
+    from .. import change_cwd
+
+    change_cwd()
+    BijiDatabase.connect_db()
+    start = time.perf_counter()
+    index = shared_index(BijiDatabase)
+    print(f'{len(index)} tags loaded in '
+          f'{(time.perf_counter() - start) * 1000:.1f}ms')
+    for prefix in sys.argv[1:] or ['']:
+        start = time.perf_counter()
+        tags = index.complete(prefix)
+        print(f'{prefix!r}: {(time.perf_counter() - start) * 1000:.2f}ms, '
+              f'{index.count(prefix)} tags: {", ".join(tags)}')
+    BijiDatabase.close_db()
@@ -0,0 +1,71 @@
+"""
+Recommends tags for a set of files by the co-occurrence of the tags,
+counted in the table tag_pairs, see TAG_PAIRS in bijidb/migrations.py.
+
+For the tags s of the files, with w(s) the share of the files having s,
+a tag c is scored by
+
+    score(c) = sum of w(s) * P(c | s) * PMI(c, s), for PMI(c, s) > 0
+
+with P(c | s) = n(c, s) / n(s) and PMI(c, s) = log(N n(c, s) / n(c) n(s)),
+N the number of files and n() the numbers of files of the tags. PMI alone
+prefers the rare tags seen once with s, P(c | s) alone prefers the tags
+used everywhere, the product needs both.
+
+Only the MAX_TAGS tags of the most files are used, each with its
+PAIRS_PER_TAG most frequent pairs, so that the time doesn't grow with the
+number of tags. A tag used with everything otherwise reads a row of
+tag_pairs per tag.
+"""
+import math
+from typing import Dict, Iterable, List, Tuple
+
+from ..bijidb.bijidatabase import BijiDatabase
+
+# Number of tags returned by recommend().
+RECOMMENDATIONS = 20
+
+MAX_TAGS = 50
+
+PAIRS_PER_TAG = 200
+
+
+def tag_weights(tag_sets: List[set]) -> Dict[str, float]:
+    """ The share of the tag sets having each tag. """
+    weights: Dict[str, float] = {}
+    for tags in tag_sets:
+        for tag in tags:
+            weights[tag] = weights.get(tag, 0) + 1 / len(tag_sets)
+    return weights
+
+
+def recommend(db: type(BijiDatabase),
+              weights: Dict[str, float],
+              exclude: Iterable[str] = (),
+              limit: int = RECOMMENDATIONS) -> List[Tuple[str, float]]:
+    """
+    (tag, score) of the best tags for weights, as tag_weights() returns,
+    leaving out the tags in weights and in exclude.
+    """
+    if not weights:
+        return []
+    files = db.count_files()
+    tags = sorted(weights, key=lambda tag: (-weights[tag], tag))[:MAX_TAGS]
+    counts = {tag: count for tag, count, _ in db.get_tag_rows(tags)}
+    exclude = set(exclude) | set(weights)
+
+    scores: Dict[str, float] = {}
+    for tag in tags:
+        if not counts.get(tag):
+            continue
+        for other, pairs, other_count in db.get_tag_pairs(tag,
+                                                          PAIRS_PER_TAG):
+            if other in exclude or not other_count:
+                continue
+            pmi = math.log(files * pairs / (other_count * counts[tag]))
+            if pmi <= 0:
+                continue
+            scores[other] = scores.get(other, 0) \
+                + weights[tag] * pairs / counts[tag] * pmi
+
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
@@ -1,14 +1,19 @@
 from typing import List
 
-from PyQt5.QtCore import Qt, QModelIndex
+from PyQt5.QtCore import Qt, QModelIndex, QStringListModel
 from PyQt5.QtWidgets import QWizard, QWizardPage, QHBoxLayout, QGroupBox, \
-    QVBoxLayout, QPushButton, QListWidget, QListWidgetItem, \
-    QInputDialog, QMessageBox
+    QVBoxLayout, QPushButton, QListWidget, QListWidgetItem, QLineEdit, \
+    QCompleter, QMessageBox
 
-from .biji import Biji
+from .biji import Biji, BijiRecord
 from .helpers import check_all, delete_from_list
 from ..bijidb.bijidatabase import BijiDatabase
 from .file_info_box import FileInfoBox
+from .tag_index import shared_index
+from .tag_recommend import recommend, tag_weights
+
+# Number of tags shown in the list of all tags.
+ALL_TAGS_SHOWN = 200
 
 
 # noinspection PyArgumentList,PyAttributeOutsideInit,PyCallByClass
@@ -21,6 +26,7 @@ class TagsPage(QWizardPage):
         self.old_files = set()
         self.new_common_tags = set()
         self.recently_deleted_tags = set()
+        self.tag_index = None
         self.button_max_width = 50
         self.box_mini_width = 225
         self.create_files_box()
@@ -67,8 +73,7 @@ class TagsPage(QWizardPage):
         tag_set_list: List[set] = []
         for file in self.files:
             if Biji.get_biji_json_path(file).exists():
-                biji = Biji.from_file(file)
-                tag_set_list.append(set(biji.tags))
+                tag_set_list.append(set(BijiRecord.load(file).tags))
             else:
                 tag_set_list.append(set())
 
@@ -96,9 +101,16 @@ class TagsPage(QWizardPage):
             self.recently_deleted_tags - recommend_tags - self.common_tags
         self.recommendTagsList.insertItems(0, recently_deleted_tags)
 
-        for row in BijiDatabase.get_all_tags_desc():
-            item = QListWidgetItem(self.allTagsList)
-            item.setText(row['tag'])
+        # Then the tags used with the tags of the files.
+        recommended = recommend(BijiDatabase, tag_weights(tag_set_list),
+                                exclude=recently_deleted_tags)
+        for tag, score in recommended:
+            item = QListWidgetItem(self.recommendTagsList)
+            item.setText(tag)
+            item.setToolTip(f'score {score:.3f}')
+
+        self.tag_index = shared_index(BijiDatabase)
+        self.filter_all_tags(self.allTagsFilter.text())
 
         self.fileList.setCurrentRow(0)
 
@@ -145,9 +157,20 @@ class TagsPage(QWizardPage):
         add_tags_button.setMaximumWidth(self.button_max_width)
         add_tags_button.clicked.connect(self.add_tags)
 
+        self.newTagEdit = QLineEdit()
+        self.newTagEdit.setPlaceholderText("New tag")
+        self.newTagEdit.returnPressed.connect(self.add_tags)
+        self.newTagEdit.textEdited.connect(self.update_completions)
+        self.tagCompleter = QCompleter(self)
+        self.tagCompleter.setModel(QStringListModel(self.tagCompleter))
+        # The index has already filtered and ranked the tags.
+        self.tagCompleter.setCompletionMode(
+            QCompleter.UnfilteredPopupCompletion)
+        self.newTagEdit.setCompleter(self.tagCompleter)
+
         buttons_layout.addWidget(all_tags_button)
         buttons_layout.addWidget(delete_tags_button)
-        buttons_layout.addStretch()
+        buttons_layout.addWidget(self.newTagEdit)
         buttons_layout.addWidget(add_tags_button)
 
         self.tagList = QListWidget()
@@ -170,7 +193,11 @@ class TagsPage(QWizardPage):
         self.allTagsBox = QGroupBox("All Tags")
         self.allTagsBox.setMinimumWidth(self.box_mini_width)
         layout = QVBoxLayout()
+        self.allTagsFilter = QLineEdit()
+        self.allTagsFilter.setPlaceholderText("Filter")
+        self.allTagsFilter.textChanged.connect(self.filter_all_tags)
         self.allTagsList = QListWidget()
+        layout.addWidget(self.allTagsFilter)
         layout.addWidget(self.allTagsList)
         self.allTagsBox.setLayout(layout)
 
@@ -184,10 +211,28 @@ class TagsPage(QWizardPage):
             if not self.recommendTagsList.findItems(item, Qt.MatchExactly):
                 self.recommendTagsList.insertItem(0, item)
 
+    def update_completions(self, text: str) -> None:
+        text = text.strip()
+        if not text or self.tag_index is None:
+            self.tagCompleter.popup().hide()
+            return
+        self.tagCompleter.model().setStringList(self.tag_index.complete(text))
+        self.tagCompleter.complete()
+
+    def filter_all_tags(self, text: str) -> None:
+        """ The best tags starting with text, all tags if empty. """
+        if self.tag_index is None:
+            return
+        text = text.strip()
+        tags = self.tag_index.complete(text, ALL_TAGS_SHOWN)
+        self.allTagsList.clear()
+        self.allTagsList.addItems(tags)
+        total = self.tag_index.count(text) if text else len(self.tag_index)
+        self.allTagsBox.setTitle(f"All Tags - [{len(tags)}/{total}]")
+
     def add_tags(self) -> None:
-        tag, ok = QInputDialog.getText(self, "New tag", "New tag:")
-        tag = tag.strip()
-        if not ok or len(tag) == 0:
+        tag = self.newTagEdit.text().strip()
+        if len(tag) == 0:
             return
         if self.tagList.findItems(
                 tag, Qt.MatchFixedString | Qt.MatchCaseSensitive):
@@ -199,6 +244,7 @@ class TagsPage(QWizardPage):
         item.setText(tag)
         item.setCheckState(Qt.Unchecked)
         item.setFlags(item.flags() | Qt.ItemIsEditable)
+        self.newTagEdit.clear()
 
     def copy_to_common_tags(self, index: QModelIndex) -> None:
         if not self.tagList.findItems(
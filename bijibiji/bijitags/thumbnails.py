@@ -0,0 +1,284 @@
+"""
+The thumbnails shown by FileInfoBox.
+
+A thumbnail is made once on a QThreadPool and kept on disk in the cache
+folder of the user, see cache_folder(), keyed by the absolute path, mtime
+and size of the file, so that a modified file gets a new one. The cache
+is not under HOME, where the scanner and the watcher would walk it. An
+LRU of QPixmap in memory sits in front of the disk cache. The disk cache
+is capped at DISK_CACHE_LIMIT bytes, the least recently used thumbnails
+are evicted.
+
+A JPEG file with a thumbnail embedded in its EXIF data uses that one,
+without decoding the full image.
+"""
+import hashlib
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+THUMBNAIL_FOLDER = 'thumbnails'
+
+THUMBNAIL_SIZE = 200
+
+DISK_CACHE_LIMIT = 200 * 1024 * 1024
+
+MEMORY_CACHE_ITEMS = 256
+
+JPEG_SUFFIXES = ('.jpg', '.jpeg', '.jpe')
+
+# The EXIF data is in the first segments of a JPEG file.
+_EXIF_READ_SIZE = 128 * 1024
+
+_THUMBNAIL_OFFSET = 0x0201
+_THUMBNAIL_LENGTH = 0x0202
+
+# (path, st_mtime_ns, st_size) of the original file.
+Key = Tuple[str, int, int]
+
+
+def exif_thumbnail(path: str) -> Optional[bytes]:
+    """ Returns the JPEG thumbnail embedded in the EXIF data, if any. """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(_EXIF_READ_SIZE)
+    except OSError:
+        return None
+    if data[:2] != b'\xff\xd8':
+        return None
+
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xff:
+        marker = data[pos + 1]
+        # Start of the image data, or end of the image.
+        if marker in (0xda, 0xd9):
+            return None
+        length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if marker == 0xe1 and data[pos + 4:pos + 10] == b'Exif\0\0':
+            try:
+                return _ifd1_thumbnail(data[pos + 10:pos + 2 + length])
+            except struct.error:
+                return None
+        pos += 2 + length
+    return None
+
+
+def _ifd1_thumbnail(tiff: bytes) -> Optional[bytes]:
+    """ The thumbnail is described by the second IFD of the TIFF header. """
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+
+    ifd0 = struct.unpack_from(endian + 'I', tiff, 4)[0]
+    count = struct.unpack_from(endian + 'H', tiff, ifd0)[0]
+    ifd1 = struct.unpack_from(endian + 'I', tiff, ifd0 + 2 + 12 * count)[0]
+    if not ifd1:
+        return None
+
+    offset = length = 0
+    count = struct.unpack_from(endian + 'H', tiff, ifd1)[0]
+    for i in range(count):
+        tag, _, _, value = struct.unpack_from(
+            endian + 'HHII', tiff, ifd1 + 2 + 12 * i)
+        if tag == _THUMBNAIL_OFFSET:
+            offset = value
+        elif tag == _THUMBNAIL_LENGTH:
+            length = value
+
+    thumbnail = tiff[offset:offset + length]
+    if not offset or len(thumbnail) != length \
+            or thumbnail[:2] != b'\xff\xd8':
+        return None
+    return thumbnail
+
+
+def make_thumbnail(path: str, size: int = THUMBNAIL_SIZE) -> QImage:
+    """ Returns a null QImage if path is not an image. """
+    if path.lower().endswith(JPEG_SUFFIXES):
+        data = exif_thumbnail(path)
+        if data:
+            image = QImage.fromData(data)
+            if not image.isNull():
+                return image
+
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    original_size = reader.size()
+    if original_size.isValid():
+        # Lets the JPEG decoder skip the full resolution.
+        reader.setScaledSize(
+            original_size.scaled(size, size, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull() or max(image.width(), image.height()) <= size:
+        return image
+    return image.scaled(size, size, Qt.KeepAspectRatio,
+                        Qt.SmoothTransformation)
+
+
+def cache_folder() -> str:
+    """ THUMBNAIL_FOLDER in $XDG_CACHE_HOME/bijibiji, or the like. """
+    base = os.environ.get('XDG_CACHE_HOME') \
+        or os.environ.get('LOCALAPPDATA') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'bijibiji', THUMBNAIL_FOLDER)
+
+
+class DiskCache:
+    """ Thumbnails on disk, shared by the worker threads. """
+
+    def __init__(self,
+                 folder: Optional[str] = None,
+                 limit: int = DISK_CACHE_LIMIT) -> None:
+        self.folder = folder or cache_folder()
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+
+    def path(self, key: Key, size: int) -> str:
+        # Absolute, the cache is shared by the roots.
+        text = f'{os.path.abspath(key[0])}\0{key[1]}\0{key[2]}\0{size}'
+        name = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, name[:2], name + '.thumb')
+
+    def load(self, key: Key, size: int) -> Optional[QImage]:
+        path = self.path(key, size)
+        image = QImage(path)
+        if image.isNull():
+            return None
+        try:
+            # The mtime of a thumbnail is its last use, for the eviction.
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def save(self, key: Key, size: int, image: QImage) -> None:
+        path = self.path(key, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image_format = 'PNG' if image.hasAlphaChannel() else 'JPG'
+        temp = f'{path}.{threading.get_ident()}.tmp'
+        if not image.save(temp, image_format):
+            return
+        os.replace(temp, path)
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, _, size in self._entries())
+            else:
+                self._total += os.path.getsize(path)
+            if self._total > self.limit:
+                self._evict()
+
+    def _entries(self) -> List[Tuple[float, str, int]]:
+        """ (last use, path, size) of every thumbnail. """
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _evict(self) -> None:
+        """ Removes the least recently used down to 90% of the limit. """
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._total = total
+
+
+class _Signals(QObject):
+    done = pyqtSignal(object, QImage)
+
+
+class _Job(QRunnable):
+    def __init__(self, key: Key, size: int, disk: DiskCache) -> None:
+        super().__init__()
+        self.key = key
+        self.size = size
+        self.disk = disk
+        self.signals = _Signals()
+
+    def run(self) -> None:
+        image = self.disk.load(self.key, self.size)
+        if image is None:
+            image = make_thumbnail(self.key[0], self.size)
+            if not image.isNull():
+                try:
+                    self.disk.save(self.key, self.size, image)
+                except OSError:
+                    pass
+        self.signals.done.emit(self.key, image)
+
+
+# noinspection PyUnresolvedReferences
+class ThumbnailCache(QObject):
+    """
+    cache.get(file) returns the QPixmap if it is in memory, otherwise
+    cache.request(file) makes it in the background and emits ready(file).
+    Only use it from the GUI thread.
+    """
+    ready = pyqtSignal(str)
+
+    def __init__(self,
+                 size: int = THUMBNAIL_SIZE,
+                 disk: Optional[DiskCache] = None,
+                 memory_items: int = MEMORY_CACHE_ITEMS,
+                 parent=None) -> None:
+        super().__init__(parent)
+        self.size = size
+        self.disk = disk or DiskCache()
+        self.memory_items = memory_items
+        # A null QPixmap for the files that are not images.
+        self._memory: Dict[Key, QPixmap] = OrderedDict()
+        self._running: Set[Key] = set()
+        self.pool = QThreadPool.globalInstance()
+
+    @staticmethod
+    def key(file: str) -> Optional[Key]:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+        return file, stat.st_mtime_ns, stat.st_size
+
+    def get(self, file: str) -> Optional[QPixmap]:
+        """ None if not in memory, a null QPixmap if it is not an image. """
+        key = self.key(file)
+        pixmap = self._memory.get(key)
+        if pixmap is not None:
+            self._memory.move_to_end(key)
+        return pixmap
+
+    def request(self, file: str) -> None:
+        key = self.key(file)
+        if key is None or key in self._memory or key in self._running:
+            return
+        self._running.add(key)
+        job = _Job(key, self.size, self.disk)
+        job.signals.done.connect(self._done)
+        self.pool.start(job)
+
+    def _done(self, key: Key, image: QImage) -> None:
+        self._running.discard(key)
+        self._memory[key] = QPixmap.fromImage(image)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+        self.ready.emit(key[0])
@@ -0,0 +1,55 @@
+"""
+Settings of a deployment, in the JSON file CONFIG_NAME in the HOME folder,
+or in the file named by the environment variable BIJIBIJI_CONFIG, e.g.
+
+    {"db_profile": "interactive"}
+
+An environment variable BIJIBIJI_<KEY> overrides a key of the file, e.g.
+BIJIBIJI_DB_PROFILE=bulk-load. The keys not set are taken from DEFAULTS.
+"""
+import json
+import os
+from typing import Any, Dict, Optional
+
+CONFIG_NAME = 'bijibiji_config.json'
+
+DEFAULTS: Dict[str, Any] = dict(
+    # The connection profile of the database, see bijidb/profiles.py.
+    db_profile='interactive',
+    # The HOME folders with a database each, see bijibiji/roots.py,
+    # None is the HOME folder only.
+    roots=None,
+)
+
+# Absolute path -> (st_mtime_ns, settings), the file is read again when
+# it changes, or when the cwd is changed to another HOME folder.
+_cache: Dict[str, tuple] = {}
+
+
+def config_path(folder: Optional[str] = None) -> str:
+    """ The config file in folder, defaults to the cwd. """
+    path = os.environ.get('BIJIBIJI_CONFIG')
+    if path is None:
+        path = os.path.join(folder or '', CONFIG_NAME)
+    return os.path.abspath(path)
+
+
+def load_config(folder: Optional[str] = None) -> Dict[str, Any]:
+    """ The settings in the config file, without the defaults. """
+    path = config_path(folder)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    cached = _cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, encoding='utf-8') as f:
+            cached = _cache[path] = (mtime, json.load(f))
+    return cached[1]
+
+
+def get(key: str, folder: Optional[str] = None) -> Any:
+    env = os.environ.get(f'BIJIBIJI_{key.upper()}')
+    if env is not None:
+        return env
+    return load_config(folder).get(key, DEFAULTS.get(key))
@@ -0,0 +1,242 @@
+"""
+Optional instrumentation of the database and of the '.biji.json' files.
+
+Enabled by the environment variable BIJIBIJI_INSTRUMENT, or by enable()
+before the database is connected. It counts the SQL statements, commits
+and '.biji.json' reads and writes, keeps a latency histogram of each kind,
+and keeps the slowest statements with their query plans. With the
+environment variable, the report is printed to stderr at exit, or written
+as JSON to the file named by BIJIBIJI_INSTRUMENT_REPORT.
+
+    BIJIBIJI_INSTRUMENT=1 python -m bijibiji.bijitags.bijitags_manager
+
+When disabled, connect_db() opens a plain sqlite3.Connection and the
+timed() functions cost one check of a flag. The time of a SELECT is the
+time of execute(), fetching the rows is not included. Each process has
+its own statistics, the worker processes of the scanner are not counted.
+"""
+import atexit
+import bisect
+import functools
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, TextIO
+
+# Upper bounds of the buckets of the latency histograms, in milliseconds.
+BUCKETS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000]
+
+# A statement slower than this is kept with its query plan.
+SLOW_MS = 50
+
+# Number of slow statements kept.
+SLOW_ITEMS = 20
+
+_SPACES = re.compile(r'\s+')
+
+
+class Stats:
+    def __init__(self, slow_ms: float = SLOW_MS) -> None:
+        self.enabled = False
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.time()
+        # kind -> [count, total seconds, histogram]
+        self.kinds: Dict[str, list] = {}
+        # normalized SQL -> [count, total seconds, max seconds]
+        self.statements: Dict[str, list] = {}
+        # [seconds, sql, query plan], the slowest first
+        self.slow: List[list] = []
+
+    def record(self,
+               kind: str,
+               seconds: float,
+               sql: Optional[str] = None) -> None:
+        bucket = bisect.bisect_left(BUCKETS, seconds * 1000)
+        with self._lock:
+            stat = self.kinds.get(kind)
+            if stat is None:
+                stat = self.kinds[kind] = [0, 0.0, [0] * (len(BUCKETS) + 1)]
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2][bucket] += 1
+            if sql is None:
+                return
+            stat = self.statements.get(sql)
+            if stat is None:
+                stat = self.statements[sql] = [0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+
+    def is_slow(self, seconds: float) -> bool:
+        if seconds * 1000 < self.slow_ms:
+            return False
+        return len(self.slow) < SLOW_ITEMS or seconds > self.slow[-1][0]
+
+    def add_slow(self, seconds: float, sql: str, plan: List[str]) -> None:
+        with self._lock:
+            self.slow.append([seconds, sql, plan])
+            self.slow.sort(key=lambda item: -item[0])
+            del self.slow[SLOW_ITEMS:]
+
+    def report(self) -> dict:
+        labels = [f'<{bound}ms' for bound in BUCKETS] \
+            + [f'>={BUCKETS[-1]}ms']
+        with self._lock:
+            return dict(
+                seconds=time.time() - self.started,
+                kinds={kind: dict(count=count,
+                                  seconds=total,
+                                  histogram=dict(zip(labels, histogram)))
+                       for kind, (count, total, histogram)
+                       in sorted(self.kinds.items())},
+                statements=[dict(sql=sql, count=count,
+                                 seconds=total, max_seconds=longest)
+                            for sql, (count, total, longest) in sorted(
+                                self.statements.items(),
+                                key=lambda item: -item[1][1])],
+                slow=[dict(sql=sql, seconds=seconds, plan=plan)
+                      for seconds, sql, plan in self.slow],
+            )
+
+
+STATS = Stats()
+
+
+def normalize(sql: str) -> str:
+    return _SPACES.sub(' ', sql).strip()
+
+
+def timed(kind: str) -> Callable[[Callable], Callable]:
+    """ Records the calls of the decorated function as kind. """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not STATS.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STATS.record(kind, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class Connection(sqlite3.Connection):
+    """ The factory of sqlite3.connect() when instrumented. """
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            seconds = time.perf_counter() - start
+            STATS.record('execute', seconds, normalize(sql))
+            if STATS.is_slow(seconds):
+                STATS.add_slow(seconds, normalize(sql),
+                               self.query_plan(sql, parameters))
+
+    def executemany(self, sql: str, seq_of_parameters) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            seconds = time.perf_counter() - start
+            STATS.record('executemany', seconds, normalize(sql))
+            if STATS.is_slow(seconds):
+                STATS.add_slow(seconds, normalize(sql), [])
+
+    def executescript(self, sql_script: str) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            STATS.record('executescript', time.perf_counter() - start)
+
+    def commit(self) -> None:
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            STATS.record('commit', time.perf_counter() - start)
+
+    def query_plan(self, sql: str, parameters) -> List[str]:
+        try:
+            rows = super().execute(
+                f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+        except sqlite3.Error:
+            return []
+        return [row[-1] for row in rows]
+
+
+def enabled() -> bool:
+    return STATS.enabled
+
+
+def enable(slow_ms: float = SLOW_MS) -> None:
+    """ Only the connections opened after this are instrumented. """
+    STATS.slow_ms = slow_ms
+    STATS.enabled = True
+
+
+def disable() -> None:
+    STATS.enabled = False
+
+
+def connection_factory() -> type:
+    return Connection if STATS.enabled else sqlite3.Connection
+
+
+def report() -> dict:
+    return STATS.report()
+
+
+def print_report(file: TextIO = sys.stderr) -> None:
+    result = report()
+    print(f'--- bijibiji instrumentation, {result["seconds"]:.1f}s ---',
+          file=file)
+    print(f'{"":<16}{"count":>10}{"ms":>12}', file=file)
+    for kind, stat in result['kinds'].items():
+        print(f'{kind:<16}{stat["count"]:>10}{stat["seconds"] * 1000:>12.1f}',
+              file=file)
+    print('Statements by total time:', file=file)
+    for stat in result['statements'][:10]:
+        print(f'{stat["count"]:>8}{stat["seconds"] * 1000:>10.1f}ms  '
+              f'{stat["sql"][:100]}', file=file)
+    if result['slow']:
+        print('Slow statements:', file=file)
+    for stat in result['slow']:
+        print(f'{stat["seconds"] * 1000:>10.1f}ms  {stat["sql"][:100]}',
+              file=file)
+        for line in stat['plan']:
+            print(f'{"":>14}{line}', file=file)
+
+
+def dump(path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report(), f, indent=2)
+
+
+def _report_at_exit() -> None:
+    path = os.environ.get('BIJIBIJI_INSTRUMENT_REPORT')
+    if path:
+        dump(path)
+    else:
+        print_report()
+
+
+if os.environ.get('BIJIBIJI_INSTRUMENT'):
+    enable()
+    atexit.register(_report_at_exit)
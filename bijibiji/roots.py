@@ -0,0 +1,62 @@
+"""
+The roots, HOME folders with a database each, e.g. one per disk, so that
+the scans and the writes of a disk stay on it. They are listed by "roots"
+in the config of the main HOME folder (FILES_FOLDER):
+
+    {"roots": [{"name": "photos", "path": "D:/HOME"}, "E:/HOME"]}
+
+A root given as a path is named by its folder. A relative path is
+relative to the main HOME, which is not a root unless it is listed, e.g.
+as ".". Without "roots", the main HOME is the only root. The environment
+variable BIJIBIJI_ROOTS lists the paths separated by os.pathsep.
+
+The paths in a database stay relative to its root. The scanner runs the
+roots in parallel with 'python -m bijibiji.bijiscan --all-roots', and
+bijidb/federated.py queries the tags of all roots.
+"""
+import os
+from typing import List, NamedTuple
+
+from . import DB_NAME, FILES_FOLDER, config
+
+
+class Root(NamedTuple):
+    name: str
+    # Absolute.
+    path: str
+
+    @property
+    def db_path(self) -> str:
+        return os.path.join(self.path, DB_NAME)
+
+
+def _root(item, home: str) -> Root:
+    if isinstance(item, str):
+        item = dict(path=item)
+    path = os.path.normpath(os.path.join(home, item['path']))
+    return Root(item.get('name') or os.path.basename(path), path)
+
+
+def get_roots() -> List[Root]:
+    """ Raises ValueError if two roots have the same name. """
+    home = str(FILES_FOLDER)
+    items = config.get('roots', home)
+    if items is None:
+        return [Root(os.path.basename(home), home)]
+    if isinstance(items, str):
+        items = [path for path in items.split(os.pathsep) if path]
+
+    roots = [_root(item, home) for item in items]
+    names = [root.name for root in roots]
+    for name in names:
+        if names.count(name) > 1:
+            raise ValueError(f'Two roots are named {name!r}, '
+                             f'name them in the config.')
+    return roots
+
+
+def get_root(name: str) -> Root:
+    for root in get_roots():
+        if root.name == name:
+            return root
+    raise ValueError(f'Unknown root: {name}')